@@ -89,6 +89,23 @@ DATABASES = {
 }
 
 
+# Cache
+# Shared between uWSGI workers in production, e.g.
+# DJANGO_CACHE_BACKEND=django.core.cache.backends.filebased.FileBasedCache
+# DJANGO_CACHE_LOCATION=/var/tmp/klimr_cache
+# or the memcached backend with its host:port
+
+CACHES = {
+    'default': {
+        'BACKEND': os.environ.get(
+            'DJANGO_CACHE_BACKEND',
+            'django.core.cache.backends.locmem.LocMemCache'
+        ),
+        'LOCATION': os.environ.get('DJANGO_CACHE_LOCATION', 'klimr'),
+    }
+}
+
+
 # Password validation
 # https://docs.djangoproject.com/en/1.10/ref/settings/#auth-password-validators
 
@@ -142,8 +159,35 @@ REST_FRAMEWORK = {
     'PAGE_SIZE': 10
 }
 
+# Compute schedule occurrences from LessonPrototypes instead of
+# reading only materialized Lessons (see klimr_main.timetable)
+SCHEDULE_VIRTUAL_LESSONS = False
+
+# How many later records may be advised ahead of a queued one because
+# they are expected to take less time (see klimr_main.queues), 0 keeps
+# queues first come, first served
+QUEUE_MAX_OVERTAKES = 3
+
+# Where lesson state and queue changes are pushed to (see
+# klimr_main.push): LocalBroker keeps them in this process, HTTPBroker
+# POSTs them to every push server (manage.py runpush) in PUSH_SERVERS
+PUSH_BROKER = os.environ.get('DJANGO_PUSH_BROKER', 'klimr_main.push.LocalBroker')
+PUSH_SERVERS = [x for x in os.environ.get('DJANGO_PUSH_SERVERS', '').split(',') if x]
+
 INTERNAL_IPS = ['127.0.0.1']
 
 DEBUG_TOOLBAR_CONFIG = {
   'JQUERY_URL':'',
 }
+
+# Whole-semester timetable snapshots (see klimr_main.export) are written
+# to TIMETABLE_EXPORT_ROOT and sent by nginx from the internal location
+# TIMETABLE_EXPORT_ACCEL; w/o one Django sends the files itself
+TIMETABLE_EXPORT_ROOT = os.environ.get(
+    'DJANGO_TIMETABLE_EXPORT_ROOT', os.path.join(BASE_DIR, 'exports')
+)
+TIMETABLE_EXPORT_ACCEL = os.environ.get('DJANGO_TIMETABLE_EXPORT_ACCEL', '')
+
+# Olson name of the time zone lesson timings are in, sent to calendar
+# apps along with the iCalendar feeds (see klimr_main.ical)
+ICAL_TIMEZONE = os.environ.get('DJANGO_ICAL_TIMEZONE', '')
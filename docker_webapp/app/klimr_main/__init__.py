@@ -0,0 +1 @@
+default_app_config = 'klimr_main.apps.KlimrMainConfig'
@@ -3,3 +3,6 @@ from django.apps import AppConfig
 
 class KlimrMainConfig(AppConfig):
     name = 'klimr_main'
+
+    def ready(self):
+        import klimr_main.signals  # noqa
@@ -0,0 +1,29 @@
+"""
+Helpers for set-based reads and writes of many rows
+"""
+from django.db import connection
+
+# Values per `IN`, keeps lookups under SQLite's variable limit
+CHUNK_SIZE = 900
+
+
+def chunks(values, size=CHUNK_SIZE):
+    """
+    Sorted lists of at most `size` of `values`
+    """
+    values = sorted(values)
+    for i in range(0, len(values), size):
+        yield values[i:i + size]
+
+
+def insert(model, objs, batch_size):
+    """
+    bulk_create w/ `batch_size` rows per INSERT at most
+    """
+    # Django 1.10 lets an explicit batch_size exceed what the backend
+    # takes (SQLite: 999 variables per statement)
+    fields = [x for x in model._meta.concrete_fields if not x.primary_key]
+    batch_size = max(1, min(
+        batch_size, connection.ops.bulk_batch_size(fields, objs) or batch_size
+    ))
+    model.objects.bulk_create(objs, batch_size=batch_size)
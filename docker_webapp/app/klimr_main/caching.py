@@ -0,0 +1,179 @@
+"""
+Version counters for models kept in the shared cache (bumped by
+klimr_main.signals on every change), plus conditional GET and response
+caching keyed by them
+"""
+import functools
+import hashlib
+import time
+from django.core.cache import cache
+from django.utils.cache import get_conditional_response
+from django.utils.http import quote_etag
+from rest_framework.response import Response
+
+VERSION_KEY = 'klimr:version:%s'
+HITS_KEY = 'klimr:response:hits'
+MISSES_KEY = 'klimr:response:misses'
+
+
+def _incr(key, initial=0):
+    try:
+        return cache.incr(key)
+    except ValueError:
+        # Missing (or evicted) counter. add() loses to a concurrent
+        # writer gracefully, so incr() again after it
+        cache.add(key, initial, None)
+        return cache.incr(key)
+
+
+def _initial_version():
+    # Start counters from the clock, so one evicted from the cache
+    # doesn't come back with a version old responses are cached under
+    return int(time.time() * 1000)
+
+
+def bump_counter(key):
+    """
+    Increment a version counter that isn't tied to a model
+    """
+    return _incr(key, _initial_version())
+
+
+def bump_version(model):
+    """
+    Call after changing rows of `model` w/o signals (bulk_create,
+    update(), raw SQL), signals take care of everything else
+    """
+    return bump_counter(VERSION_KEY % model._meta.label_lower)
+
+
+def _get_counters(keys, initial):
+    values = cache.get_many(keys)
+    for key in keys:
+        if key not in values:
+            cache.add(key, initial(), None)
+            values[key] = cache.get(key)
+    return tuple(values[x] for x in keys)
+
+
+def get_counter(key):
+    return _get_counters([key], _initial_version)[0]
+
+
+def get_counters(keys):
+    """
+    Current values of the counters `keys` in one cache round-trip
+    """
+    return _get_counters(list(keys), _initial_version)
+
+
+def get_versions(*models):
+    """
+    Current version counters of `models` in one cache round-trip
+    """
+    return _get_counters(
+        [VERSION_KEY % x._meta.label_lower for x in models], _initial_version
+    )
+
+
+def get_stats():
+    stats = cache.get_many([HITS_KEY, MISSES_KEY])
+    return {
+        'hits': stats.get(HITS_KEY, 0),
+        'misses': stats.get(MISSES_KEY, 0),
+    }
+
+
+def conditional(method):
+    """
+    Wrap a viewset action with ConditionalGetMixin.get_conditional_response
+    """
+    @functools.wraps(method)
+    def wrapper(self, request, *args, **kwargs):
+        return self.get_conditional_response(
+            functools.partial(method, self), request, *args, **kwargs
+        )
+    return wrapper
+
+
+class ConditionalGetMixin(object):
+    """
+    ETag for GET actions, derived from the version counters of
+    `cache_models` (the viewset's model by default) and the full URL.
+    A matching If-None-Match gets a 304 before the action runs, so
+    nothing is queried or serialized. There is no Last-Modified: with
+    its one-second resolution a change within the second of the
+    previous response would go unnoticed by If-Modified-Since.
+    """
+    cache_models = ()
+
+    def get_cache_models(self):
+        return self.cache_models or (self.get_queryset().model, )
+
+    def get_etag_extra(self, request):
+        """
+        Anything besides the URL and the models the response depends on
+        """
+        return ''
+
+    def get_etag(self, request):
+        key = '%s|%s|%s|%s' % (
+            self.__class__.__name__,
+            request.get_full_path(),
+            self.get_etag_extra(request),
+            ','.join(str(x) for x in get_versions(*self.get_cache_models()))
+        )
+        return hashlib.md5(key.encode('utf-8')).hexdigest()
+
+    def get_conditional_response(self, handler, request, *args, **kwargs):
+        if request.method != 'GET' or getattr(request, 'etag', None):
+            return handler(request, *args, **kwargs)
+        request.etag = self.get_etag(request)
+        response = get_conditional_response(request, etag=request.etag)
+        if response is None:
+            response = handler(request, *args, **kwargs)
+        if response.status_code in (200, 304):
+            response['ETag'] = quote_etag(request.etag)
+        return response
+
+
+class CachedResponseMixin(ConditionalGetMixin):
+    """
+    Cache the data of successful list/retrieve responses, keyed by the
+    same ETag ConditionalGetMixin produces. Any change to `cache_models`
+    bumps a counter, so stale entries are never read again and just
+    expire. Other GET actions can use get_cached_response() directly.
+    """
+    cache_timeout = 60 * 60
+
+    def get_cache_key(self, request):
+        etag = getattr(request, 'etag', None) or self.get_etag(request)
+        return 'klimr:response:' + etag
+
+    def get_cached_response(self, handler, request, *args, **kwargs):
+        return self.get_conditional_response(
+            functools.partial(self._get_cached_response, handler),
+            request, *args, **kwargs
+        )
+
+    def _get_cached_response(self, handler, request, *args, **kwargs):
+        key = self.get_cache_key(request)
+        data = cache.get(key)
+        if data is not None:
+            _incr(HITS_KEY)
+            return Response(data)
+        _incr(MISSES_KEY)
+        response = handler(request, *args, **kwargs)
+        if response.status_code == 200:
+            cache.set(key, response.data, self.cache_timeout)
+        return response
+
+    def list(self, request, *args, **kwargs):
+        return self.get_cached_response(
+            super(CachedResponseMixin, self).list, request, *args, **kwargs
+        )
+
+    def retrieve(self, request, *args, **kwargs):
+        return self.get_cached_response(
+            super(CachedResponseMixin, self).retrieve, request, *args, **kwargs
+        )
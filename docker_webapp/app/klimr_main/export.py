@@ -0,0 +1,224 @@
+"""
+Whole-semester timetable snapshots for offline clients.
+
+A snapshot is a JSON file in settings.TIMETABLE_EXPORT_ROOT, written
+once per version of the semester's lessons and served by nginx
+(X-Accel-Redirect to settings.TIMETABLE_EXPORT_ACCEL) instead of being
+paged through the API. Its layout:
+
+    {"semester": ID, "start_on": "YYYY-MM-DD", "version": "...",
+     "timings": [[id, "HH:MM:SS", "HH:MM:SS"], ...],
+     "disciplines": [[id, name], ...],
+     "teachers": [[id, last name, first name, middle name], ...],
+     "classrooms": [[id, name], ...],
+     "subgroups": [[id, name, group name], ...],
+     "lessons": [[id, day, start, end, discipline, teacher, classroom,
+                  state, subgroup, ...], ...]}
+
+`day` counts days from start_on; start and end (timings), discipline,
+teacher, classroom and the trailing subgroups are indexes into the
+lists above.
+
+Every semester has its own version counter, bumped by
+klimr_main.signals (and timetable.materialize_semester) when one of its
+lessons changes, so a change rewrites only that semester's snapshot.
+Changes to the dictionaries (names of disciplines, teachers, ...) are
+rare and rewrite every snapshot.
+"""
+import glob
+import hashlib
+import json
+import os
+import tempfile
+import time
+from django.conf import settings
+from django.core.cache import cache
+from klimr_main import bulk, caching
+from klimr_main.models import Semester, LessonTiming, Person, Subgroup, \
+    GroupSemesterState, Teacher, Discipline, Classroom, Lesson
+
+SEMESTER_VERSION_KEY = 'klimr:export:semester:%d'
+LOCK_KEY = 'klimr:export:lock:%d'
+# Models the dictionaries are built from
+DICTIONARY_MODELS = (Semester, LessonTiming, Person, Subgroup, GroupSemesterState,
+                     Teacher, Discipline, Classroom)
+# Longest a snapshot is expected to take to write
+LOCK_TIMEOUT = 60
+# How long a request waits for another process writing the first
+# snapshot of a semester, and how often it checks
+WAIT_TIMEOUT = 10
+WAIT_INTERVAL = 0.2
+
+
+class ExportBusy(Exception):
+    """
+    The first snapshot of a semester is being written by another process
+    """
+
+
+def get_root():
+    return getattr(
+        settings, 'TIMETABLE_EXPORT_ROOT', os.path.join(settings.BASE_DIR, 'exports')
+    )
+
+
+def touch_dates(dates):
+    """
+    Bump the version of the semesters `dates` fall into
+    """
+    dates = set(dates)
+    if not dates:
+        return
+    semesters = Semester.objects.filter(
+        start_on__lte=max(dates), session_end_on__gte=min(dates)
+    ).values_list('id', 'start_on', 'session_end_on')
+    for pk, start_on, end_on in semesters:
+        if any(start_on <= x <= end_on for x in dates):
+            touch(pk)
+
+
+def touch(semester_id):
+    caching.bump_counter(SEMESTER_VERSION_KEY % semester_id)
+
+
+def get_version(semester):
+    versions = caching.get_versions(*DICTIONARY_MODELS) + (
+        caching.get_counter(SEMESTER_VERSION_KEY % semester.pk),
+    )
+    return hashlib.md5(','.join(str(x) for x in versions).encode('ascii')).hexdigest()[:16]
+
+
+def _index(rows):
+    """
+    (rows, {id: index in rows}) of rows ordered by id
+    """
+    rows = sorted(rows, key=lambda x: x[0])
+    return [list(x) for x in rows], {x[0]: i for i, x in enumerate(rows)}
+
+
+def build(semester, version=''):
+    """
+    Snapshot of `semester` as a dict
+    """
+    lessons = Lesson.objects.filter(
+        date__gte=semester.start_on, date__lte=semester.session_end_on
+    )
+    rows = list(lessons.order_by('date', 'start_time__start', 'id').values_list(
+        'id', 'date', 'start_time_id', 'end_time_id', 'discipline_id',
+        'teacher_id', 'classroom_id', 'state'
+    ))
+    links = {}
+    for lesson, subgroup in Lesson.groups.through.objects.filter(
+            lesson__in=lessons
+    ).values_list('lesson_id', 'subgroup_id'):
+        links.setdefault(lesson, []).append(subgroup)
+
+    def lookup(queryset, ids, *fields):
+        result = []
+        for chunk in bulk.chunks(ids):
+            result.extend(queryset.filter(pk__in=chunk).values_list('id', *fields))
+        return _index(result)
+
+    timings, timing_index = lookup(
+        LessonTiming.objects, {x[2] for x in rows} | {x[3] for x in rows}, 'start', 'end'
+    )
+    timings = [[x, y.isoformat(), z.isoformat()] for x, y, z in timings]
+    disciplines, discipline_index = lookup(
+        Discipline.objects, {x[4] for x in rows}, 'name'
+    )
+    teachers, teacher_index = lookup(
+        Teacher.objects, {x[5] for x in rows},
+        'person__last_name', 'person__first_name', 'person__middle_name'
+    )
+    classrooms, classroom_index = lookup(Classroom.objects, {x[6] for x in rows}, 'name')
+    subgroups, subgroup_index = lookup(
+        Subgroup.objects, set().union(*links.values()), 'name', 'group__name'
+    )
+    return {
+        'semester': semester.pk,
+        'start_on': semester.start_on.isoformat(),
+        'version': version,
+        'timings': timings,
+        'disciplines': disciplines,
+        'teachers': teachers,
+        'classrooms': classrooms,
+        'subgroups': subgroups,
+        'lessons': [
+            [pk, (date - semester.start_on).days, timing_index[start], timing_index[end],
+             discipline_index[discipline], teacher_index[teacher],
+             classroom_index[classroom], state] +
+            sorted(subgroup_index[x] for x in links.get(pk, ()))
+            for pk, date, start, end, discipline, teacher, classroom, state in rows
+        ],
+    }
+
+
+def get_name(semester, version):
+    return 'timetable-%d-%s.json' % (semester.pk, version)
+
+
+def _get_names(semester):
+    """
+    {version: file name} of the snapshots of `semester` on disk
+    """
+    prefix = 'timetable-%d-' % semester.pk
+    return {
+        os.path.basename(x)[len(prefix):-len('.json')]: os.path.basename(x)
+        for x in glob.glob(os.path.join(get_root(), prefix + '*.json'))
+    }
+
+
+def _write(semester, version):
+    root = get_root()
+    os.makedirs(root, exist_ok=True)
+    data = build(semester, version)
+    with tempfile.NamedTemporaryFile('w', dir=root, suffix='.tmp', delete=False) as f:
+        json.dump(data, f, separators=(',', ':'), ensure_ascii=False)
+    # Readable by nginx, NamedTemporaryFile creates files as 0600
+    os.chmod(f.name, 0o644)
+    os.replace(f.name, os.path.join(root, get_name(semester, version)))
+
+
+def _remove_old(semester, keep):
+    # Recently replaced ones may still be being sent by nginx
+    now = time.time()
+    for name in _get_names(semester).values():
+        path = os.path.join(get_root(), name)
+        try:
+            if name != keep and os.path.getmtime(path) < now - LOCK_TIMEOUT:
+                os.remove(path)
+        except OSError:
+            # Removed concurrently
+            pass
+
+
+def get_export(semester):
+    """
+    (file name in the export root, version) of the current snapshot of
+    `semester`, written first if needed. While another process writes
+    it, the previous snapshot is returned if there is one; if there is
+    none, waits up to WAIT_TIMEOUT for the writer and raises ExportBusy.
+    """
+    version = get_version(semester)
+    name = get_name(semester, version)
+    path = os.path.join(get_root(), name)
+    deadline = time.time() + WAIT_TIMEOUT
+    while not os.path.exists(path):
+        if cache.add(LOCK_KEY % semester.pk, version, LOCK_TIMEOUT):
+            try:
+                if not os.path.exists(path):
+                    _write(semester, version)
+                    _remove_old(semester, name)
+            finally:
+                cache.delete(LOCK_KEY % semester.pk)
+            break
+        previous = _get_names(semester)
+        if previous:
+            version = max(previous, key=lambda x: os.path.getmtime(
+                os.path.join(get_root(), previous[x])
+            ))
+            return previous[version], version
+        if time.time() >= deadline:
+            raise ExportBusy
+        time.sleep(WAIT_INTERVAL)
+    return name, version
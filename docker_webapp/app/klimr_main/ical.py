@@ -0,0 +1,273 @@
+"""
+iCalendar (RFC 5545) feeds of the lessons of a subgroup, a teacher or a
+classroom.
+
+Every LessonPrototype becomes one recurring event per semester it takes
+place in: an RRULE (weekly, or every other week) from its first to its
+last occurrence, with an EXDATE for every day in between it doesn't
+take place on (holidays, the test week) or whose stored Lesson was
+cancelled or changed. Only Lessons that differ from their prototype (or
+have none) become events of their own, so a feed of a whole year stays
+a few kilobytes.
+
+LessonTiming has no time zone, so times are floating (local);
+ICAL_TIMEZONE is sent as X-WR-TIMEZONE to the clients that honour it.
+
+Calendar apps refetch feeds every few minutes. A feed's version is made
+of the counters of the rarely changing models it's built from and a
+counter of the feed itself, bumped by klimr_main.signals when one of its
+lessons changes, so e.g. lesson state updates during the day don't
+invalidate every feed.
+"""
+import datetime
+import hashlib
+from collections import namedtuple
+from django.conf import settings
+from django.core.cache import cache
+from django.utils import timezone
+from klimr_main import caching, timetable
+from klimr_main.models import Semester, Holiday, LessonTiming, Person, \
+    Teacher, Discipline, Classroom, Subgroup, LessonPrototype, Lesson
+
+# kind: (model, field of Lesson and LessonPrototype it filters on)
+FEEDS = {
+    'subgroup': (Subgroup, 'groups'),
+    'teacher': (Teacher, 'teacher'),
+    'classroom': (Classroom, 'classroom'),
+}
+FEED_KEY = 'klimr:ical:%s:%d'
+CONTENT_KEY = 'klimr:ical:content:%s'
+# Changes to these rewrite every feed
+FEED_MODELS = (Semester, Holiday, LessonTiming, Person, Teacher, Discipline,
+               Classroom, LessonPrototype)
+CACHE_TIMEOUT = 60 * 60
+
+COLUMNS = (
+    'id', 'start_time_id', 'end_time_id', 'discipline_id', 'teacher_id',
+    'classroom_id', 'start_time__start', 'end_time__end', 'discipline__name',
+    'teacher__person__last_name', 'teacher__person__first_name',
+    'teacher__person__middle_name', 'classroom__name',
+)
+# Fields a stored Lesson has to share with its prototype to be covered
+# by the prototype's RRULE
+EVENT_FIELDS = ('start_time_id', 'end_time_id', 'discipline_id', 'teacher_id', 'classroom_id')
+FIELDS = EVENT_FIELDS + ('start', 'end', 'discipline', 'last_name', 'first_name',
+                         'middle_name', 'classroom')
+# Lesson fields the feeds depend on, besides being cancelled
+LESSON_FIELDS = ('date', 'teacher_id', 'classroom_id', 'start_time_id', 'end_time_id',
+                 'discipline_id', 'prototype_id')
+PrototypeRow = namedtuple('PrototypeRow', ('id', ) + FIELDS + ('day_of_week', 'weektype'))
+LessonRow = namedtuple('LessonRow', ('id', ) + FIELDS + ('date', 'state', 'prototype_id'))
+
+
+def touch(kind, ids):
+    for pk in set(ids):
+        if pk is not None:
+            caching.bump_counter(FEED_KEY % (kind, pk))
+
+
+def lesson_key(values, state):
+    """
+    What the feeds show of a lesson with `values` of LESSON_FIELDS
+    """
+    return tuple(values) + (state == Lesson.CANCELLED, )
+
+
+def touch_lesson(lesson, old=None):
+    """
+    Bump the feeds of `lesson` after it was saved, unless nothing they
+    show changed (`old` is its lesson_key() before). Subgroups added
+    later are bumped on Lesson.groups changes.
+    """
+    new = lesson_key((getattr(lesson, x) for x in LESSON_FIELDS), lesson.state)
+    if new == old:
+        return
+    touch('subgroup', lesson.groups.values_list('id', flat=True))
+    touch('teacher', [lesson.teacher_id] + ([old[1]] if old else []))
+    touch('classroom', [lesson.classroom_id] + ([old[2]] if old else []))
+
+
+def get_version(kind, pk):
+    # Semesters that are over drop out of _semesters() at midnight
+    today = timezone.localtime(timezone.now()).date()
+    versions = caching.get_versions(*FEED_MODELS) + (
+        caching.get_counter(FEED_KEY % (kind, pk)), today,
+        getattr(settings, 'ICAL_TIMEZONE', '')
+    )
+    key = '%s|%d|%s' % (kind, pk, ','.join(str(x) for x in versions))
+    return hashlib.md5(key.encode('utf-8')).hexdigest()
+
+
+def escape(text):
+    return text.replace('\\', '\\\\').replace(';', '\\;').replace(',', '\\,') \
+        .replace('\n', '\\n')
+
+
+def fold(line):
+    """
+    `line` with CRLF, folded into lines of at most 75 octets (not
+    splitting UTF-8 sequences)
+    """
+    data = line.encode('utf-8')
+    parts = []
+    limit = 75
+    while len(data) > limit:
+        cut = limit
+        # Continuation bytes are 10xxxxxx
+        while data[cut] & 0xC0 == 0x80:
+            cut -= 1
+        parts.append(data[:cut])
+        data = data[cut:]
+        # The leading space of continuation lines counts too
+        limit = 74
+    parts.append(data)
+    return b'\r\n '.join(parts).decode('utf-8') + '\r\n'
+
+
+def _datetime(day, time):
+    return datetime.datetime.combine(day, time).strftime('%Y%m%dT%H%M%S')
+
+
+def _event(uid, stamp, row, day, rule=()):
+    lines = [
+        'BEGIN:VEVENT',
+        'UID:%s@klimr' % uid,
+        'DTSTAMP:' + stamp,
+        'DTSTART:' + _datetime(day, row.start),
+        'DTEND:' + _datetime(day, row.end),
+    ]
+    lines.extend(rule)
+    teacher = ' '.join(x for x in (row.last_name, row.first_name, row.middle_name) if x)
+    lines.extend([
+        'SUMMARY:' + escape(row.discipline),
+        'LOCATION:' + escape(row.classroom),
+        'DESCRIPTION:' + escape(teacher),
+        'END:VEVENT',
+    ])
+    return ''.join(fold(x) for x in lines)
+
+
+def _rule(prototype, semester, days, excluded, stamp):
+    """
+    Event of `prototype` taking place on `days` of `semester`, except
+    the `excluded` ones
+    """
+    days = sorted(set(days) - excluded)
+    uid = 'prototype-%d-%d' % (prototype.id, semester.id)
+    if len(days) < 2:
+        return ''.join(_event(uid, stamp, prototype, x) for x in days)
+    step = datetime.timedelta(weeks=1 if prototype.weektype == 0 else 2)
+    first, last = days[0], days[-1]
+    rule = ['RRULE:FREQ=WEEKLY;INTERVAL=%d;UNTIL=%s' % (
+        step.days // 7, _datetime(last, prototype.start)
+    )]
+    exdates = []
+    day, days = first, set(days)
+    while day <= last:
+        if day not in days:
+            exdates.append(_datetime(day, prototype.start))
+        day += step
+    if exdates:
+        rule.append('EXDATE:' + ','.join(exdates))
+    return _event(uid, stamp, prototype, first, rule)
+
+
+def _semesters(stored):
+    """
+    (semester, ids of prototypes it has lessons of) pairs. A prototype
+    takes place in every semester that isn't over yet, but only in the
+    past ones it has stored lessons in: it may not have existed back
+    then.
+    """
+    today = timezone.localtime(timezone.now()).date()
+    for semester in Semester.objects.order_by('start_on'):
+        if semester.session_end_on >= today:
+            yield semester, None
+            continue
+        prototypes = {
+            x for x, y in stored if semester.start_on <= y <= semester.session_end_on
+        }
+        if prototypes:
+            yield semester, prototypes
+
+
+def events(kind, pk, stamp):
+    """
+    VEVENTs of the feed, one string per event
+    """
+    field = FEEDS[kind][1]
+    prototypes = LessonPrototype.objects.filter(**{field: pk})
+    rows = [PrototypeRow(*x) for x in prototypes.order_by('id').values_list(
+        *COLUMNS + ('day_of_week', 'weektype')
+    )]
+    lessons = [LessonRow(*x) for x in Lesson.objects.filter(**{field: pk}).order_by(
+        'date', 'start_time__start', 'id'
+    ).values_list(*COLUMNS + ('date', 'state', 'prototype_id'))]
+    # Stored occurrences of the prototypes, in the feed or not (e.g. the
+    # lesson was moved to another classroom)
+    stored = set(Lesson.objects.filter(prototype__in=prototypes).order_by().values_list(
+        'prototype_id', 'date'
+    ))
+    by_key = {(x.prototype_id, x.date): x for x in lessons if x.prototype_id is not None}
+    covered = set()
+    for semester, used in _semesters(stored):
+        occurrences = {}
+        for prototype, day in timetable.expand(semester, [
+                x for x in rows if used is None or x.id in used
+        ]):
+            occurrences.setdefault(prototype, []).append(day)
+        for prototype, days in occurrences.items():
+            excluded = set()
+            for day in days:
+                key = (prototype.id, day)
+                if key not in stored:
+                    continue
+                lesson = by_key.get(key)
+                if lesson is not None and lesson.state != Lesson.CANCELLED and all(
+                    getattr(lesson, x) == getattr(prototype, x) for x in EVENT_FIELDS
+                ):
+                    covered.add(key)
+                else:
+                    excluded.add(day)
+            event = _rule(prototype, semester, days, excluded, stamp)
+            if event:
+                yield event
+    for lesson in lessons:
+        if lesson.state != Lesson.CANCELLED and (lesson.prototype_id, lesson.date) not in covered:
+            yield _event('lesson-%d' % lesson.id, stamp, lesson, lesson.date)
+
+
+def generate(kind, obj):
+    """
+    The feed of `obj` as chunks of text
+    """
+    stamp = timezone.now().astimezone(datetime.timezone.utc).strftime('%Y%m%dT%H%M%SZ')
+    header = [
+        'BEGIN:VCALENDAR',
+        'VERSION:2.0',
+        'PRODID:-//klimr//timetable//EN',
+        'CALSCALE:GREGORIAN',
+        'X-WR-CALNAME:' + escape(str(obj)),
+    ]
+    if getattr(settings, 'ICAL_TIMEZONE', ''):
+        header.append('X-WR-TIMEZONE:' + settings.ICAL_TIMEZONE)
+    yield ''.join(fold(x) for x in header)
+    for event in events(kind, obj.pk, stamp):
+        yield event
+    yield fold('END:VCALENDAR')
+
+
+def get_cached(version):
+    return cache.get(CONTENT_KEY % version)
+
+
+def cached(version, chunks):
+    """
+    Yield `chunks`, caching the whole feed under `version` once they
+    have all been sent
+    """
+    content = []
+    for chunk in chunks:
+        content.append(chunk)
+        yield chunk
+    cache.set(CONTENT_KEY % version, ''.join(content), CACHE_TIMEOUT)
@@ -0,0 +1,82 @@
+import datetime
+import time
+from django.core.management.base import BaseCommand
+from django.db import transaction
+from klimr_main import models
+from klimr_main.timetable import materialize_semester
+
+
+class Command(BaseCommand):
+    help = ('Time materialize_semester on a synthetic timetable. '
+            'Everything is created in a transaction that is rolled back.')
+
+    def add_arguments(self, parser):
+        parser.add_argument('--prototypes', type=int, default=10000)
+        parser.add_argument('--batch-size', type=int, default=2000)
+
+    def handle(self, *args, **options):
+        with transaction.atomic():
+            semester = self.populate(options['prototypes'])
+            started = time.time()
+            created = materialize_semester(
+                semester,
+                models.LessonPrototype.objects.filter(discipline__name='bench'),
+                batch_size=options['batch_size']
+            )
+            elapsed = time.time() - started
+            started = time.time()
+            again = materialize_semester(
+                semester,
+                models.LessonPrototype.objects.filter(discipline__name='bench')
+            )
+            rerun = time.time() - started
+            transaction.set_rollback(True)
+        self.stdout.write(
+            '%d prototypes -> %d lessons in %.2fs (%.0f lessons/s), '
+            'idempotent rerun created %d in %.2fs' % (
+                options['prototypes'], created, elapsed,
+                created / elapsed if elapsed else 0, again, rerun
+            )
+        )
+
+    def populate(self, count):
+        start = datetime.date(2100, 9, 1)
+        semester = models.Semester.objects.create(
+            start_on=start,
+            test_week_on=start + datetime.timedelta(weeks=8),
+            test_week_end_on=start + datetime.timedelta(weeks=8, days=6),
+            session_on=start + datetime.timedelta(weeks=18),
+            session_end_on=start + datetime.timedelta(weeks=21),
+        )
+        department = models.Department.objects.create(name='bench')
+        course = models.Course.objects.create(name='bench', description='', department=department)
+        group = models.Group.objects.create(course=course)
+        state = models.GroupSemesterState.objects.create(name='bench', group=group, semester=semester)
+        person = models.Person.objects.create(first_name='bench', middle_name='', last_name='')
+        teacher = models.Teacher.objects.create(person=person, department=department)
+        discipline = models.Discipline.objects.create(name='bench', description='')
+        classroom = models.Classroom.objects.create(name='bench', comments='')
+        timing, _ = models.LessonTiming.objects.get_or_create(
+            start=datetime.time(0, 0), end=datetime.time(0, 1)
+        )
+        # 36 lessons a week per subgroup
+        subgroups = [
+            models.Subgroup.objects.create(name=str(i), group=state, primary=True)
+            for i in range(count // 36 + 1)
+        ]
+        models.LessonPrototype.objects.bulk_create(
+            models.LessonPrototype(
+                day_of_week=i % 6, weektype=i % 3,
+                start_time=timing, end_time=timing,
+                discipline=discipline, teacher=teacher, classroom=classroom
+            )
+            for i in range(count)
+        )
+        Links = models.LessonPrototype.groups.through
+        Links.objects.bulk_create(
+            Links(lessonprototype_id=pk, subgroup=subgroups[i // 36])
+            for i, pk in enumerate(models.LessonPrototype.objects.filter(
+                discipline=discipline
+            ).order_by('id').values_list('id', flat=True))
+        )
+        return semester
@@ -0,0 +1,70 @@
+import datetime
+import json
+import time
+from django.core.management.base import BaseCommand
+from django.db import transaction
+from django.test import Client
+from klimr_main import models
+
+
+class Command(BaseCommand):
+    help = ('Time POSTing measurements to /api/measurement/bulk/ as '
+            'NDJSON. Data is created in a transaction that is rolled back.')
+
+    def add_arguments(self, parser):
+        parser.add_argument('--count', type=int, default=100000)
+        parser.add_argument('--per-lesson', type=int, default=100)
+        parser.add_argument('--batch-size', type=int, default=1000)
+
+    def populate(self, count, per_lesson):
+        department = models.Department.objects.create(name='bench')
+        timing = models.LessonTiming.objects.create(
+            start=datetime.time(8, 30), end=datetime.time(10, 0)
+        )
+        person = models.Person.objects.create(
+            first_name='bench', middle_name='bench', last_name='bench'
+        )
+        student = models.Student.objects.create(person=person)
+        discipline = models.Discipline.objects.create(name='bench', description='')
+        teacher = models.Teacher.objects.create(person=person, department=department)
+        classroom = models.Classroom.objects.create(name='bench', comments='')
+        start = datetime.date(2017, 9, 4)
+        models.Lesson.objects.bulk_create([
+            models.Lesson(
+                date=start + datetime.timedelta(days=i), start_time=timing,
+                end_time=timing, discipline=discipline, teacher=teacher,
+                classroom=classroom, state=0
+            )
+            for i in range((count + per_lesson - 1) // per_lesson)
+        ])
+        lessons = models.Lesson.objects.filter(discipline=discipline).values_list('id', flat=True)
+        models.QueueRecord.objects.bulk_create([
+            models.QueueRecord(student=student, lesson_id=lesson, reason=i % 3)
+            for lesson in lessons for i in range(per_lesson)
+        ])
+        records = models.QueueRecord.objects.filter(
+            student=student
+        ).values_list('id', 'lesson_id').order_by('id')[:count]
+        return [
+            {'user': person.pk, 'lesson': lesson, 'record': record, 'time': i % per_lesson * 120}
+            for i, (record, lesson) in enumerate(records)
+        ]
+
+    def handle(self, *args, **options):
+        with transaction.atomic():
+            items = self.populate(options['count'], options['per_lesson'])
+            body = '\n'.join(json.dumps(x) for x in items)
+            client = Client(HTTP_HOST='127.0.0.1')
+            started = time.time()
+            response = client.post(
+                '/api/measurement/bulk/?batch_size=%d' % options['batch_size'],
+                body, content_type='application/x-ndjson'
+            )
+            elapsed = time.time() - started
+            result = response.json()
+            self.stdout.write('%d measurements (%d bytes): %d created, %d errors in %.2fs, %.0f/s' % (
+                len(items), len(body), result['created'], len(result['errors']),
+                elapsed, len(items) / elapsed
+            ))
+            self.stdout.write('%d ServiceTimeStats rows' % models.ServiceTimeStats.objects.count())
+            transaction.set_rollback(True)
@@ -0,0 +1,84 @@
+import datetime
+import random
+import time
+from django.core.management.base import BaseCommand
+from django.db import transaction
+from klimr_main import models, occupancy, timetable
+
+
+class Command(BaseCommand):
+    help = ('Time free classroom lookups over a synthetic semester. Everything '
+            'is created in a transaction that is rolled back.')
+
+    def add_arguments(self, parser):
+        parser.add_argument('--classrooms', type=int, default=500)
+        parser.add_argument('--prototypes', type=int, default=5000)
+        parser.add_argument('--queries', type=int, default=1000)
+
+    def populate(self, options, rng):
+        department = models.Department.objects.create(name='Bench')
+        semester = models.Semester.objects.create(
+            start_on=datetime.date(2030, 9, 2), test_week_on=datetime.date(2030, 10, 28),
+            test_week_end_on=datetime.date(2030, 11, 3), session_on=datetime.date(2030, 12, 30),
+            session_end_on=datetime.date(2031, 1, 19)
+        )
+        timings = [
+            models.LessonTiming.objects.get_or_create(
+                start=datetime.time(8 + i, 30), end=datetime.time(9 + i, 59)
+            )[0]
+            for i in range(7)
+        ]
+        models.Classroom.objects.bulk_create(
+            models.Classroom(name='B%d' % i, comments='', classroom_type=i % 5)
+            for i in range(options['classrooms'])
+        )
+        classrooms = list(models.Classroom.objects.order_by('-id')[:options['classrooms']])
+        teacher = models.Teacher.objects.create(
+            person=models.Person.objects.create(first_name='B', middle_name='B', last_name='B'),
+            department=department
+        )
+        discipline = models.Discipline.objects.create(name='Bench', description='')
+        models.LessonPrototype.objects.bulk_create(
+            models.LessonPrototype(
+                day_of_week=rng.randrange(6), weektype=rng.randrange(3),
+                start_time=timing, end_time=timing, discipline=discipline,
+                teacher=teacher, classroom=rng.choice(classrooms)
+            )
+            for timing in (rng.choice(timings) for _ in range(options['prototypes']))
+        )
+        started = time.time()
+        created = timetable.materialize_semester(semester)
+        self.stdout.write('Materialized %d lessons in %.2fs' % (created, time.time() - started))
+        return semester, timings
+
+    def handle(self, *args, **options):
+        rng = random.Random(0)
+        with transaction.atomic():
+            semester, timings = self.populate(options, rng)
+            days = list(timetable.semester_days(semester))
+            started = time.time()
+            index = occupancy.get_index()
+            index.get_days(days)
+            self.stdout.write('Indexed %d days in %.2fs' % (len(days), time.time() - started))
+            kinds = (
+                ('one slot', lambda: [(rng.choice(days), rng.choice(timings).pk)]),
+                ('3 slots', lambda: [
+                    (day, x.pk) for day in [rng.choice(days)] for x in timings[2:5]
+                ]),
+                ('week x 2 slots', lambda: [
+                    (days[i] + datetime.timedelta(days=j), x.pk)
+                    for i in [rng.randrange(len(days) - 40)] for j in range(7)
+                    for x in timings[:2]
+                ]),
+            )
+            for name, make in kinds:
+                queries = [make() for _ in range(options['queries'])]
+                found = 0
+                started = time.time()
+                for slots in queries:
+                    found += len(occupancy.get_free(slots, rng.randrange(5)))
+                elapsed = time.time() - started
+                self.stdout.write('%-16s %.3f ms/query, %.1f results/query' % (
+                    name, elapsed * 1000 / len(queries), found / len(queries)
+                ))
+            transaction.set_rollback(True)
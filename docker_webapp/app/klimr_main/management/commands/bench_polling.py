@@ -0,0 +1,43 @@
+import datetime
+import time
+from django.core.management.base import BaseCommand
+from django.db import transaction
+from django.test import Client
+from klimr_main import models
+from klimr_main.management.commands.bench_materialize import Command as Materialize
+from klimr_main.timetable import materialize_semester
+
+
+class Command(BaseCommand):
+    help = ('Compare polling a subgroup schedule with and without '
+            'If-None-Match. Data is created in a transaction that is '
+            'rolled back.')
+
+    def add_arguments(self, parser):
+        parser.add_argument('--requests', type=int, default=200)
+
+    def handle(self, *args, **options):
+        with transaction.atomic():
+            semester = Materialize().populate(360)
+            materialize_semester(semester, models.LessonPrototype.objects.filter(
+                discipline__name='bench'
+            ))
+            subgroup = models.Subgroup.objects.filter(group__name='bench').first()
+            url = '/api/schedule/group/%d/' % subgroup.pk
+            params = {
+                'from': semester.start_on,
+                'to': semester.start_on + datetime.timedelta(days=13),
+                'limit': 100,
+            }
+            client = Client(HTTP_HOST='127.0.0.1')
+            etag = client.get(url, params)['ETag']
+            for name, headers in (('full', {}), ('conditional', {'HTTP_IF_NONE_MATCH': etag})):
+                started = time.time()
+                for _ in range(options['requests']):
+                    response = client.get(url, params, **headers)
+                elapsed = time.time() - started
+                self.stdout.write('%-12s %d x %d: %.1f req/s (%d bytes)' % (
+                    name, options['requests'], response.status_code,
+                    options['requests'] / elapsed, len(response.content)
+                ))
+            transaction.set_rollback(True)
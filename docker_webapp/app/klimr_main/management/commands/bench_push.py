@@ -0,0 +1,77 @@
+import asyncio
+import json
+import resource
+import time
+from django.core.management.base import BaseCommand
+from klimr_main.pushserver import PushServer
+
+
+class Command(BaseCommand):
+    help = ('Measure push server fan-out: open SSE subscribers to one '
+            'lesson channel, POST messages to /publish and time until '
+            'every subscriber got all of them')
+
+    def add_arguments(self, parser):
+        parser.add_argument('--subscribers', type=int, default=2000)
+        parser.add_argument('--messages', type=int, default=100)
+        parser.add_argument('--batch-size', type=int, default=10)
+
+    def handle(self, *args, **options):
+        # Two descriptors per subscriber, both ends live in this process
+        soft, hard = resource.getrlimit(resource.RLIMIT_NOFILE)
+        resource.setrlimit(resource.RLIMIT_NOFILE, (hard, hard))
+        loop = asyncio.new_event_loop()
+        asyncio.set_event_loop(loop)
+        try:
+            loop.run_until_complete(self.run(loop, **options))
+        finally:
+            loop.close()
+
+    async def subscribe(self, loop, port, ready, expected):
+        reader, writer = await asyncio.open_connection('127.0.0.1', port, loop=loop)
+        writer.write(b'GET /events/lesson/1/ HTTP/1.1\r\nHost: bench\r\n\r\n')
+        await reader.readuntil(b'retry: 3000\n\n')
+        ready.set_result(None)
+        count, tail = 0, b''
+        while count < expected:
+            chunk = await reader.read(65536)
+            if not chunk:
+                break
+            count += (tail + chunk).count(b'\n\n')
+            tail = chunk[-1:]
+        writer.close()
+        return count
+
+    async def publish(self, loop, port, messages):
+        body = json.dumps(messages).encode('utf-8')
+        reader, writer = await asyncio.open_connection('127.0.0.1', port, loop=loop)
+        writer.write(b'POST /publish HTTP/1.1\r\nContent-Length: %d\r\n\r\n' % len(body) + body)
+        await reader.read()
+        writer.close()
+
+    async def run(self, loop, subscribers, messages, batch_size, **options):
+        server = PushServer(loop=loop)
+        await server.start('127.0.0.1', 0)
+        port = server.server.sockets[0].getsockname()[1]
+        clients = []
+        started = time.time()
+        for _ in range(subscribers):
+            ready = loop.create_future()
+            clients.append(loop.create_task(self.subscribe(loop, port, ready, messages)))
+            await ready
+        self.stdout.write('%d subscribers connected in %.2fs' % (
+            len(server.hub), time.time() - started
+        ))
+        data = {'type': 'queue', 'lesson': 1, 'op': 'join', 'position': 1, 'length': 1}
+        started = time.time()
+        for i in range(0, messages, batch_size):
+            await self.publish(loop, port, [
+                {'channel': 'lesson:1', 'data': dict(data, version=j)}
+                for j in range(i, min(i + batch_size, messages))
+            ])
+        received = sum(await asyncio.gather(*clients, loop=loop))
+        elapsed = time.time() - started
+        self.stdout.write('%d messages x %d subscribers: %d delivered in %.2fs, %.0f msg/s' % (
+            messages, subscribers, received, elapsed, received / elapsed
+        ))
+        await server.stop()
@@ -0,0 +1,64 @@
+import datetime
+import time
+from django.core.management.base import BaseCommand
+from django.db import transaction
+from klimr_main import models
+from klimr_main.roster import import_roster
+
+
+class Command(BaseCommand):
+    help = ('Time import_roster on a synthetic faculty. Everything is '
+            'created in a transaction that is rolled back.')
+
+    def add_arguments(self, parser):
+        parser.add_argument('--students', type=int, default=20000)
+        parser.add_argument('--group-size', type=int, default=25)
+        parser.add_argument('--existing', type=float, default=0.2,
+                            help='Share of persons that already exist')
+        parser.add_argument('--batch-size', type=int, default=1000)
+
+    def populate(self, options):
+        department = models.Department.objects.create(name='bench')
+        course = models.Course.objects.create(name='bench', description='', department=department)
+        start_on = datetime.date(2100, 9, 1)
+        semester = models.Semester.objects.create(
+            start_on=start_on,
+            test_week_on=start_on + datetime.timedelta(weeks=8),
+            test_week_end_on=start_on + datetime.timedelta(weeks=9),
+            session_on=start_on + datetime.timedelta(weeks=17),
+            session_end_on=start_on + datetime.timedelta(weeks=20),
+        )
+        rows = [
+            {
+                'last_name': 'Bench%d' % i, 'first_name': 'First%d' % (i % 97),
+                'middle_name': 'Middle%d' % (i % 89),
+                'group': 'B%05d' % (i // options['group_size']),
+                'subgroup': str(i % 2 + 1), 'course': course.pk,
+            }
+            for i in range(options['students'])
+        ]
+        models.Person.objects.bulk_create([
+            models.Person(**{x: row[x] for x in ('last_name', 'first_name', 'middle_name')})
+            for row in rows[:int(len(rows) * options['existing'])]
+        ])
+        return semester, rows
+
+    def handle(self, *args, **options):
+        with transaction.atomic():
+            semester, rows = self.populate(options)
+            started = time.time()
+            result = import_roster(rows, semester, batch_size=options['batch_size'])
+            elapsed = time.time() - started
+            started = time.time()
+            again = import_roster(rows, semester, batch_size=options['batch_size'])
+            rerun = time.time() - started
+            transaction.set_rollback(True)
+        self.stdout.write(
+            '%d rows in %.2fs (%.0f rows/s): %d groups, %d subgroups, %d persons, '
+            '%d students, %d links created' % (
+                len(rows), elapsed, len(rows) / elapsed, result['groups'],
+                result['subgroups'], result['persons'], result['students'], result['links']
+            )
+        )
+        self.stdout.write(', '.join('%s %.2fs' % x for x in result['timings'].items()))
+        self.stdout.write('Rerun created %d links in %.2fs' % (again['links'], rerun))
@@ -0,0 +1,67 @@
+import random
+import time
+from django.core.management.base import BaseCommand
+from django.db import transaction
+from klimr_main import models, search
+
+SYLLABLES = ('ба', 'ва', 'го', 'да', 'ел', 'жу', 'за', 'ки', 'ло', 'ма', 'но', 'пе',
+             'ро', 'са', 'ту', 'фё', 'ха', 'це', 'чи', 'ша', 'юр', 'яр')
+ENDINGS = ('ов', 'ев', 'ин', 'ский', 'енко', 'ук')
+FIRST_NAMES = ('Александр', 'Алексей', 'Анна', 'Артём', 'Дарья', 'Дмитрий', 'Елена',
+               'Иван', 'Мария', 'Михаил', 'Наталья', 'Никита', 'Ольга', 'Пётр',
+               'Сергей', 'Софья', 'Татьяна', 'Фёдор', 'Юлия', 'Ярослав')
+MIDDLE_NAMES = ('Александров', 'Иванов', 'Петров', 'Сергеев', 'Фёдоров', 'Андреев')
+
+
+class Command(BaseCommand):
+    help = ('Time person searches over synthetic persons. Everything is '
+            'created in a transaction that is rolled back.')
+
+    def add_arguments(self, parser):
+        parser.add_argument('--persons', type=int, default=100000)
+        parser.add_argument('--queries', type=int, default=200)
+
+    def populate(self, count, rng):
+        persons = []
+        for i in range(count):
+            last_name = ''.join(rng.choice(SYLLABLES) for _ in range(rng.randint(1, 3)))
+            last_name = (last_name + rng.choice(ENDINGS)).capitalize()
+            female = i % 2
+            persons.append(models.Person(
+                last_name=last_name + ('а' if female and last_name[-1] in 'вн' else ''),
+                first_name=rng.choice(FIRST_NAMES),
+                middle_name=rng.choice(MIDDLE_NAMES) + ('на' if female else 'ич')
+            ))
+        started = time.time()
+        models.Person.objects.bulk_create(persons, batch_size=300)
+        search.index(models.Person.objects.values_list('id', *search.NAME_FIELDS))
+        self.stdout.write('Created and indexed %d persons in %.2fs' % (count, time.time() - started))
+        return persons
+
+    def typo(self, word, rng):
+        i = rng.randrange(2, len(word))
+        return word[:i] + rng.choice('аеиоу') + word[i + 1:]
+
+    def handle(self, *args, **options):
+        rng = random.Random(0)
+        with transaction.atomic():
+            persons = self.populate(options['persons'], rng)
+            samples = [rng.choice(persons) for _ in range(options['queries'])]
+            kinds = (
+                ('full name', lambda x: '%s %s %s' % (x.last_name, x.first_name, x.middle_name)),
+                ('last name', lambda x: x.last_name),
+                ('3-letter prefix', lambda x: x.last_name[:3]),
+                ('prefix + initial', lambda x: '%s %s' % (x.last_name[:4], x.first_name[:1])),
+                ('typo', lambda x: self.typo(x.last_name, rng)),
+            )
+            for name, make in kinds:
+                queries = [make(x) for x in samples]
+                found = 0
+                started = time.time()
+                for query in queries:
+                    found += len(search.search(query))
+                elapsed = time.time() - started
+                self.stdout.write('%-16s %.2f ms/query, %.1f results/query' % (
+                    name, elapsed * 1000 / len(queries), found / len(queries)
+                ))
+            transaction.set_rollback(True)
@@ -0,0 +1,25 @@
+import os
+import time
+from django.core.management.base import BaseCommand
+from klimr_main import export
+from klimr_main.models import Semester
+
+
+class Command(BaseCommand):
+    help = ('Write the timetable snapshots of semesters (all by default) '
+            'that are out of date')
+
+    def add_arguments(self, parser):
+        parser.add_argument('semesters', type=int, nargs='*')
+
+    def handle(self, *args, **options):
+        semesters = Semester.objects.order_by('start_on')
+        if options['semesters']:
+            semesters = semesters.filter(pk__in=options['semesters'])
+        for semester in semesters:
+            started = time.time()
+            name, version = export.get_export(semester)
+            self.stdout.write('%s: %s, %d bytes in %.2fs' % (
+                semester, name, os.path.getsize(os.path.join(export.get_root(), name)),
+                time.time() - started
+            ))
@@ -0,0 +1,49 @@
+import csv
+import json
+from django.core.management.base import BaseCommand, CommandError
+from klimr_main.models import Semester
+from klimr_main.roster import import_roster
+
+
+class Command(BaseCommand):
+    help = ('Import Persons, Students, groups and subgroups of a semester '
+            'from a CSV (with a header row), JSON or NDJSON roster of '
+            'last_name, first_name, middle_name, group, subgroup, course')
+
+    def add_arguments(self, parser):
+        parser.add_argument('semester', type=int)
+        parser.add_argument('path')
+        parser.add_argument(
+            '--format', choices=('csv', 'json', 'ndjson'),
+            help='Taken from the file extension by default'
+        )
+        parser.add_argument('--batch-size', type=int, default=1000)
+
+    def read(self, path, format):
+        with open(path, encoding='utf-8', newline='') as f:
+            if format == 'csv':
+                return list(csv.DictReader(f))
+            if format == 'json':
+                return json.load(f)
+            return [json.loads(x) for x in f if x.strip()]
+
+    def handle(self, *args, **options):
+        try:
+            semester = Semester.objects.get(pk=options['semester'])
+        except Semester.DoesNotExist:
+            raise CommandError('Semester %s does not exist' % options['semester'])
+        format = options['format'] or options['path'].rsplit('.', 1)[-1].lower()
+        if format not in ('csv', 'json', 'ndjson'):
+            raise CommandError('Unknown roster format, use --format')
+        try:
+            rows = self.read(options['path'], format)
+        except (OSError, ValueError, csv.Error) as exc:
+            raise CommandError('Could not read %s: %s' % (options['path'], exc))
+        result = import_roster(rows, semester, batch_size=options['batch_size'])
+        for error in result['errors']:
+            self.stderr.write('Row %d: %s' % (error['index'], json.dumps(error['errors'])))
+        self.stdout.write(
+            'Imported %(rows)d row(s): %(groups)d group(s), %(subgroups)d subgroup(s), '
+            '%(persons)d person(s), %(students)d student(s), %(links)d link(s) created' % result
+        )
+        self.stdout.write(', '.join('%s %.2fs' % x for x in result['timings'].items()))
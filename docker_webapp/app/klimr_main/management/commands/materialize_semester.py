@@ -0,0 +1,21 @@
+import time
+from django.core.management.base import BaseCommand, CommandError
+from klimr_main.models import Semester
+from klimr_main.timetable import materialize_semester
+
+
+class Command(BaseCommand):
+    help = 'Create Lesson rows from LessonPrototypes for a whole semester'
+
+    def add_arguments(self, parser):
+        parser.add_argument('semester', type=int)
+        parser.add_argument('--batch-size', type=int, default=2000)
+
+    def handle(self, *args, **options):
+        try:
+            semester = Semester.objects.get(pk=options['semester'])
+        except Semester.DoesNotExist:
+            raise CommandError('Semester %s does not exist' % options['semester'])
+        started = time.time()
+        created = materialize_semester(semester, batch_size=options['batch_size'])
+        self.stdout.write('Created %d lesson(s) in %.2fs' % (created, time.time() - started))
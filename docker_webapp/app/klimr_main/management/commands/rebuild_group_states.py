@@ -0,0 +1,33 @@
+from django.core.management.base import BaseCommand
+from django.db import transaction
+from klimr_main import caching
+from klimr_main.models import Group, GroupSemesterState
+
+
+class Command(BaseCommand):
+    help = 'Rebuild Group.first_state/current_state pointers from scratch'
+
+    def handle(self, *args, **options):
+        first, current = {}, {}
+        states = GroupSemesterState.objects.order_by(
+            'group_id', 'semester__start_on', 'id'
+        ).values_list('group_id', 'id')
+        for group_id, state_id in states.iterator():
+            first.setdefault(group_id, state_id)
+            current[group_id] = state_id
+
+        changed = 0
+        with transaction.atomic():
+            groups = Group.objects.values_list('id', 'first_state', 'current_state')
+            for group_id, first_state, current_state in groups:
+                pointers = (first.get(group_id), current.get(group_id))
+                if pointers == (first_state, current_state):
+                    continue
+                Group.objects.filter(pk=group_id).update(
+                    first_state=pointers[0],
+                    current_state=pointers[1]
+                )
+                changed += 1
+        if changed:
+            caching.bump_version(Group)
+        self.stdout.write('Updated %d group(s)' % changed)
@@ -0,0 +1,12 @@
+import time
+from django.core.management.base import BaseCommand
+from klimr_main import search
+
+
+class Command(BaseCommand):
+    help = 'Recompute the PersonNameToken search index from all Persons'
+
+    def handle(self, *args, **options):
+        started = time.time()
+        count = search.rebuild()
+        self.stdout.write('Indexed %d token(s) in %.2fs' % (count, time.time() - started))
@@ -0,0 +1,12 @@
+import time
+from django.core.management.base import BaseCommand
+from klimr_main import progress
+
+
+class Command(BaseCommand):
+    help = 'Recompute AssignmentProgress from all CompletedAssignments'
+
+    def handle(self, *args, **options):
+        started = time.time()
+        count = progress.rebuild()
+        self.stdout.write('Rebuilt %d row(s) in %.2fs' % (count, time.time() - started))
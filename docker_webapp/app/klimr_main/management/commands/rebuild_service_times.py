@@ -0,0 +1,12 @@
+import time
+from django.core.management.base import BaseCommand
+from klimr_main import waittime
+
+
+class Command(BaseCommand):
+    help = 'Recompute ServiceTimeStats (queue wait estimates) from all Measurements'
+
+    def handle(self, *args, **options):
+        started = time.time()
+        count = waittime.rebuild()
+        self.stdout.write('Rebuilt %d row(s) in %.2fs' % (count, time.time() - started))
@@ -0,0 +1,46 @@
+import time
+from django.core.management.base import BaseCommand, CommandError
+from klimr_main.models import Semester
+from klimr_main.rollover import rollover
+
+
+class Command(BaseCommand):
+    help = ('Copy the group states of a semester, with their subgroups, '
+            'subgroup disciplines and teachers and the students that '
+            "weren't expelled, to another semester")
+
+    def add_arguments(self, parser):
+        parser.add_argument('source', type=int)
+        parser.add_argument('target', type=int)
+        parser.add_argument('--batch-size', type=int, default=1000)
+        parser.add_argument(
+            '--dry-run', action='store_true',
+            help='Report what would be copied and roll everything back'
+        )
+
+    def get_semester(self, pk):
+        try:
+            return Semester.objects.get(pk=pk)
+        except Semester.DoesNotExist:
+            raise CommandError('Semester %s does not exist' % pk)
+
+    def handle(self, *args, **options):
+        source = self.get_semester(options['source'])
+        target = self.get_semester(options['target'])
+        if source == target:
+            raise CommandError('The semesters must differ')
+        started = time.time()
+
+        def progress(done, total):
+            if options['verbosity'] > 0:
+                self.stdout.write('%d/%d group(s), %.2fs' % (done, total, time.time() - started))
+
+        counts = rollover(
+            source, target, batch_size=options['batch_size'],
+            dry_run=options['dry_run'], progress=progress
+        )
+        self.stdout.write('%s %s in %.2fs' % (
+            'Would copy' if options['dry_run'] else 'Copied',
+            ', '.join('%d %s' % (y, x) for x, y in counts.items()),
+            time.time() - started
+        ))
@@ -0,0 +1,29 @@
+import asyncio
+from django.core.management.base import BaseCommand
+from klimr_main import push
+from klimr_main.pushserver import PushServer
+
+
+class Command(BaseCommand):
+    help = ('Serve lesson and queue updates as Server-Sent Events, '
+            'see klimr_main.pushserver')
+
+    def add_arguments(self, parser):
+        parser.add_argument('--host', default='0.0.0.0')
+        parser.add_argument('--port', type=int, default=8001)
+
+    def handle(self, *args, **options):
+        loop = asyncio.get_event_loop()
+        server = PushServer(loop=loop)
+        loop.run_until_complete(server.start(options['host'], options['port']))
+        broker = push.get_broker()
+        if isinstance(broker, push.LocalBroker):
+            # Changes made in this process only, e.g. from `manage.py shell`
+            broker.listen(server.hub.publish)
+        self.stdout.write('Serving events on %s:%d' % (options['host'], options['port']))
+        try:
+            loop.run_forever()
+        except KeyboardInterrupt:
+            pass
+        finally:
+            loop.run_until_complete(server.stop())
@@ -0,0 +1,82 @@
+"""
+Bulk ingestion of Measurements: validation with a few set-based
+lookups instead of a query per item, inserts with bulk_create
+"""
+from django.db import transaction
+from klimr_main import bulk, waittime
+from klimr_main.models import Person, QueueRecord, Measurement
+
+FIELDS = ('user', 'lesson', 'record', 'time')
+
+
+def _lookup(queryset, ids):
+    """
+    {id: value} of the rows of `queryset` (a two-column values_list)
+    with the given ids
+    """
+    result = {}
+    for chunk in bulk.chunks(ids):
+        result.update(queryset.filter(pk__in=chunk))
+    return result
+
+
+def validate(items):
+    """
+    Returns (Measurements, {index: {field: [errors]}})
+    """
+    errors = {}
+    values = []
+    for i, item in enumerate(items):
+        if not isinstance(item, dict):
+            errors[i] = {'non_field_errors': ['Expected a JSON object.']}
+            continue
+        item_errors = {}
+        for field in FIELDS:
+            value = item.get(field)
+            if value is None:
+                item_errors[field] = ['This field is required.']
+            elif isinstance(value, bool) or not isinstance(value, int):
+                item_errors[field] = ['A valid integer is required.']
+        if item_errors:
+            errors[i] = item_errors
+        else:
+            values.append((i, item))
+
+    persons = _lookup(
+        Person.objects.values_list('id', 'id'), {x['user'] for i, x in values}
+    )
+    records = _lookup(
+        QueueRecord.objects.values_list('id', 'lesson_id'), {x['record'] for i, x in values}
+    )
+    measurements = []
+    for i, item in values:
+        item_errors = {}
+        if item['user'] not in persons:
+            item_errors['user'] = ['Invalid pk "%d" - object does not exist.' % item['user']]
+        if item['record'] not in records:
+            item_errors['record'] = ['Invalid pk "%d" - object does not exist.' % item['record']]
+        elif records[item['record']] != item['lesson']:
+            item_errors['lesson'] = ['The record is not queued for this lesson.']
+        if item_errors:
+            errors[i] = item_errors
+            continue
+        measurements.append(Measurement(
+            user_id=item['user'], lesson_id=item['lesson'],
+            record_id=item['record'], time=item['time']
+        ))
+    return measurements, errors
+
+
+def ingest(items, batch_size):
+    """
+    Store the valid items, `batch_size` rows per INSERT, in one
+    transaction. Returns (number of created rows, per-item errors).
+    """
+    measurements, errors = validate(items)
+    with transaction.atomic():
+        bulk.insert(Measurement, measurements, batch_size)
+        # bulk_create sends no post_save, see klimr_main.signals
+        waittime.add_measurements(measurements)
+    return len(measurements), [
+        {'index': i, 'errors': errors[i]} for i in sorted(errors)
+    ]
@@ -0,0 +1,30 @@
+# -*- coding: utf-8 -*-
+# Generated by Django 1.10.6 on 2026-10-18 08:12
+from __future__ import unicode_literals
+
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('klimr_main', '0012_auto_20170531_0434'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='LessonPrototype',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('day_of_week', models.IntegerField(choices=[(0, 'Monday'), (1, 'Tuesday'), (2, 'Wednesday'), (3, 'Thursday'), (4, 'Friday'), (5, 'Saturday'), (6, 'Sunday')])),
+                ('weektype', models.IntegerField(choices=[(0, 'Both'), (1, 'Odd'), (2, 'Even')])),
+                ('classroom', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, to='klimr_main.Classroom')),
+                ('discipline', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, to='klimr_main.Discipline')),
+                ('end_time', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='prototype_end_time', to='klimr_main.LessonTiming')),
+                ('groups', models.ManyToManyField(to='klimr_main.Subgroup')),
+                ('start_time', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='prototype_start_time', to='klimr_main.LessonTiming')),
+                ('teacher', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, to='klimr_main.Teacher')),
+            ],
+        ),
+    ]
@@ -0,0 +1,36 @@
+# -*- coding: utf-8 -*-
+# Generated by Django 1.10.6 on 2026-10-18 08:15
+from __future__ import unicode_literals
+
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+def fill_state_pointers(apps, schema_editor):
+    Group = apps.get_model('klimr_main', 'Group')
+    for group in Group.objects.all():
+        states = group.states.order_by('semester__start_on', 'id')
+        group.first_state = states.first()
+        group.current_state = states.last()
+        group.save(update_fields=['first_state', 'current_state'])
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('klimr_main', '0013_lessonprototype'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='group',
+            name='current_state',
+            field=models.ForeignKey(blank=True, editable=False, null=True, on_delete=django.db.models.deletion.SET_NULL, related_name='+', to='klimr_main.GroupSemesterState'),
+        ),
+        migrations.AddField(
+            model_name='group',
+            name='first_state',
+            field=models.ForeignKey(blank=True, editable=False, null=True, on_delete=django.db.models.deletion.SET_NULL, related_name='+', to='klimr_main.GroupSemesterState'),
+        ),
+        migrations.RunPython(fill_state_pointers, migrations.RunPython.noop),
+    ]
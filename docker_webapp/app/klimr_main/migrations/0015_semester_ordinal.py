@@ -0,0 +1,37 @@
+# -*- coding: utf-8 -*-
+# Generated by Django 1.10.6 on 2026-10-18 08:15
+from __future__ import unicode_literals
+
+from django.db import migrations, models
+
+
+def fill_ordinals(apps, schema_editor):
+    Semester = apps.get_model('klimr_main', 'Semester')
+    previous = None
+    for index, semester in enumerate(Semester.objects.order_by('start_on')):
+        if semester.start_on != previous:
+            current, previous = index, semester.start_on
+        semester.ordinal = current
+        semester.year = (current // 2) + 1
+        semester.save(update_fields=['ordinal', 'year'])
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('klimr_main', '0014_group_state_pointers'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='semester',
+            name='ordinal',
+            field=models.IntegerField(default=0, editable=False),
+        ),
+        migrations.AddField(
+            model_name='semester',
+            name='year',
+            field=models.IntegerField(default=1, editable=False),
+        ),
+        migrations.RunPython(fill_ordinals, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,25 @@
+# -*- coding: utf-8 -*-
+# Generated by Django 1.10.6 on 2026-10-18 08:18
+from __future__ import unicode_literals
+
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('klimr_main', '0015_semester_ordinal'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='lesson',
+            name='prototype',
+            field=models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.SET_NULL, to='klimr_main.LessonPrototype'),
+        ),
+        migrations.AlterUniqueTogether(
+            name='lesson',
+            unique_together=set([('prototype', 'date')]),
+        ),
+    ]
@@ -0,0 +1,20 @@
+# -*- coding: utf-8 -*-
+# Generated by Django 1.10.6 on 2026-10-18 08:29
+from __future__ import unicode_literals
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('klimr_main', '0016_lesson_prototype'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='queuerecord',
+            name='left_on',
+            field=models.DateTimeField(blank=True, editable=False, null=True),
+        ),
+    ]
@@ -0,0 +1,31 @@
+# -*- coding: utf-8 -*-
+# Generated by Django 1.10.6 on 2026-10-18 08:35
+from __future__ import unicode_literals
+
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('klimr_main', '0017_queuerecord_left_on'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='ServiceTimeStats',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('reason', models.IntegerField(choices=[(0, 'Autograph'), (1, 'Assignment'), (2, 'Question')])),
+                ('count', models.IntegerField(default=0)),
+                ('total', models.FloatField(default=0)),
+                ('discipline', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, to='klimr_main.Discipline')),
+                ('teacher', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, to='klimr_main.Teacher')),
+            ],
+        ),
+        migrations.AlterUniqueTogether(
+            name='servicetimestats',
+            unique_together=set([('discipline', 'teacher', 'reason')]),
+        ),
+    ]
@@ -0,0 +1,30 @@
+# -*- coding: utf-8 -*-
+# Generated by Django 1.10.6 on 2026-10-18 08:40
+from __future__ import unicode_literals
+
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('klimr_main', '0018_servicetimestats'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='AssignmentProgress',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('completed', models.IntegerField(default=0)),
+                ('last_completed_on', models.DateField(blank=True, null=True)),
+                ('discipline', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, to='klimr_main.Discipline')),
+                ('student', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='progress', to='klimr_main.Student')),
+            ],
+        ),
+        migrations.AlterUniqueTogether(
+            name='assignmentprogress',
+            unique_together=set([('student', 'discipline')]),
+        ),
+    ]
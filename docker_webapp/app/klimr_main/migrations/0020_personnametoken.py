@@ -0,0 +1,52 @@
+# -*- coding: utf-8 -*-
+# Generated by Django 1.10.6 on 2026-10-18 08:49
+from __future__ import unicode_literals
+
+import re
+
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+# A frozen copy of klimr_main.search.name_tokens() as of this migration,
+# later changes to it must not change what this migration does
+def name_tokens(*names):
+    return {
+        (field, token[:100])
+        for field, name in enumerate(names)
+        for token in re.findall(r'\w+', (name or '').casefold().replace('ё', 'е'))
+    }
+
+
+def index_person_names(apps, schema_editor):
+    Person = apps.get_model('klimr_main', 'Person')
+    PersonNameToken = apps.get_model('klimr_main', 'PersonNameToken')
+    rows = Person.objects.values_list('id', 'last_name', 'first_name', 'middle_name')
+    PersonNameToken.objects.bulk_create([
+        PersonNameToken(person_id=row[0], field=field, token=token)
+        for row in rows.iterator() for field, token in sorted(name_tokens(*row[1:]))
+    ], batch_size=300)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('klimr_main', '0019_assignmentprogress'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='PersonNameToken',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('field', models.IntegerField(choices=[(0, 'Last name'), (1, 'First name'), (2, 'Middle name')])),
+                ('token', models.CharField(max_length=100)),
+                ('person', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='name_tokens', to='klimr_main.Person')),
+            ],
+        ),
+        migrations.AlterIndexTogether(
+            name='personnametoken',
+            index_together=set([('token', 'person', 'field')]),
+        ),
+        migrations.RunPython(index_person_names, migrations.RunPython.noop),
+    ]
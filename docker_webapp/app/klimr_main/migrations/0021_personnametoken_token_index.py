@@ -0,0 +1,20 @@
+# -*- coding: utf-8 -*-
+# Generated by Django 1.10.6 on 2026-10-18 09:16
+from __future__ import unicode_literals
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('klimr_main', '0020_personnametoken'),
+    ]
+
+    operations = [
+        migrations.AlterField(
+            model_name='personnametoken',
+            name='token',
+            field=models.CharField(db_index=True, max_length=100),
+        ),
+    ]
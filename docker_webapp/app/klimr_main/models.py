@@ -1,5 +1,6 @@
 import datetime
 from django.db import models
+from django.db.models import F
 from django.contrib.auth.models import User
 from django.contrib import admin
 import django.utils.timezone
@@ -15,6 +16,28 @@ class Semester(models.Model):
     test_week_end_on = models.DateField(unique_for_year='start_on')
     session_on = models.DateField(unique_for_year='start_on')
     session_end_on = models.DateField(unique_for_year='start_on')
+    # Number of semesters that started before this one and the academic
+    # year it belongs to, maintained by klimr_main.signals
+    ordinal = models.IntegerField(default=0, editable=False)
+    year = models.IntegerField(default=1, editable=False)
+
+    @classmethod
+    def renumber(cls):
+        """
+        Recompute ordinal/year of every semester, touching only the rows
+        that actually changed
+        """
+        semesters = cls.objects.order_by('start_on').values_list(
+            'id', 'start_on', 'ordinal'
+        )
+        previous = None
+        for index, (pk, start_on, ordinal) in enumerate(semesters):
+            if start_on != previous:
+                current, previous = index, start_on
+            if ordinal != current:
+                cls.objects.filter(pk=pk).update(
+                    ordinal=current, year=(current // 2) + 1
+                )
 
     def __str__(self):
         return '%s' % (str(self.start_on))
@@ -39,6 +62,30 @@ class LessonTiming(models.Model):
         return 'Lesson %s - %s' % (str(self.start), str(self.end))
 
 
+class PersonQuerySet(models.QuerySet):
+    def with_roles(self):
+        """
+        Prefetch teachers (with departments) and students (with the
+        departments of their subgroups), so role checks and departments
+        of a whole page of persons cost four queries instead of a few
+        per person
+        """
+        return self.prefetch_related(
+            models.Prefetch(
+                'teachers', queryset=Teacher.objects.select_related('department')
+            ),
+            'students',
+            models.Prefetch(
+                'students__subgroups',
+                queryset=Subgroup.objects.select_related('group__group__course__department')
+            ),
+        )
+
+
+def _unique(departments):
+    return sorted({x.pk: x for x in departments}.values(), key=lambda x: (x.name, x.pk))
+
+
 class Person(models.Model):
     first_name = models.CharField(max_length=100)
     middle_name = models.CharField(max_length=100)
@@ -46,28 +93,67 @@ class Person(models.Model):
     created_on = models.DateField(auto_now_add=True)
     modified_on = models.DateTimeField(auto_now=True)
 
+    objects = PersonQuerySet.as_manager()
+
+    def _prefetched(self, name):
+        # Set by PersonQuerySet.with_roles()
+        return name in getattr(self, '_prefetched_objects_cache', {})
+
     def get_teachers(self):
         return Teacher.objects.filter(person=self.id)
 
     def get_teachers_departments(self):
-        return Department.objects.filter(teacher__in=self.get_teachers())
+        if self._prefetched('teachers'):
+            return _unique(x.department for x in self.teachers.all())
+        return Department.objects.filter(teacher__person=self.id).distinct().order_by('name', 'id')
 
     def get_students(self):
         return Student.objects.filter(person=self.id)
 
     def get_students_departments(self):
-        return Department.objects.filter(student__in=self.get_students())
+        if self._prefetched('students'):
+            return _unique(
+                x.group.group.course.department
+                for student in self.students.all() for x in student.subgroups.all()
+            )
+        return Department.objects.filter(
+            course__group__states__subgroup__student__person=self.id
+        ).distinct().order_by('name', 'id')
 
     def is_student(self):
-        return self.get_students().count() != 0
+        if self._prefetched('students'):
+            return len(self.students.all()) != 0
+        return self.get_students().exists()
 
     def is_teacher(self):
-        return self.get_teachers().count() != 0
+        if self._prefetched('teachers'):
+            return len(self.teachers.all()) != 0
+        return self.get_teachers().exists()
 
     def __str__(self):
         return '%s %s %s' % (self.first_name, self.middle_name, self.last_name)
 
 
+class PersonNameToken(models.Model):
+    """
+    A normalized word of a Person's name, maintained by klimr_main.search
+    """
+    FIELDS = (
+        (0, 'Last name'),
+        (1, 'First name'),
+        (2, 'Middle name')
+    )
+    person = models.ForeignKey(Person, related_name='name_tokens')
+    field = models.IntegerField(choices=FIELDS)
+    # db_index gets a varchar_pattern_ops index for prefix (LIKE)
+    # lookups on PostgreSQL, whatever the database collation
+    token = models.CharField(max_length=100, db_index=True)
+
+    class Meta:
+        # Covers exact lookups by token w/o reading the table
+        index_together = (("token", "person", "field"), )
+
+
 class KlimrUser(models.Model):
     djuser = models.OneToOneField(User, on_delete=models.CASCADE)
     person = models.OneToOneField(Person, on_delete=models.PROTECT)
@@ -100,6 +186,21 @@ class Course(models.Model):
         return self.name
 
 
+class GroupQuerySet(models.QuerySet):
+    def with_latest_state(self):
+        """
+        Annotate every group with the name and semester of its current
+        state, so directory listings can be filtered, ordered and
+        serialized straight from the maintained pointer columns
+        """
+        return self.select_related('course').annotate(
+            latest_name=F('current_state__name'),
+            latest_semester_id=F('current_state__semester_id'),
+            latest_semester_start_on=F('current_state__semester__start_on'),
+            latest_year=F('current_state__semester__year'),
+        )
+
+
 class Group(models.Model):
     """
     Literally, just a hack to connect all the group changes w/o
@@ -110,20 +211,49 @@ class Group(models.Model):
     TODO Autoremove groups w/o any states
     """
     course = models.ForeignKey(Course)
+    # Maintained by klimr_main.signals (see update_state_pointers),
+    # rebuild with `manage.py rebuild_group_states`
+    first_state = models.ForeignKey(
+        'GroupSemesterState', related_name='+', null=True, blank=True,
+        on_delete=models.SET_NULL, editable=False
+    )
+    current_state = models.ForeignKey(
+        'GroupSemesterState', related_name='+', null=True, blank=True,
+        on_delete=models.SET_NULL, editable=False
+    )
+
+    objects = GroupQuerySet.as_manager()
 
     @property
     def first_semester(self):
-        if self.states.count() > 0:
-            return self.states.earliest().semester
-        return None
+        if self.first_state_id is None:
+            return None
+        return self.first_state.semester
 
     @property
     def last_semester(self):
-        return self.states.latest().semester or None
-    
+        if self.current_state_id is None:
+            return None
+        return self.current_state.semester
+
     @property
     def name(self):
-        return self.states.latest().name
+        if self.current_state_id is None:
+            return None
+        return self.current_state.name
+
+    def update_state_pointers(self):
+        """
+        Point first_state/current_state at the earliest/latest states
+        (same order as GroupSemesterState's get_latest_by)
+        """
+        states = self.states.order_by('semester__start_on', 'id')
+        self.first_state = states.first()
+        self.current_state = states.last()
+        Group.objects.filter(pk=self.pk).update(
+            first_state=self.first_state,
+            current_state=self.current_state
+        )
 
     def __str__(self):
         fs = self.first_semester
@@ -135,6 +265,15 @@ class Group(models.Model):
         )
 
     def save(self, *args, **kwargs):
+        # The state pointers are kept by update_state_pointers(), an
+        # instance loaded before a state was added mustn't write its
+        # stale ones back
+        if not self._state.adding and not kwargs.get('force_insert') \
+                and kwargs.get('update_fields') is None:
+            kwargs['update_fields'] = [
+                x.name for x in self._meta.concrete_fields
+                if not x.primary_key and x.name not in ('first_state', 'current_state')
+            ]
         return super(Group, self).save(*args, **kwargs)
 
 
@@ -155,8 +294,7 @@ class GroupSemesterState(models.Model):
 
     @property
     def year(self):
-        prv = Semester.objects.filter(start_on__lt=self.semester.start_on)
-        return (prv.count() // 2) + 1
+        return self.semester.year
 
     def __str__(self):
         return self.name + ' (' + str(self.semester.start_on) + ')'
@@ -193,7 +331,30 @@ class Teacher(models.Model):
 
     @property
     def groups(self):
-        return Group.objects.filter(id__in=Lesson.objects.filter(teacher=self).values_list('groups', flat=True))
+        return Group.objects.filter(
+            states__subgroup__lesson__teacher=self
+        ).distinct()
+
+    @staticmethod
+    def groups_by_teacher(teachers):
+        """
+        Map teacher id to the groups it has lessons with, for many
+        teachers at once (two queries, however many lessons there are)
+        """
+        pairs = Lesson.objects.filter(
+            teacher__in=teachers,
+            groups__isnull=False
+        ).values_list('teacher_id', 'groups__group__group_id').distinct()
+        group_ids = {}
+        for teacher_id, group_id in pairs:
+            group_ids.setdefault(teacher_id, set()).add(group_id)
+        groups = Group.objects.with_latest_state().filter(
+            id__in=set().union(*group_ids.values())
+        ).in_bulk()
+        return {
+            teacher_id: [groups[x] for x in sorted(ids)]
+            for teacher_id, ids in group_ids.items()
+        }
 
     @property
     def name(self):
@@ -214,7 +375,7 @@ class Student(models.Model):
 
     @property
     def expelled(self):
-        return self.expelled_in is not None
+        return self.expelled_in_id is not None
 
     def __str__(self):
         if self.expelled_in is not None:
@@ -276,6 +437,20 @@ class CompletedAssignment(models.Model):
         )
 
 
+class AssignmentProgress(models.Model):
+    """
+    Completed assignments per student and discipline, maintained by
+    klimr_main.progress
+    """
+    student = models.ForeignKey(Student, related_name='progress')
+    discipline = models.ForeignKey(Discipline)
+    completed = models.IntegerField(default=0)
+    last_completed_on = models.DateField(null=True, blank=True)
+
+    class Meta:
+        unique_together = (("student", "discipline"), )
+
+
 class LessonPrototype(models.Model):
     WEEKDAYS = (
         (0, 'Monday'),
@@ -293,8 +468,8 @@ class LessonPrototype(models.Model):
         (2, 'Even')
     )
     weektype = models.IntegerField(choices=WEEKTYPES)
-    start_time = models.ForeignKey(LessonTiming, related_name="start_time")
-    end_time = models.ForeignKey(LessonTiming, related_name="end_time")
+    start_time = models.ForeignKey(LessonTiming, related_name="prototype_start_time")
+    end_time = models.ForeignKey(LessonTiming, related_name="prototype_end_time")
     discipline = models.ForeignKey(Discipline)
     teacher = models.ForeignKey(Teacher)
     classroom = models.ForeignKey(Classroom)
@@ -317,14 +492,19 @@ class Lesson(models.Model):
     classroom = models.ForeignKey(Classroom)
     groups = models.ManyToManyField(Subgroup)
     assignments = models.ManyToManyField(Assignment, blank=True)
+    CANCELLED = 3
     LESSON_STATES = (
         (0, 'Scheduled'),
         (1, 'On Time'),
         (2, 'Arrived'),
-        (3, 'Cancelled')
+        (CANCELLED, 'Cancelled')
     )
     state = models.IntegerField(choices=LESSON_STATES)
     reason = models.CharField(max_length=255, blank=True, default='')
+    # Set when the lesson was generated by klimr_main.timetable
+    prototype = models.ForeignKey(
+        LessonPrototype, null=True, blank=True, on_delete=models.SET_NULL
+    )
 
     def __str__(self):
         return '%s@%s (lt%s - lt%s) w/ %s' % (
@@ -335,6 +515,7 @@ class Lesson(models.Model):
 
     class Meta:
         ordering = ['date', 'start_time__start']
+        unique_together = (("prototype", "date"), )
 
 
 class QueueRecord(models.Model):
@@ -348,6 +529,9 @@ class QueueRecord(models.Model):
     )
     reason = models.IntegerField(choices=REASON_CHOICES)
     added_on = models.DateTimeField(auto_now_add=True)
+    # Set when the student leaves the queue or gets served, records are
+    # kept for Measurement
+    left_on = models.DateTimeField(null=True, blank=True, editable=False)
 
     def __str__(self):
         return '%d (%s)' % (self.id, str(self.student))
@@ -361,6 +545,21 @@ class Measurement(models.Model):
     time = models.IntegerField()
 
 
+class ServiceTimeStats(models.Model):
+    """
+    Running sums of service times (seconds between consecutive
+    Measurements of a lesson), maintained by klimr_main.waittime
+    """
+    discipline = models.ForeignKey(Discipline)
+    teacher = models.ForeignKey(Teacher)
+    reason = models.IntegerField(choices=QueueRecord.REASON_CHOICES)
+    count = models.IntegerField(default=0)
+    total = models.FloatField(default=0)
+
+    class Meta:
+        unique_together = (("discipline", "teacher", "reason"), )
+
+
 class AdvisedQueue(models.Model):
     record = models.ForeignKey(QueueRecord, on_delete=models.PROTECT)
     rank = models.IntegerField()
@@ -394,4 +593,6 @@ admin.site.register(Lesson)
 admin.site.register(QueueRecord)
 admin.site.register(Measurement)
 admin.site.register(AdvisedQueue)
+admin.site.register(ServiceTimeStats)
+admin.site.register(AssignmentProgress)
 admin.site.register(Achievement)
\ No newline at end of file
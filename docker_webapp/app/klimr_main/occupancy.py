@@ -0,0 +1,217 @@
+"""
+Classroom occupancy index: for every date and LessonTiming, a bitmap
+(an int with bit N set when the Classroom with id N is taken) built
+from stored Lessons that weren't cancelled and the LessonPrototype
+occurrences that have no stored Lesson.
+
+Finding free rooms of a type is then a couple of bitwise operations on
+in-process data instead of a scan over Lesson:
+
+    free = rooms of the type & ~(slot 1 | slot 2 | ...)
+
+Days are built lazily, a few queries for a whole range of them, and
+kept for the whole process. Every date has a version counter in the
+shared cache, bumped by klimr_main.signals when a lesson on it changes
+what it occupies, so only the days that changed are rebuilt, whichever
+process changed them. Changes to prototypes, timings, classrooms,
+semesters or holidays rebuild the whole index.
+"""
+import threading
+from collections import namedtuple
+from klimr_main import bulk, caching, timetable
+from klimr_main.models import Semester, Holiday, LessonTiming, Classroom, \
+    LessonPrototype, Lesson
+
+DAY_KEY = 'klimr:occupancy:%s'
+# Changes to these rebuild the whole index
+INDEX_MODELS = (Semester, Holiday, LessonTiming, Classroom, LessonPrototype)
+# Days kept before the index starts over
+MAX_DAYS = 1000
+
+# Lesson fields occupancy depends on, besides being cancelled
+LESSON_FIELDS = ('date', 'start_time_id', 'end_time_id', 'classroom_id', 'prototype_id')
+PrototypeRow = namedtuple(
+    'PrototypeRow', 'id day_of_week weektype start_time_id end_time_id classroom_id'
+)
+
+
+def lesson_key(values):
+    """
+    What occupancy depends on of a lesson (`values`: a dict of
+    LESSON_FIELDS and `state`)
+    """
+    return tuple(values[x] for x in LESSON_FIELDS) + (values['state'] == Lesson.CANCELLED, )
+
+
+def touch(dates):
+    for date in set(dates):
+        if date is not None:
+            caching.bump_counter(DAY_KEY % date.isoformat())
+
+
+def touch_lesson(lesson, old=None):
+    """
+    Bump the days of `lesson` after it was saved, unless nothing
+    occupancy depends on changed (`old` is its lesson_key() before)
+    """
+    new = lesson_key({x: getattr(lesson, x) for x in LESSON_FIELDS + ('state', )})
+    if new != old:
+        touch([lesson.date] + ([old[0]] if old else []))
+
+
+def bits(bitmap):
+    """
+    Positions of the set bits of `bitmap`, lowest first
+    """
+    result = []
+    while bitmap:
+        low = bitmap & -bitmap
+        result.append(low.bit_length() - 1)
+        bitmap ^= low
+    return result
+
+
+class OccupancyIndex(object):
+    """
+    Occupancy of the days looked up so far. `timings` are LessonTiming
+    ids in order, `classrooms` is {id: (name, classroom_type)}.
+    """
+    def __init__(self, fingerprint):
+        self.fingerprint = fingerprint
+        timings = list(LessonTiming.objects.order_by('start', 'end').values_list(
+            'id', 'start', 'end'
+        ))
+        self.timings = [x[0] for x in timings]
+        self.bounds = {x[0]: (x[1], x[2]) for x in timings}
+        self.spans = {}
+        self.classrooms = {}
+        self.types = {}
+        self.all = 0
+        for pk, name, classroom_type in Classroom.objects.values_list(
+                'id', 'name', 'classroom_type'
+        ):
+            self.classrooms[pk] = (name, classroom_type)
+            self.types[classroom_type] = self.types.get(classroom_type, 0) | 1 << pk
+            self.all |= 1 << pk
+        self.by_weekday = {}
+        for row in LessonPrototype.objects.order_by('id').values_list(*PrototypeRow._fields):
+            row = PrototypeRow(*row)
+            self.by_weekday.setdefault(row.day_of_week, []).append(row)
+        self.semesters = list(Semester.objects.order_by('start_on'))
+        # {date: (version, {timing id: bitmap})}
+        self.days = {}
+        self.lock = threading.Lock()
+
+    def span(self, start_time, end_time):
+        """
+        Timings overlapping a lesson from `start_time` to `end_time`
+        (ids), e.g. both halves of a double lesson
+        """
+        key = (start_time, end_time)
+        if key not in self.spans:
+            start, end = self.bounds[start_time][0], self.bounds[end_time][1]
+            self.spans[key] = [
+                x for x in self.timings
+                if self.bounds[x][0] < end and self.bounds[x][1] > start
+            ]
+        return self.spans[key]
+
+    def occurrences(self, day):
+        """
+        Prototypes taking place on `day`
+        """
+        for semester in self.semesters:
+            if not semester.start_on <= day <= semester.session_end_on:
+                continue
+            calendar = timetable.get_calendar(semester)
+            if not any(calendar.teaching_days(day, day)):
+                continue
+            weektype = 1 if calendar.is_odd_week(day) else 2
+            return [
+                x for x in self.by_weekday.get(day.weekday(), ())
+                if x.weektype in (0, weektype)
+            ]
+        return []
+
+    def build(self, versions):
+        """
+        (Re)build the days of `versions` ({date: version}), returns them
+        like they are kept in `days`
+        """
+        stored = {}
+        for chunk in bulk.chunks(versions):
+            for row in Lesson.objects.filter(date__in=chunk).order_by().values_list(
+                    'date', 'prototype_id', 'start_time_id', 'end_time_id',
+                    'classroom_id', 'state'
+            ):
+                stored.setdefault(row[0], []).append(row[1:])
+        days = {}
+        for day, version in versions.items():
+            slots = dict.fromkeys(self.timings, 0)
+            lessons = stored.get(day, [])
+            materialized = {x[0] for x in lessons}
+            for prototype, start_time, end_time, classroom, state in lessons:
+                if state != Lesson.CANCELLED:
+                    for timing in self.span(start_time, end_time):
+                        slots[timing] |= 1 << classroom
+            for prototype in self.occurrences(day):
+                if prototype.id not in materialized:
+                    for timing in self.span(prototype.start_time_id, prototype.end_time_id):
+                        slots[timing] |= 1 << prototype.classroom_id
+            days[day] = (version, slots)
+        with self.lock:
+            if len(self.days) + len(days) > MAX_DAYS:
+                self.days.clear()
+            self.days.update(days)
+        return days
+
+    def get_days(self, dates):
+        """
+        {date: {timing id: bitmap}} of `dates`, rebuilding the stale ones
+        """
+        dates = sorted(set(dates))
+        versions = dict(zip(dates, caching.get_counters(
+            [DAY_KEY % x.isoformat() for x in dates]
+        )))
+        days = {x: self.days.get(x) for x in dates}
+        stale = {
+            x: y for x, y in versions.items() if days[x] is None or days[x][0] != y
+        }
+        if stale:
+            days.update(self.build(stale))
+        return {x: y[1] for x, y in days.items()}
+
+    def get_free(self, slots, classroom_type=None):
+        """
+        Ids of the classrooms (of `classroom_type`) free during every
+        one of `slots` ([(date, timing id)])
+        """
+        days = self.get_days(x[0] for x in slots)
+        taken = 0
+        for day, timing in slots:
+            taken |= days[day][timing]
+        rooms = self.all if classroom_type is None else self.types.get(classroom_type, 0)
+        return bits(rooms & ~taken)
+
+
+_index = None
+_index_lock = threading.Lock()
+
+
+def get_index():
+    """
+    OccupancyIndex of this process, started over when one of
+    INDEX_MODELS changes
+    """
+    global _index
+    fingerprint = caching.get_versions(*INDEX_MODELS)
+    index = _index
+    if index is None or index.fingerprint != fingerprint:
+        index = OccupancyIndex(fingerprint)
+        with _index_lock:
+            _index = index
+    return index
+
+
+def get_free(slots, classroom_type=None):
+    return get_index().get_free(slots, classroom_type)
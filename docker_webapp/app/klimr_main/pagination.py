@@ -0,0 +1,105 @@
+from collections import OrderedDict
+from django.db.models import Q
+from django.utils.dateparse import parse_date, parse_time
+from rest_framework.exceptions import ParseError
+from rest_framework.pagination import BasePagination
+from rest_framework.response import Response
+from rest_framework.settings import api_settings
+from rest_framework.utils.urls import replace_query_param
+
+
+class LessonKeysetPagination(BasePagination):
+    """
+    Keyset ("seek") pagination over Lesson's natural ordering.
+
+    Instead of OFFSET the next page is selected with
+    (date, start_time__start, id) > cursor, so deep pages in a long
+    timetable cost the same as the first one. The cursor looks like
+    `2017-09-04,08:30:00,123`.
+    """
+    ordering = ('date', 'start_time__start', 'id')
+    cursor_query_param = 'cursor'
+    page_size_query_param = 'limit'
+    page_size = api_settings.PAGE_SIZE
+    max_page_size = 1000
+
+    @staticmethod
+    def get_key(lesson):
+        # Virtual lessons (see timetable.virtual_lessons) have no id yet,
+        # a negated prototype id keeps their keys unique
+        pk = lesson.id if lesson.id is not None else -lesson.prototype_id
+        return (lesson.date, lesson.start_time.start, pk)
+
+    @classmethod
+    def encode_cursor(cls, lesson):
+        return ','.join(str(x) for x in cls.get_key(lesson))
+
+    @classmethod
+    def decode_cursor(cls, cursor):
+        try:
+            date, time, pk = cursor.split(',')
+            key = (parse_date(date), parse_time(time), int(pk))
+        except ValueError:
+            key = (None, )
+        if None in key:
+            raise ParseError('Invalid cursor')
+        return key
+
+    @classmethod
+    def filter_after(cls, queryset, key):
+        """
+        Rows strictly after `key` in (date, start_time__start, id) order
+        """
+        condition = Q()
+        for i, field in enumerate(cls.ordering):
+            step = Q(**{field + '__gt': key[i]})
+            for previous, value in zip(cls.ordering[:i], key):
+                step &= Q(**{previous: value})
+            condition |= step
+        return queryset.filter(condition)
+
+    def get_page_size(self, request):
+        try:
+            size = int(request.query_params[self.page_size_query_param])
+        except (KeyError, ValueError):
+            return self.page_size
+        return max(1, min(size, self.max_page_size))
+
+    def paginate_queryset(self, queryset, request, view=None):
+        """
+        Also accepts a list of lessons already sorted by get_key, which
+        is then paged in memory
+        """
+        self.request = request
+        cursor = request.query_params.get(self.cursor_query_param)
+        limit = self.get_page_size(request)
+        if isinstance(queryset, list):
+            if cursor:
+                key = self.decode_cursor(cursor)
+                queryset = [x for x in queryset if self.get_key(x) > key]
+        else:
+            queryset = queryset.order_by(*self.ordering)
+            if cursor:
+                queryset = self.filter_after(queryset, self.decode_cursor(cursor))
+        # One extra row tells us whether there is a next page w/o COUNT
+        page = list(queryset[:limit + 1])
+        self.next_cursor = None
+        if len(page) > limit:
+            page = page[:limit]
+            self.next_cursor = self.encode_cursor(page[-1])
+        return page
+
+    def get_next_link(self):
+        if self.next_cursor is None:
+            return None
+        return replace_query_param(
+            self.request.build_absolute_uri(),
+            self.cursor_query_param,
+            self.next_cursor
+        )
+
+    def get_paginated_response(self, data):
+        return Response(OrderedDict([
+            ('next', self.get_next_link()),
+            ('results', data)
+        ]))
@@ -0,0 +1,47 @@
+import codecs
+import csv
+import json
+from django.conf import settings
+from rest_framework.exceptions import ParseError
+from rest_framework.parsers import BaseParser
+
+
+class NDJSONParser(BaseParser):
+    """
+    Newline-delimited JSON, parsed into a list with one item per
+    non-empty line. Lines that aren't valid JSON become None, so the
+    view can report them next to the other per-item errors instead of
+    rejecting the whole body.
+    """
+    media_type = 'application/x-ndjson'
+
+    def parse(self, stream, media_type=None, parser_context=None):
+        parser_context = parser_context or {}
+        encoding = parser_context.get('encoding', settings.DEFAULT_CHARSET)
+        items = []
+        try:
+            for line in codecs.getreader(encoding)(stream):
+                if not line.strip():
+                    continue
+                try:
+                    items.append(json.loads(line))
+                except ValueError:
+                    items.append(None)
+        except UnicodeDecodeError as exc:
+            raise ParseError('NDJSON parse error - %s' % exc)
+        return items
+
+
+class CSVParser(BaseParser):
+    """
+    CSV with a header row, parsed into a list of dicts by column name
+    """
+    media_type = 'text/csv'
+
+    def parse(self, stream, media_type=None, parser_context=None):
+        parser_context = parser_context or {}
+        encoding = parser_context.get('encoding', settings.DEFAULT_CHARSET)
+        try:
+            return list(csv.DictReader(codecs.getreader(encoding)(stream)))
+        except (csv.Error, UnicodeDecodeError) as exc:
+            raise ParseError('CSV parse error - %s' % exc)
@@ -0,0 +1,91 @@
+"""
+AssignmentProgress: number of CompletedAssignments and the last
+completion date per student and discipline, so group progress is read
+from one table instead of joining through Assignment and Subgroup
+"""
+from django.db import transaction
+from django.db.models import Count, Max
+from klimr_main.models import Student, Assignment, CompletedAssignment, \
+    AssignmentProgress
+
+# Students per refresh query, keeps `IN` under SQLite's variable limit
+STUDENT_CHUNK_SIZE = 500
+
+
+def _aggregate(completions):
+    return [
+        AssignmentProgress(
+            student_id=x['student_id'], discipline_id=x['assignment__discipline_id'],
+            completed=x['completed'], last_completed_on=x['last_completed_on']
+        )
+        for x in completions.values('student_id', 'assignment__discipline_id').annotate(
+            completed=Count('id'), last_completed_on=Max('completed_on')
+        ).order_by()
+    ]
+
+
+def refresh(students, disciplines):
+    """
+    Recompute the progress of `students` in `disciplines` (ids) with a
+    grouped query, a DELETE and an INSERT per chunk of students
+    """
+    students, disciplines = sorted(set(students)), set(disciplines)
+    if not disciplines:
+        return
+    for i in range(0, len(students), STUDENT_CHUNK_SIZE):
+        chunk = students[i:i + STUDENT_CHUNK_SIZE]
+        with transaction.atomic():
+            # Concurrent refreshes of the same students would both
+            # insert their rows
+            list(Student.objects.select_for_update().filter(pk__in=chunk).values_list('id'))
+            progress = _aggregate(CompletedAssignment.objects.filter(
+                student__in=chunk, assignment__discipline__in=disciplines
+            ))
+            AssignmentProgress.objects.filter(
+                student__in=chunk, discipline__in=disciplines
+            ).delete()
+            AssignmentProgress.objects.bulk_create(progress)
+
+
+def mark_completed(students, assignments, completed_on):
+    """
+    Create the missing CompletedAssignments of `students` x
+    `assignments` (ids): existing pairs are read with one query, the
+    rest is inserted with bulk_create. Returns the number of created
+    rows.
+    """
+    students, assignments = set(students), set(assignments)
+    with transaction.atomic():
+        # Nothing keeps two markings of the same students from inserting
+        # the same pairs but this lock
+        list(Student.objects.select_for_update().filter(pk__in=students).values_list('id'))
+        existing = set(CompletedAssignment.objects.filter(
+            student__in=students, assignment__in=assignments
+        ).values_list('student_id', 'assignment_id'))
+        missing = [
+            CompletedAssignment(student_id=x, assignment_id=y, completed_on=completed_on)
+            for x in sorted(students) for y in sorted(assignments)
+            if (x, y) not in existing
+        ]
+        CompletedAssignment.objects.bulk_create(missing)
+        # bulk_create sends no post_save, see klimr_main.signals
+        if missing:
+            refresh(
+                {x.student_id for x in missing},
+                Assignment.objects.filter(pk__in=assignments).values_list(
+                    'discipline_id', flat=True
+                ).distinct()
+            )
+    return len(missing)
+
+
+def rebuild():
+    """
+    Recompute AssignmentProgress from all CompletedAssignments, returns
+    the number of rows
+    """
+    with transaction.atomic():
+        progress = _aggregate(CompletedAssignment.objects.all())
+        AssignmentProgress.objects.all().delete()
+        AssignmentProgress.objects.bulk_create(progress)
+    return len(progress)
@@ -0,0 +1,115 @@
+"""
+Server push of lesson state and queue changes.
+
+Changes are published as (channel, data) pairs, channels being
+`lesson:ID` (state and queue of the lesson) and `subgroup:ID` (state of
+the subgroup's lessons), through the broker named by
+settings.PUSH_BROKER. klimr_main.pushserver fans them out to Server-Sent
+Events subscribers.
+
+LocalBroker hands messages to listeners in this process (tests,
+bench_push), HTTPBroker POSTs them to every push server in
+settings.PUSH_SERVERS, so subscribers can be spread over any number of
+nodes.
+"""
+import logging
+import urllib.request
+from django.conf import settings
+from django.utils.module_loading import import_string
+from rest_framework.utils.encoders import JSONEncoder
+
+logger = logging.getLogger(__name__)
+
+
+def lesson_channel(lesson_id):
+    return 'lesson:%d' % lesson_id
+
+
+def subgroup_channel(subgroup_id):
+    return 'subgroup:%d' % subgroup_id
+
+
+class LocalBroker(object):
+    def __init__(self):
+        self.listeners = []
+
+    def listen(self, callback):
+        """
+        Call `callback(channel, data)` for every published message
+        """
+        self.listeners.append(callback)
+
+    def unlisten(self, callback):
+        self.listeners.remove(callback)
+
+    def publish(self, messages):
+        for callback in list(self.listeners):
+            for channel, data in messages:
+                callback(channel, data)
+
+
+class HTTPBroker(object):
+    timeout = 1
+
+    def __init__(self, servers=None):
+        self.servers = settings.PUSH_SERVERS if servers is None else servers
+
+    def publish(self, messages):
+        body = JSONEncoder().encode([
+            {'channel': channel, 'data': data} for channel, data in messages
+        ]).encode('utf-8')
+        for server in self.servers:
+            request = urllib.request.Request(
+                server.rstrip('/') + '/publish', data=body,
+                headers={'Content-Type': 'application/json'}
+            )
+            try:
+                urllib.request.urlopen(request, timeout=self.timeout).close()
+            except OSError:
+                # Subscribers reload on reconnect, a push server being
+                # down must not fail the change itself
+                logger.warning('Could not publish to %s', server, exc_info=True)
+
+
+_broker = (None, None)
+
+
+def get_broker():
+    global _broker
+    if _broker[0] != settings.PUSH_BROKER:
+        _broker = (settings.PUSH_BROKER, import_string(settings.PUSH_BROKER)())
+    return _broker[1]
+
+
+def publish(messages):
+    """
+    Publish a list of (channel, data) pairs
+    """
+    if messages:
+        get_broker().publish(messages)
+
+
+def publish_lesson(lesson_id, state, reason, subgroups):
+    data = {'type': 'lesson', 'id': lesson_id, 'state': state, 'reason': reason}
+    publish([(lesson_channel(lesson_id), data)] + [
+        (subgroup_channel(x), data) for x in subgroups
+    ])
+
+
+def publish_queue(queue, op, entry):
+    """
+    Publish a change of a klimr_main.queues.LessonQueue. `version` goes
+    up by one with every change of the lesson's queue, so subscribers
+    that see a gap know they missed one and reload the queue.
+    """
+    publish([(lesson_channel(queue.lesson_id), {
+        'type': 'queue',
+        'lesson': queue.lesson_id,
+        'version': queue.version,
+        'op': op,
+        'record': entry.id,
+        'student': entry.student,
+        'reason': entry.reason,
+        'position': queue.position(entry.id),
+        'length': len(queue),
+    })])
@@ -0,0 +1,169 @@
+"""
+asyncio Server-Sent Events server for klimr_main.push (manage.py runpush).
+
+GET /events/lesson/ID/ or /events/subgroup/ID/ subscribes to a channel,
+POST /publish with a JSON list of {channel, data} publishes to this
+process' subscribers (that's what push.HTTPBroker does). Only /events/
+is meant to be proxied to clients.
+"""
+import asyncio
+import json
+import re
+from rest_framework.utils.encoders import JSONEncoder
+
+EVENTS_PATH = re.compile(r'^/events/(lesson|subgroup)/([0-9]+)/$')
+
+
+class Hub(object):
+    """
+    SSE subscribers of this process by channel. A message is encoded
+    once and written to the transports of all its subscribers; ones
+    that don't read fast enough are disconnected instead of buffering
+    for them (they reload and resubscribe).
+    """
+    max_buffer = 64 * 1024
+
+    def __init__(self):
+        self.channels = {}
+        self.last_id = 0
+        self.delivered = 0
+        self.encoder = JSONEncoder(separators=(',', ':'))
+
+    def subscribe(self, channel, writer):
+        self.channels.setdefault(channel, set()).add(writer)
+
+    def unsubscribe(self, channel, writer):
+        subscribers = self.channels.get(channel)
+        if subscribers is not None:
+            subscribers.discard(writer)
+            if not subscribers:
+                del self.channels[channel]
+
+    def __len__(self):
+        return sum(len(x) for x in self.channels.values())
+
+    def write(self, channel, data):
+        for writer in list(self.channels.get(channel, ())):
+            if writer.transport.get_write_buffer_size() > self.max_buffer:
+                self.unsubscribe(channel, writer)
+                writer.close()
+                continue
+            writer.write(data)
+            self.delivered += 1
+
+    def publish(self, channel, data):
+        if channel not in self.channels:
+            return
+        self.last_id += 1
+        self.write(channel, ('id: %d\nevent: %s\ndata: %s\n\n' % (
+            self.last_id, data.get('type', 'message'), self.encoder.encode(data)
+        )).encode('utf-8'))
+
+    def ping(self):
+        # Comments keep proxies from closing idle streams
+        for channel in list(self.channels):
+            for writer in list(self.channels.get(channel, ())):
+                writer.write(b':\n\n')
+
+
+def _response(writer, status, headers=()):
+    writer.write(('HTTP/1.1 %s\r\n%s\r\n' % (status, ''.join(
+        '%s: %s\r\n' % x for x in headers + (('Connection', 'close'), )
+    ))).encode('latin-1'))
+
+
+class PushServer(object):
+    keepalive = 15
+    max_body_size = 1024 * 1024
+    event_headers = (
+        ('Content-Type', 'text/event-stream'),
+        ('Cache-Control', 'no-cache'),
+        ('Access-Control-Allow-Origin', '*'),
+        # Don't let nginx buffer the stream
+        ('X-Accel-Buffering', 'no'),
+    )
+
+    def __init__(self, hub=None, loop=None):
+        self.hub = hub or Hub()
+        self.loop = loop or asyncio.get_event_loop()
+        self.connections = set()
+
+    async def start(self, host, port):
+        self.server = await asyncio.start_server(
+            self.handle, host, port, loop=self.loop, backlog=1024
+        )
+        self.pinger = self.loop.create_task(self.ping())
+        return self.server
+
+    async def stop(self):
+        self.pinger.cancel()
+        self.server.close()
+        for task in self.connections:
+            task.cancel()
+        await asyncio.gather(*self.connections, loop=self.loop, return_exceptions=True)
+        await self.server.wait_closed()
+
+    async def ping(self):
+        while True:
+            await asyncio.sleep(self.keepalive, loop=self.loop)
+            self.hub.ping()
+
+    async def handle(self, reader, writer):
+        task = asyncio.Task.current_task(loop=self.loop)
+        self.connections.add(task)
+        try:
+            await self.serve(reader, writer)
+        finally:
+            self.connections.discard(task)
+
+    async def serve(self, reader, writer):
+        try:
+            head = await reader.readuntil(b'\r\n\r\n')
+            request, *lines = head.decode('latin-1').split('\r\n')
+            method, path, _ = request.split(' ', 2)
+        except (asyncio.IncompleteReadError, asyncio.LimitOverrunError,
+                ConnectionError, ValueError):
+            writer.close()
+            return
+        headers = {}
+        for line in lines:
+            name, _, value = line.partition(':')
+            headers[name.strip().lower()] = value.strip()
+        path = path.split('?', 1)[0]
+        match = EVENTS_PATH.match(path)
+        try:
+            if method == 'GET' and match:
+                await self.handle_events(reader, writer, '%s:%s' % match.groups())
+            elif method == 'POST' and path == '/publish':
+                await self.handle_publish(reader, writer, headers)
+            else:
+                _response(writer, '404 Not Found')
+        except ConnectionError:
+            pass
+        finally:
+            writer.close()
+
+    async def handle_events(self, reader, writer, channel):
+        _response(writer, '200 OK', self.event_headers)
+        writer.write(b'retry: 3000\n\n')
+        self.hub.subscribe(channel, writer)
+        try:
+            # Clients don't send anything, EOF means they're gone
+            while await reader.read(1024):
+                pass
+        finally:
+            self.hub.unsubscribe(channel, writer)
+
+    async def handle_publish(self, reader, writer, headers):
+        try:
+            length = int(headers.get('content-length', 0))
+            if length > self.max_body_size:
+                raise ValueError
+            messages = json.loads((await reader.readexactly(length)).decode('utf-8'))
+            for message in messages:
+                self.hub.publish(message['channel'], message['data'])
+        except (asyncio.IncompleteReadError, ValueError, KeyError, TypeError,
+                AttributeError):
+            _response(writer, '400 Bad Request')
+            return
+        _response(writer, '204 No Content')
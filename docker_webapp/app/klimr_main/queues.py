@@ -0,0 +1,312 @@
+"""
+Per-lesson queues of QueueRecords kept in process memory.
+
+The database stays the source of truth: the order is persisted as
+AdvisedQueue ranks, and every change bumps a per-lesson counter in the
+shared cache, so other processes notice their copy is stale and reload
+it (one query) on next access. Reads (peek, position) never touch the
+database while the copy is fresh.
+
+Joining records are placed by advised_position(); a join or leave
+writes a single rank, the rest of the queue keeps its ranks.
+"""
+import bisect
+import contextlib
+import threading
+from django.conf import settings
+from django.db import transaction
+from django.db.models import Case, When, Value, IntegerField
+from django.utils import timezone
+from klimr_main import caching, push, waittime
+from klimr_main.models import Lesson, QueueRecord, AdvisedQueue
+
+QUEUE_VERSION_KEY = 'klimr:queue:%d'
+# Gap between neighbouring ranks, leaves room to move records between
+# them w/o renumbering the rest of the queue
+RANK_STEP = 1024
+
+
+class QueueEntry(object):
+    __slots__ = ('id', 'student', 'reason', 'added_on', 'rank', 'overtaken')
+
+    def __init__(self, id, student, reason, added_on, rank=None):
+        self.id = id
+        self.student = student
+        self.reason = reason
+        self.added_on = added_on
+        self.rank = rank
+        # Number of records queued after this one but ahead of it
+        self.overtaken = 0
+
+    @property
+    def key(self):
+        # Records w/o a rank (created outside this module) go last
+        return (self.rank is None, self.rank or 0, self.id)
+
+
+class LessonQueue(object):
+    """
+    Entries of a lesson's queue sorted by AdvisedQueue rank, with
+    O(log n) lookup of a record's position
+    """
+    def __init__(self, lesson, version, entries=()):
+        self.lesson_id = lesson.id
+        # For klimr_main.waittime
+        self.discipline_id = lesson.discipline_id
+        self.teacher_id = lesson.teacher_id
+        self.version = version
+        self.lock = threading.Lock()
+        self.entries = sorted(entries, key=lambda x: x.key)
+        self.keys = [x.key for x in self.entries]
+        self.by_id = {x.id: x for x in self.entries}
+        self.by_student = {x.student: x for x in self.entries}
+        arrivals = []
+        for entry in self.entries:
+            arrival = (entry.added_on, entry.id)
+            entry.overtaken = len(arrivals) - bisect.bisect(arrivals, arrival)
+            bisect.insort(arrivals, arrival)
+
+    def __len__(self):
+        return len(self.entries)
+
+    def add(self, entry):
+        with self.lock:
+            i = bisect.bisect(self.keys, entry.key)
+            self.keys.insert(i, entry.key)
+            self.entries.insert(i, entry)
+            self.by_id[entry.id] = entry
+            self.by_student[entry.student] = entry
+
+    def remove(self, record_id):
+        with self.lock:
+            entry = self.by_id.pop(record_id)
+            i = bisect.bisect_left(self.keys, entry.key)
+            del self.keys[i]
+            del self.entries[i]
+            del self.by_student[entry.student]
+        return entry
+
+    def get(self, record_id):
+        return self.by_id.get(record_id)
+
+    def find(self, student_id):
+        return self.by_student.get(student_id)
+
+    def position(self, record_id):
+        """
+        1-based position of the record or None if it's not queued
+        """
+        with self.lock:
+            entry = self.by_id.get(record_id)
+            if entry is None:
+                return None
+            return bisect.bisect_left(self.keys, entry.key) + 1
+
+    def peek(self, count=None):
+        with self.lock:
+            return self.entries[:count]
+
+
+_queues = {}
+_queues_lock = threading.Lock()
+
+
+def _load(lesson, version):
+    rows = QueueRecord.objects.filter(
+        lesson=lesson.id, left_on__isnull=True
+    ).values_list('id', 'student_id', 'reason', 'added_on', 'advisedqueue__rank')
+    return LessonQueue(lesson, version, [QueueEntry(*x) for x in rows])
+
+
+def _publish(queue):
+    with _queues_lock:
+        cached = _queues.get(queue.lesson_id)
+        if cached is None or cached.version < queue.version:
+            _queues[queue.lesson_id] = queue
+
+
+def get_queue(lesson_id):
+    """
+    LessonQueue of the lesson, reloaded from the database if it was
+    changed (by any process) since this process loaded it. Raises
+    Lesson.DoesNotExist for unknown lessons, so they aren't kept.
+    """
+    version = caching.get_counter(QUEUE_VERSION_KEY % lesson_id)
+    queue = _queues.get(lesson_id)
+    if queue is None or queue.version != version:
+        # Read the counter before the rows, so a change committed in
+        # between bumps it past what we store
+        lesson = Lesson.objects.filter(pk=lesson_id).only(
+            'id', 'discipline_id', 'teacher_id'
+        ).first()
+        if lesson is None:
+            raise Lesson.DoesNotExist
+        queue = _load(lesson, version)
+        _publish(queue)
+    return queue
+
+
+@contextlib.contextmanager
+def _change(lesson_id):
+    """
+    Serialize changes to a lesson's queue on the Lesson row and hand the
+    block (lesson, queue loaded under that lock); on success bump the
+    lesson's counter and publish the changed queue under the new version
+    """
+    with transaction.atomic():
+        lesson = Lesson.objects.select_for_update().filter(
+            pk=lesson_id
+        ).only('id', 'state', 'discipline_id', 'teacher_id').first()
+        if lesson is None:
+            raise Lesson.DoesNotExist
+        queue = _load(lesson, None)
+        yield lesson, queue
+    queue.version = caching.bump_counter(QUEUE_VERSION_KEY % lesson_id)
+    _publish(queue)
+
+
+def _save_ranks(ranks):
+    """
+    Persist {record id: rank} with one UPDATE (plus one INSERT for
+    records that had no rank yet)
+    """
+    if not ranks:
+        return
+    existing = set(AdvisedQueue.objects.filter(
+        record__in=list(ranks)
+    ).values_list('record_id', flat=True))
+    if existing:
+        AdvisedQueue.objects.filter(record__in=existing).update(rank=Case(
+            *[When(record_id=x, then=Value(ranks[x])) for x in existing],
+            output_field=IntegerField()
+        ))
+    AdvisedQueue.objects.bulk_create([
+        AdvisedQueue(record_id=x, rank=y)
+        for x, y in ranks.items() if x not in existing
+    ])
+
+
+def _renumber(queue, entries):
+    """
+    Re-add `entries` (the whole queue in the wanted order) with ranks
+    RANK_STEP apart, returns the ranks that changed
+    """
+    changed = {}
+    for entry in queue.peek():
+        queue.remove(entry.id)
+    for i, entry in enumerate(entries):
+        rank = (i + 1) * RANK_STEP
+        if entry.rank != rank:
+            entry.rank = changed[entry.id] = rank
+        queue.add(entry)
+    return changed
+
+
+def _place(queue, entry, i):
+    """
+    Insert `entry` at 0-based index `i` with a rank between its new
+    neighbours; only when there is no room left the whole queue gets
+    renumbered. Returns the ranks that changed.
+    """
+    others = queue.peek()
+    i = max(0, min(i, len(others)))
+    low = others[i - 1].rank if i > 0 else 0
+    high = others[i].rank if i < len(others) else None
+    if high is None and low is not None:
+        high = low + 2 * RANK_STEP
+    if low is None or high is None or high - low < 2:
+        queue.add(entry)
+        return _renumber(queue, others[:i] + [entry] + others[i:])
+    entry.rank = (low + high) // 2
+    queue.add(entry)
+    return {entry.id: entry.rank}
+
+
+def advised_position(queue, entry):
+    """
+    0-based index a joining `entry` should get: ahead of records with a
+    longer expected service time, as shortest expected service first
+    minimizes the mean wait, but never past a record that was already
+    overtaken QUEUE_MAX_OVERTAKES times, so nobody waits forever. Only
+    the records it passes are looked at.
+    """
+    limit = getattr(settings, 'QUEUE_MAX_OVERTAKES', 0)
+    estimator = waittime.get_estimator()
+
+    def service(x):
+        return estimator.service_time(queue.discipline_id, queue.teacher_id, x.reason)
+
+    entries = queue.peek()
+    expected = service(entry)
+    i = len(entries)
+    while i > 0 and entries[i - 1].overtaken < limit and service(entries[i - 1]) > expected:
+        i -= 1
+    return i
+
+
+def join(lesson_id, student_id, reason):
+    """
+    Queue the student at advised_position(), returns the new
+    QueueEntry. Raises ValueError if the student is already queued or
+    the lesson is cancelled and Lesson.DoesNotExist for unknown lessons.
+    """
+    with _change(lesson_id) as (lesson, queue):
+        if lesson.state == Lesson.CANCELLED:
+            raise ValueError('Lesson is cancelled')
+        if queue.find(student_id) is not None:
+            raise ValueError('Student is already queued')
+        record = QueueRecord.objects.create(
+            lesson_id=lesson_id, student_id=student_id, reason=reason
+        )
+        entry = QueueEntry(record.id, student_id, reason, record.added_on)
+        i = advised_position(queue, entry)
+        for other in queue.peek()[i:]:
+            other.overtaken += 1
+        _save_ranks(_place(queue, entry, i))
+    push.publish_queue(queue, 'join', entry)
+    return entry
+
+
+def _take(queue, record_id):
+    QueueRecord.objects.filter(pk=record_id).update(left_on=timezone.now())
+    AdvisedQueue.objects.filter(record=record_id).delete()
+    return queue.remove(record_id)
+
+
+def leave(lesson_id, record_id):
+    """
+    Take the record out of the queue (the student left or got served)
+    """
+    with _change(lesson_id) as (lesson, queue):
+        if queue.get(record_id) is None:
+            raise QueueRecord.DoesNotExist
+        entry = _take(queue, record_id)
+    push.publish_queue(queue, 'leave', entry)
+    return entry
+
+
+def pop(lesson_id):
+    """
+    Take the first record out of the queue, returns None if it's empty
+    """
+    with _change(lesson_id) as (lesson, queue):
+        first = queue.peek(1)
+        if not first:
+            return None
+        entry = _take(queue, first[0].id)
+    push.publish_queue(queue, 'next', entry)
+    return entry
+
+
+def move(lesson_id, record_id, position):
+    """
+    Put the record at 1-based `position`
+    """
+    with _change(lesson_id) as (lesson, queue):
+        entry = queue.get(record_id)
+        if entry is None:
+            raise QueueRecord.DoesNotExist
+        queue.remove(record_id)
+        _save_ranks(_place(queue, entry, position - 1))
+    push.publish_queue(queue, 'move', entry)
+    return entry
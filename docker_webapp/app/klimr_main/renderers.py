@@ -0,0 +1,17 @@
+from rest_framework.renderers import BaseRenderer
+
+
+class ICalendarRenderer(BaseRenderer):
+    """
+    text/calendar, for views that build their iCalendar responses
+    themselves (see klimr_main.ical). Errors are sent w/o a body,
+    calendar apps only look at the status.
+    """
+    media_type = 'text/calendar'
+    format = 'ics'
+    charset = 'utf-8'
+
+    def render(self, data, accepted_media_type=None, renderer_context=None):
+        if isinstance(data, str):
+            return data.encode(self.charset)
+        return b''
@@ -0,0 +1,152 @@
+"""
+Semester rollover: every group with a state in one semester gets a copy
+of it in the next, with copies of its Subgroups, their disciplines and
+teachers and the memberships of students that weren't expelled (an
+expelled praepostor is left out too).
+
+Groups are copied in chunks, every chunk with a few set-based reads and
+one bulk_create per table, so the number of queries grows with the
+number of chunks, not of groups. bulk_create sends no signals: the
+group state pointers and cache versions are updated here.
+"""
+from collections import OrderedDict
+from django.db import transaction
+from django.db.models import Case, When, Value, IntegerField
+from klimr_main import bulk, caching
+from klimr_main.models import Group, GroupSemesterState, Subgroup, Student, \
+    Discipline, Teacher
+
+# Groups per chunk
+GROUP_CHUNK_SIZE = 300
+# Subgroup M2M copied along with the subgroups: (name, relation, column
+# of the other side, rows to skip)
+LINKS = (
+    ('disciplines', Subgroup.disciplines, 'discipline_id', {}),
+    ('teachers', Subgroup.teachers, 'teacher_id', {}),
+    ('students', Student.subgroups, 'student_id', {'student__expelled_in__isnull': False}),
+)
+
+
+def _by_state(subgroups):
+    result = OrderedDict()
+    for pk, state in subgroups:
+        result.setdefault(state, []).append(pk)
+    return result
+
+
+def _update_pointers(groups):
+    """
+    Recompute Group.first_state/current_state of `groups` (ids), one
+    UPDATE per changed column of a chunk instead of one per group
+    """
+    first, current = {}, {}
+    states = GroupSemesterState.objects.filter(group__in=groups).order_by(
+        'group_id', 'semester__start_on', 'id'
+    ).values_list('group_id', 'id')
+    for group_id, state_id in states:
+        first.setdefault(group_id, state_id)
+        current[group_id] = state_id
+    changed = {'first_state': {}, 'current_state': {}}
+    pointers = Group.objects.filter(pk__in=groups).values_list(
+        'id', 'first_state', 'current_state'
+    )
+    for group_id, first_state, current_state in pointers:
+        if first[group_id] != first_state:
+            changed['first_state'][group_id] = first[group_id]
+        if current[group_id] != current_state:
+            changed['current_state'][group_id] = current[group_id]
+    for field, values in changed.items():
+        if values:
+            Group.objects.filter(pk__in=list(values)).update(**{field: Case(
+                *[When(pk=x, then=Value(y)) for x, y in values.items()],
+                output_field=IntegerField()
+            )})
+
+
+def _copy_chunk(states, target, batch_size, counts):
+    """
+    Copy `states` ([(id, group id, name, praepostor id)]) to `target`
+    """
+    groups = [x[1] for x in states]
+    bulk.insert(GroupSemesterState, [
+        GroupSemesterState(name=name, group_id=group, praepostor_id=praepostor, semester=target)
+        for pk, group, name, praepostor in states
+    ], batch_size)
+    # SQLite doesn't return the ids of bulk inserted rows
+    new_states = dict(GroupSemesterState.objects.filter(
+        semester=target, group__in=groups
+    ).values_list('group_id', 'id'))
+    counts['states'] += len(states)
+
+    old = []
+    for chunk in bulk.chunks(x[0] for x in states):
+        old.extend(Subgroup.objects.filter(group__in=chunk).values_list(
+            'id', 'group_id', 'name', 'primary'
+        ))
+    old.sort(key=lambda x: (x[1], x[0]))
+    state_map = {x[0]: new_states[x[1]] for x in states}
+    bulk.insert(Subgroup, [
+        Subgroup(group_id=state_map[state], name=name, primary=primary)
+        for pk, state, name, primary in old
+    ], batch_size)
+    new = []
+    for chunk in bulk.chunks(state_map.values()):
+        new.extend(Subgroup.objects.filter(group__in=chunk).values_list('id', 'group_id'))
+    new = _by_state(sorted(new, key=lambda x: (x[1], x[0])))
+    # Rows are inserted in order, the n-th new subgroup of a state is the
+    # copy of the n-th old one
+    subgroup_map = {}
+    for state, subgroups in _by_state((x[0], x[1]) for x in old).items():
+        subgroup_map.update(zip(subgroups, new[state_map[state]]))
+    counts['subgroups'] += len(old)
+
+    for name, relation, column, exclude in LINKS:
+        Link = relation.through
+        rows = []
+        for chunk in bulk.chunks(subgroup_map):
+            rows.extend(Link.objects.filter(subgroup__in=chunk).exclude(
+                **exclude
+            ).values_list('subgroup_id', column))
+        bulk.insert(Link, [
+            Link(**{'subgroup_id': subgroup_map[subgroup], column: other})
+            for subgroup, other in rows
+        ], batch_size)
+        counts[name] += len(rows)
+
+    _update_pointers(groups)
+
+
+def rollover(source, target, batch_size=1000, dry_run=False, progress=None):
+    """
+    Copy the group states of Semester `source` to `target`, skipping
+    groups that already have a state there. `progress(done, total)` is
+    called after every chunk. With `dry_run` everything is rolled back.
+    Returns an OrderedDict of counts of copied rows.
+    """
+    counts = OrderedDict([('states', 0), ('subgroups', 0)] + [(x[0], 0) for x in LINKS])
+    with transaction.atomic():
+        done = set(GroupSemesterState.objects.filter(
+            semester=target
+        ).values_list('group_id', flat=True))
+        # Expelled praepostors aren't carried over, like their memberships
+        states = [
+            (pk, group, name, None if expelled_in is not None else praepostor)
+            for pk, group, name, praepostor, expelled_in in GroupSemesterState.objects.filter(
+                semester=source
+            ).order_by('group_id', 'id').values_list(
+                'id', 'group_id', 'name', 'praepostor_id', 'praepostor__expelled_in_id'
+            )
+            if group not in done
+        ]
+        # A group with several states in a semester gets its latest copied
+        states = list(OrderedDict((x[1], x) for x in states).values())
+        for i in range(0, len(states), GROUP_CHUNK_SIZE):
+            _copy_chunk(states[i:i + GROUP_CHUNK_SIZE], target, batch_size, counts)
+            if progress is not None:
+                progress(min(i + GROUP_CHUNK_SIZE, len(states)), len(states))
+        if dry_run:
+            transaction.set_rollback(True)
+    if not dry_run and states:
+        for model in (Group, GroupSemesterState, Subgroup, Student, Discipline, Teacher):
+            caching.bump_version(model)
+    return counts
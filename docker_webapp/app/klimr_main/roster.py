@@ -0,0 +1,217 @@
+"""
+Bulk roster import: Persons, Students, GroupSemesterStates, Subgroups
+and Student.subgroups links of a semester from a list of rows.
+
+Every lookup is a handful of set-based queries (existing persons are
+matched by full name) and the bulk of the rows (persons, students,
+links) is inserted with bulk_create, all in one transaction. Groups,
+states and subgroups are few, they are created one by one so their
+signals maintain Group.first_state/current_state.
+"""
+import time
+from collections import OrderedDict
+from django.db import transaction
+from klimr_main import bulk, caching, search
+from klimr_main.models import Person, Course, Group, GroupSemesterState, \
+    Subgroup, Student
+
+NAME_FIELDS = ('last_name', 'first_name', 'middle_name')
+REQUIRED_FIELDS = ('last_name', 'first_name', 'group', 'subgroup')
+
+
+def _text(value):
+    return '' if value is None else str(value).strip()
+
+
+def validate(rows):
+    """
+    Returns ([(index, row)] with stripped values, {index: {field: [errors]}})
+    """
+    valid = []
+    errors = {}
+    for i, row in enumerate(rows):
+        if not isinstance(row, dict):
+            errors[i] = {'non_field_errors': ['Expected an object.']}
+            continue
+        row = {
+            x: _text(row.get(x))
+            for x in NAME_FIELDS + ('group', 'subgroup', 'course')
+        }
+        row_errors = {x: ['This field is required.'] for x in REQUIRED_FIELDS if not row[x]}
+        for field in NAME_FIELDS + ('group', 'subgroup'):
+            if len(row[field]) > 100:
+                row_errors[field] = ['Ensure this field has no more than 100 characters.']
+        if row['course']:
+            try:
+                row['course'] = int(row['course'])
+            except ValueError:
+                row_errors['course'] = ['A valid integer is required.']
+        else:
+            row['course'] = None
+        if row_errors:
+            errors[i] = row_errors
+        else:
+            valid.append((i, row))
+    return valid, errors
+
+
+def _get_persons(names):
+    """
+    {(last name, first name, middle name): person id}, the oldest person
+    if several have the same name
+    """
+    wanted = set(names)
+    result = {}
+    for chunk in bulk.chunks({x[0] for x in wanted}):
+        persons = Person.objects.filter(last_name__in=chunk).order_by('-id').values_list(
+            'id', *NAME_FIELDS
+        )
+        for pk, *name in persons:
+            if tuple(name) in wanted:
+                result[tuple(name)] = pk
+    return result
+
+
+def _get_students(persons):
+    """
+    {person id: id of its latest student that isn't expelled}
+    """
+    result = {}
+    for chunk in bulk.chunks(persons):
+        result.update(Student.objects.filter(
+            person__in=chunk, expelled_in__isnull=True
+        ).order_by('id').values_list('person_id', 'id'))
+    return result
+
+
+def _get_states(semester, rows, errors):
+    """
+    ({state name: id}, number of created states) for the groups of
+    `rows`, creating the missing ones (along with their Group) from the
+    rows' course
+    """
+    names = {x['group'] for i, x in rows}
+    states = {}
+    for chunk in bulk.chunks(names):
+        states.update(GroupSemesterState.objects.filter(
+            semester=semester, name__in=chunk
+        ).order_by('-id').values_list('name', 'id'))
+    courses = {}
+    for i, row in rows:
+        if row['group'] not in states and row['course'] is not None:
+            courses.setdefault(row['group'], row['course'])
+    existing = set(Course.objects.filter(
+        pk__in=set(courses.values())
+    ).values_list('id', flat=True))
+    created = 0
+    for name in sorted(names - set(states)):
+        if courses.get(name) in existing:
+            states[name] = GroupSemesterState.objects.create(
+                name=name, semester=semester,
+                group=Group.objects.create(course_id=courses[name])
+            ).pk
+            created += 1
+    for i, row in rows:
+        if row['group'] not in states:
+            errors[i] = {'course': [
+                'Unknown group, a valid course is required to create it.'
+            ]}
+    return states, created
+
+
+def _get_subgroups(states, keys):
+    """
+    ({(state id, subgroup name): id}, number of created subgroups),
+    creating the missing subgroups. The first one created in a state
+    w/o a primary subgroup becomes primary.
+    """
+    result = {}
+    primary = set()
+    for chunk in bulk.chunks(states):
+        subgroups = Subgroup.objects.filter(group__in=chunk).order_by('-id').values_list(
+            'group_id', 'name', 'id', 'primary'
+        )
+        for state, name, pk, is_primary in subgroups:
+            result[(state, name)] = pk
+            if is_primary:
+                primary.add(state)
+    missing = sorted(set(keys) - set(result))
+    for state, name in missing:
+        result[(state, name)] = Subgroup.objects.create(
+            group_id=state, name=name, primary=state not in primary
+        ).pk
+        primary.add(state)
+    return result, len(missing)
+
+
+def import_roster(rows, semester, batch_size=1000):
+    """
+    Import the rows ({last_name, first_name, middle_name, group,
+    subgroup, course}, `group` being the name of a GroupSemesterState of
+    `semester` and `course` an id used to create groups that don't
+    exist yet) in one transaction. Returns an OrderedDict of counts,
+    per-row errors and the time spent in every stage.
+    """
+    timings = OrderedDict()
+    started = last = time.time()
+
+    def lap(stage):
+        nonlocal last
+        now = time.time()
+        timings[stage] = round(now - last, 3)
+        last = now
+
+    rows, errors = validate(rows)
+    lap('validate')
+    with transaction.atomic():
+        counts = OrderedDict()
+        states, counts['groups'] = _get_states(semester, rows, errors)
+        rows = [(i, x) for i, x in rows if i not in errors]
+        subgroups, counts['subgroups'] = _get_subgroups(
+            set(states.values()),
+            {(states[x['group']], x['subgroup']) for i, x in rows}
+        )
+        lap('groups')
+
+        names = {tuple(x[y] for y in NAME_FIELDS) for i, x in rows}
+        persons = _get_persons(names)
+        missing = sorted(names - set(persons))
+        bulk.insert(Person, [Person(**dict(zip(NAME_FIELDS, x))) for x in missing], batch_size)
+        # SQLite doesn't return the ids of bulk inserted rows
+        persons.update(_get_persons(missing))
+        # bulk_create sends no post_save, see klimr_main.signals
+        search.index((persons[x], ) + x for x in missing)
+        counts['persons'] = len(missing)
+        lap('persons')
+
+        students = _get_students(persons.values())
+        missing = sorted(set(persons.values()) - set(students))
+        bulk.insert(Student, [Student(person_id=x) for x in missing], batch_size)
+        students.update(_get_students(missing))
+        counts['students'] = len(missing)
+        lap('students')
+
+        links = {
+            (students[persons[tuple(x[y] for y in NAME_FIELDS)]],
+             subgroups[(states[x['group']], x['subgroup'])])
+            for i, x in rows
+        }
+        Link = Student.subgroups.through
+        existing = set()
+        for chunk in bulk.chunks({x[1] for x in links}):
+            existing.update(Link.objects.filter(subgroup__in=chunk).values_list(
+                'student_id', 'subgroup_id'
+            ))
+        missing = sorted(links - existing)
+        bulk.insert(Link, [Link(student_id=x, subgroup_id=y) for x, y in missing], batch_size)
+        counts['links'] = len(missing)
+        lap('links')
+    # bulk_create sends no post_save/m2m_changed, see klimr_main.signals
+    for model in (Person, Student, Subgroup):
+        caching.bump_version(model)
+    timings['total'] = round(time.time() - started, 3)
+    result = OrderedDict([('rows', len(rows))])
+    result.update(counts)
+    result['errors'] = [{'index': i, 'errors': errors[i]} for i in sorted(errors)]
+    result['timings'] = timings
+    return result
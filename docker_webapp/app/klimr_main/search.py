@@ -0,0 +1,169 @@
+"""
+Person search by name.
+
+Every word of a Person's name is kept normalized (case folded, ё as е)
+in PersonNameToken, so a query word is looked up as an indexed prefix
+instead of an `icontains` scan over Person: `token LIKE 'word%'` (the
+index has varchar_pattern_ops on PostgreSQL, so it doesn't depend on
+the collation), or on SQLite, whose LIKE can't use an index, the range
+`token >= word AND token < word + U+FFFF`, exact under its bytewise
+BINARY collation. Words that match nothing as a prefix are looked up
+fuzzily among the tokens sharing their first two letters.
+
+Persons matching every query word are ranked by how well they match
+(exact word, prefix, typo), then by name.
+"""
+import re
+from django.db import connection, transaction
+from django.db.models import Count
+from klimr_main import bulk
+from klimr_main.models import Person, PersonNameToken
+
+NAME_FIELDS = ('last_name', 'first_name', 'middle_name')
+WORD = re.compile(r'\w+')
+# Scores of a query word matching a token
+EXACT, PREFIX, FUZZY = 3, 2, 1
+# End of the SQLite prefix range, everything above U+FFFF is rare
+# enough in names to ignore
+PREFIX_END = '\uffff'
+# Words shorter than this aren't matched fuzzily
+FUZZY_MIN_LENGTH = 4
+
+
+def normalize(text):
+    """
+    Normalized words of `text`
+    """
+    return WORD.findall(text.casefold().replace('ё', 'е'))
+
+
+def name_tokens(*names):
+    """
+    {(field, token)} of a person's last, first and middle name
+    """
+    return {
+        (field, token[:100])
+        for field, name in enumerate(names)
+        for token in normalize(name or '')
+    }
+
+
+def index(rows):
+    """
+    (Re)index persons from (id, last name, first name, middle name) rows
+    """
+    rows = list(rows)
+    with transaction.atomic():
+        for chunk in bulk.chunks(x[0] for x in rows):
+            PersonNameToken.objects.filter(person__in=chunk).delete()
+        bulk.insert(PersonNameToken, [
+            PersonNameToken(person_id=row[0], field=field, token=token)
+            for row in rows for field, token in sorted(name_tokens(*row[1:]))
+        ], 1000)
+
+
+def index_persons(ids):
+    rows = []
+    for chunk in bulk.chunks(ids):
+        rows.extend(Person.objects.filter(pk__in=chunk).values_list('id', *NAME_FIELDS))
+    index(rows)
+
+
+def rebuild():
+    """
+    Reindex all persons, returns the number of tokens
+    """
+    with transaction.atomic():
+        PersonNameToken.objects.all().delete()
+        index(Person.objects.values_list('id', *NAME_FIELDS).iterator())
+    return PersonNameToken.objects.count()
+
+
+def _distance(a, b, limit):
+    """
+    Levenshtein distance of `a` and `b`, or limit + 1 if it's above limit
+    """
+    if abs(len(a) - len(b)) > limit:
+        return limit + 1
+    previous = list(range(len(b) + 1))
+    for i, x in enumerate(a, 1):
+        current = [i]
+        for j, y in enumerate(b, 1):
+            current.append(min(previous[j] + 1, current[j - 1] + 1, previous[j - 1] + (x != y)))
+        if min(current) > limit:
+            return limit + 1
+        previous = current
+    return previous[-1]
+
+
+def _prefix(tokens, word):
+    if connection.vendor == 'sqlite':
+        return tokens.filter(token__gte=word, token__lt=word + PREFIX_END)
+    return tokens.filter(token__startswith=word)
+
+
+def _match(word, candidates):
+    """
+    {person id: score} of the persons with a token matching `word`,
+    among `candidates` (ids) if it's not None
+    """
+    tokens = PersonNameToken.objects.all()
+    if candidates is not None and len(candidates) <= bulk.CHUNK_SIZE:
+        tokens = tokens.filter(person__in=candidates)
+    scores = {}
+    for person, token in _prefix(tokens, word).values_list('person_id', 'token'):
+        score = EXACT if token == word else PREFIX
+        if score > scores.get(person, 0):
+            scores[person] = score
+    if not scores and len(word) >= FUZZY_MIN_LENGTH:
+        limit = 1 if len(word) < 8 else 2
+        similar = [
+            x for x in _prefix(tokens, word[:2]).values_list('token', flat=True).distinct()
+            if _distance(word, x, limit) <= limit
+        ]
+        for chunk in bulk.chunks(similar):
+            for person in tokens.filter(token__in=chunk).values_list('person_id', flat=True):
+                scores[person] = FUZZY
+    if candidates is not None:
+        scores = {x: y for x, y in scores.items() if x in candidates}
+    return scores
+
+
+def search(query, limit=20, role=None):
+    """
+    Persons (annotated with `score`, `teacher_count` and
+    `student_count`) matching every word of `query`, best first. `role`
+    ('teacher' or 'student') keeps only persons that have one.
+    """
+    words = sorted(set(normalize(query)), key=len, reverse=True)
+    if not words:
+        return []
+    scores = None
+    # Longest (most selective) words first, later ones are looked up
+    # among the persons matching the previous ones
+    for word in words:
+        matches = _match(word, scores)
+        if scores is None:
+            scores = matches
+        else:
+            scores = {x: scores[x] + y for x, y in matches.items()}
+        if not scores:
+            return []
+    persons = Person.objects.all()
+    if role == 'teacher':
+        persons = persons.filter(teachers__isnull=False).distinct()
+    elif role == 'student':
+        persons = persons.filter(students__isnull=False).distinct()
+    names = []
+    for chunk in bulk.chunks(scores):
+        names.extend(persons.filter(pk__in=chunk).values_list('id', *NAME_FIELDS))
+    names.sort(key=lambda x: (-scores[x[0]], normalize(x[1]), normalize(x[2]),
+                              normalize(x[3]), x[0]))
+    top = [x[0] for x in names[:limit]]
+    result = Person.objects.filter(pk__in=top).annotate(
+        teacher_count=Count('teachers', distinct=True),
+        student_count=Count('students', distinct=True)
+    ).in_bulk()
+    for person in result.values():
+        person.score = scores[person.pk]
+    return [result[x] for x in top]
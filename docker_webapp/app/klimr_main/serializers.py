@@ -1,5 +1,6 @@
 from collections import OrderedDict
 from django.contrib.auth.models import User, Group
+from django.db.models import Prefetch
 from rest_framework import serializers
 from klimr_main import models
 
@@ -22,9 +23,25 @@ class LessonTimingSerializer(serializers.ModelSerializer):
 
 
 class PersonSerializer(serializers.ModelSerializer):
+    """
+    Use with Person.objects.with_roles(), roles and departments are
+    read from the prefetched teachers and students
+    """
+    is_student = serializers.BooleanField(read_only=True)
+    is_teacher = serializers.BooleanField(read_only=True)
+    teacher_departments = serializers.SerializerMethodField()
+    student_departments = serializers.SerializerMethodField()
+
+    def get_teacher_departments(self, obj):
+        return ShortDepartmentSerializer(obj.get_teachers_departments(), many=True).data
+
+    def get_student_departments(self, obj):
+        return ShortDepartmentSerializer(obj.get_students_departments(), many=True).data
+
     class Meta:
         model = models.Person
-        fields = ('id', 'first_name', 'middle_name', 'last_name', 'students', 'teachers')
+        fields = ('id', 'first_name', 'middle_name', 'last_name', 'students', 'teachers',
+                  'is_student', 'is_teacher', 'teacher_departments', 'student_departments')
         read_only_fields = ('students', 'teachers')
 
 
@@ -34,6 +51,20 @@ class ShortPersonSerializer(serializers.ModelSerializer):
         fields = ('id', 'first_name', 'middle_name', 'last_name')
 
 
+class PersonSearchSerializer(serializers.ModelSerializer):
+    """
+    klimr_main.search results
+    """
+    score = serializers.IntegerField(read_only=True)
+    is_teacher = serializers.BooleanField(source='teacher_count', read_only=True)
+    is_student = serializers.BooleanField(source='student_count', read_only=True)
+
+    class Meta:
+        model = models.Person
+        fields = ('id', 'first_name', 'middle_name', 'last_name', 'is_teacher',
+                  'is_student', 'score')
+
+
 class DepartmentSerializer(serializers.ModelSerializer):
     class Meta:
         model = models.Department
@@ -90,6 +121,30 @@ class ShortGroupSerializer(serializers.ModelSerializer):
         fields = ('id', 'name', 'course', 'last_semester') 
 
 
+class LatestSemesterSerializer(serializers.Serializer):
+    id = serializers.IntegerField(source='latest_semester_id')
+    start_on = serializers.DateField(source='latest_semester_start_on')
+
+    def to_representation(self, instance):
+        if instance.latest_semester_id is None:
+            return None
+        return super(LatestSemesterSerializer, self).to_representation(instance)
+
+
+class GroupDirectorySerializer(serializers.ModelSerializer):
+    """
+    Same output as ShortGroupSerializer, but reads the annotations
+    added by Group.objects.with_latest_state()
+    """
+    name = serializers.CharField(source='latest_name', read_only=True)
+    course = ShortCourseSerializer(read_only=True)
+    last_semester = LatestSemesterSerializer(source='*', read_only=True)
+
+    class Meta:
+        model = models.Group
+        fields = ('id', 'name', 'course', 'last_semester')
+
+
 class ShortSubgroupSerializer(serializers.ModelSerializer):
     class Meta:
         model = models.Subgroup
@@ -100,7 +155,7 @@ class GroupDetails(object):
     def __init__(self, group, state):
         self.name = group.name
         self.course = group.course
-        self.year = group.states.count() - 1 // 2
+        self.year = state.year
         self.praepostor = state.praepostor.person_id
         primary_subgroups = state.subgroup_set.filter(primary=True)
 
@@ -134,25 +189,39 @@ class PrimarySubgroupDataSerializer(serializers.Serializer):
 class GroupStateSerializer(serializers.ModelSerializer):
     course = ShortCourseSerializer()
 
+    @staticmethod
+    def setup_eager_loading(queryset):
+        """
+        Load everything to_representation needs (course, semester,
+        subgroups, students with persons) in a fixed number of queries,
+        no matter how many states or students there are
+        """
+        subgroups = models.Subgroup.objects.order_by('id')
+        students = models.Student.objects.select_related('person')
+        return queryset.select_related('group__course', 'semester').prefetch_related(
+            Prefetch('subgroup_set', queryset=subgroups),
+            Prefetch('subgroup_set__student_set', queryset=students)
+        )
+
     def to_representation(self, obj):
         result = super(GroupStateSerializer, self).to_representation(obj)
-        primary_subgroups = obj.subgroup_set
-        print(primary_subgroups.count())
-        if primary_subgroups is not None:
-            if primary_subgroups.count() > 1: 
-                result['primary_subgroups'] = [
-                    {
-                        'subgroup': x.id,
-                        'name': x.name,
-                        'students': ShortStudentSerializer(x.student_set.all(), many=True).data
-                    }
-                    for x in primary_subgroups.all()
-                ]
-            elif primary_subgroups.count() == 1:
-                result['students'] = ShortStudentSerializer(primary_subgroups.first().student_set.all(), many=True).data
-            else:
-                result['students'] = []
-            result['year'] = str(obj.year)
+        # all() is served from the prefetch cache when setup_eager_loading
+        # was used, so evaluate it once instead of calling count()
+        subgroups = list(obj.subgroup_set.all())
+        if len(subgroups) > 1:
+            result['primary_subgroups'] = [
+                {
+                    'subgroup': x.id,
+                    'name': x.name,
+                    'students': ShortStudentSerializer(x.student_set.all(), many=True).data
+                }
+                for x in subgroups
+            ]
+        elif len(subgroups) == 1:
+            result['students'] = ShortStudentSerializer(subgroups[0].student_set.all(), many=True).data
+        else:
+            result['students'] = []
+        result['year'] = str(obj.year)
         return result
 
     class Meta:
@@ -176,11 +245,27 @@ class GroupSerializer(serializers.ModelSerializer):
 class TeacherSerializer(serializers.ModelSerializer):
     department = ShortDepartmentSerializer()
 
+    @staticmethod
+    def setup_eager_loading(queryset):
+        """
+        Evaluate teachers with departments and disciplines prefetched
+        and return them with the context to_representation expects
+        """
+        teachers = list(queryset.select_related('department').prefetch_related(
+            Prefetch('discipline_set', queryset=models.Discipline.objects.order_by('name'))
+        ))
+        return teachers, {'groups': models.Teacher.groups_by_teacher(teachers)}
+
     def to_representation(self, instance):
         result = super(TeacherSerializer, self).to_representation(instance)
-        result['disciplines'] = ShortDisciplineSerializer(instance.disciplines, many=True).data
-        print(instance.groups)
-        result['groups'] = ShortGroupSerializer(instance.groups, many=True).data
+        result['disciplines'] = ShortDisciplineSerializer(
+            instance.discipline_set.all(), many=True
+        ).data
+        if 'groups' in self.context:
+            groups = self.context['groups'].get(instance.id, [])
+        else:
+            groups = instance.groups.with_latest_state()
+        result['groups'] = GroupDirectorySerializer(groups, many=True).data
         return result
 
     class Meta:
@@ -222,9 +307,85 @@ class LessonSerializer(serializers.ModelSerializer):
     discipline = ShortDisciplineSerializer()
     classroom = ShortClassroomSerializer()
     teacher = ShortTeacherSerializer()
-    groups = ShortSubgroupSerializer(many=True)
+    groups = serializers.SerializerMethodField()
+
+    @staticmethod
+    def setup_eager_loading(queryset):
+        return queryset.select_related(
+            'start_time', 'discipline', 'classroom', 'teacher__person'
+        ).prefetch_related('groups')
+
+    def get_groups(self, obj):
+        # Virtual lessons (see timetable.virtual_lessons) aren't saved, so
+        # they carry their subgroups instead of using the m2m manager
+        if obj.pk is None:
+            groups = obj.virtual_groups
+        else:
+            groups = obj.groups.all()
+        return ShortSubgroupSerializer(groups, many=True).data
 
     class Meta:
         model = models.Lesson
         fields = ('id', 'date', 'start_time', 'end_time', 'discipline',
-                  'teacher', 'classroom', 'groups', 'state', 'reason')
+                  'teacher', 'classroom', 'groups', 'state', 'reason',
+                  'prototype')
+
+
+class LessonStateSerializer(serializers.ModelSerializer):
+    class Meta:
+        model = models.Lesson
+        fields = ('state', 'reason')
+
+
+class QueueJoinSerializer(serializers.ModelSerializer):
+    class Meta:
+        model = models.QueueRecord
+        fields = ('student', 'reason')
+
+
+class QueueEntrySerializer(serializers.Serializer):
+    """
+    klimr_main.queues.QueueEntry with its position in context['queue']
+    and expected service time and wait (seconds) in context['waits']
+    """
+    id = serializers.IntegerField()
+    student = serializers.IntegerField()
+    reason = serializers.IntegerField()
+    added_on = serializers.DateTimeField()
+    position = serializers.SerializerMethodField()
+    service = serializers.SerializerMethodField()
+    wait = serializers.SerializerMethodField()
+
+    def get_position(self, obj):
+        return self.context['queue'].position(obj.id)
+
+    def get_estimate(self, obj, i):
+        # Records that left the queue have none
+        estimate = self.context['waits'].get(obj.id)
+        return None if estimate is None else round(estimate[i])
+
+    def get_service(self, obj):
+        return self.get_estimate(obj, 0)
+
+    def get_wait(self, obj):
+        return self.get_estimate(obj, 1)
+
+
+class AssignmentProgressSerializer(serializers.ModelSerializer):
+    person = ShortPersonSerializer(source='student.person')
+
+    class Meta:
+        model = models.AssignmentProgress
+        fields = ('student', 'person', 'discipline', 'completed', 'last_completed_on')
+
+
+class CompletionSerializer(serializers.Serializer):
+    """
+    Ids only, they are checked in bulk by the view
+    """
+    assignments = serializers.ListField(
+        child=serializers.IntegerField(), min_length=1, required=False
+    )
+    students = serializers.ListField(child=serializers.IntegerField(), required=False)
+    completed_on = serializers.DateField(required=False)
+    include_expelled = serializers.BooleanField(default=False)
@@ -0,0 +1,238 @@
+from django.db import transaction
+from django.db.models import Q
+from django.db.models.signals import pre_save, post_save, pre_delete, post_delete, \
+    m2m_changed
+from django.dispatch import receiver
+from klimr_main import caching, export, ical, occupancy, progress, push, \
+    search, timetable, waittime
+from klimr_main.models import Semester, Holiday, LessonTiming, Person, \
+    Department, Course, Group, GroupSemesterState, Subgroup, Teacher, \
+    Student, Discipline, Classroom, LessonPrototype, Lesson, Measurement, \
+    Assignment, CompletedAssignment
+
+# Models whose version counters key ETags and cached responses
+# (see caching.py)
+VERSIONED_MODELS = (
+    Semester, Holiday, LessonTiming, Person, Department, Course, Group,
+    GroupSemesterState, Subgroup, Teacher, Student, Discipline, Classroom,
+    LessonPrototype, Lesson,
+)
+VERSIONED_M2M = (
+    Subgroup.disciplines, Subgroup.teachers, Student.subgroups,
+    Discipline.teachers, LessonPrototype.groups, Lesson.groups,
+)
+
+
+@receiver(post_save, sender=GroupSemesterState)
+@receiver(post_delete, sender=GroupSemesterState)
+def update_group_state_pointers(sender, instance, **kwargs):
+    # Also catch the group this state was moved away from
+    groups = Group.objects.filter(
+        Q(pk=instance.group_id) |
+        Q(first_state=instance.pk) |
+        Q(current_state=instance.pk)
+    )
+    for group in groups:
+        group.update_state_pointers()
+
+
+@receiver(post_save, sender=Person)
+def index_person_name(sender, instance, **kwargs):
+    # Bulk inserts call search.index_persons() themselves
+    search.index([(instance.pk, instance.last_name, instance.first_name, instance.middle_name)])
+
+
+@receiver(post_save, sender=Semester)
+def update_semester_group_pointers(sender, instance, created, **kwargs):
+    # Moving start_on can change which state is the first/current one
+    if created:
+        return
+    for group in Group.objects.filter(states__semester=instance).distinct():
+        group.update_state_pointers()
+
+
+@receiver(post_save, sender=Semester)
+@receiver(post_delete, sender=Semester)
+def renumber_semesters(sender, instance, **kwargs):
+    Semester.renumber()
+
+
+@receiver(post_save, sender=Semester)
+@receiver(post_delete, sender=Semester)
+@receiver(post_save, sender=Holiday)
+@receiver(post_delete, sender=Holiday)
+def invalidate_semester_calendars(sender, **kwargs):
+    timetable.invalidate_calendars()
+
+
+@receiver(post_save, sender=Lesson)
+def push_lesson_state(sender, instance, created, raw=False, **kwargs):
+    # Nobody subscribes to a lesson before it exists
+    if created or raw:
+        return
+
+    def publish():
+        push.publish_lesson(
+            instance.pk, instance.state, instance.reason,
+            instance.groups.values_list('id', flat=True)
+        )
+    transaction.on_commit(publish)
+
+
+@receiver(pre_save, sender=Lesson)
+def remember_lesson(sender, instance, raw=False, **kwargs):
+    # A lesson moved to another semester changes both snapshots, one
+    # moved to another teacher or classroom both feeds, one moved to
+    # another day the occupancy of both
+    instance._old_date = instance._old_feed_key = instance._old_occupancy_key = None
+    if raw or instance.pk is None:
+        return
+    old = Lesson.objects.filter(pk=instance.pk).values(
+        'state', *set(ical.LESSON_FIELDS + occupancy.LESSON_FIELDS)
+    ).first()
+    if old is not None:
+        instance._old_date = old['date']
+        instance._old_feed_key = ical.lesson_key(
+            [old[x] for x in ical.LESSON_FIELDS], old['state']
+        )
+        instance._old_occupancy_key = occupancy.lesson_key(old)
+
+
+@receiver(post_save, sender=Lesson)
+@receiver(post_delete, sender=Lesson)
+def touch_lesson_export(sender, instance, **kwargs):
+    export.touch_dates(
+        [instance.date] + [x for x in [getattr(instance, '_old_date', None)] if x]
+    )
+
+
+@receiver(post_save, sender=Lesson)
+def touch_lesson_feeds(sender, instance, raw=False, **kwargs):
+    if not raw:
+        ical.touch_lesson(instance, getattr(instance, '_old_feed_key', None))
+
+
+@receiver(post_save, sender=Lesson)
+def touch_lesson_occupancy(sender, instance, raw=False, **kwargs):
+    if not raw:
+        occupancy.touch_lesson(instance, getattr(instance, '_old_occupancy_key', None))
+
+
+@receiver(post_delete, sender=Lesson)
+def touch_deleted_lesson_occupancy(sender, instance, **kwargs):
+    occupancy.touch([instance.date])
+
+
+@receiver(pre_delete, sender=Lesson)
+def touch_deleted_lesson_feeds(sender, instance, **kwargs):
+    # Its Lesson.groups rows are gone by post_delete
+    ical.touch('subgroup', instance.groups.values_list('id', flat=True))
+    ical.touch('teacher', [instance.teacher_id])
+    ical.touch('classroom', [instance.classroom_id])
+
+
+@receiver(m2m_changed, sender=Lesson.groups.through)
+def touch_lesson_groups_export(sender, instance, action, reverse, pk_set, **kwargs):
+    if not reverse:
+        if action in ('post_add', 'post_remove', 'post_clear'):
+            export.touch_dates([instance.date])
+    elif action == 'pre_clear':
+        # pk_set isn't given for clear
+        instance._export_dates = list(instance.lesson_set.values_list('date', flat=True))
+    elif action == 'post_clear':
+        export.touch_dates(getattr(instance, '_export_dates', ()))
+    elif action in ('post_add', 'post_remove'):
+        export.touch_dates(Lesson.objects.filter(pk__in=pk_set).values_list('date', flat=True))
+
+
+@receiver(m2m_changed, sender=Lesson.groups.through)
+def touch_lesson_groups_feeds(sender, instance, action, reverse, pk_set, **kwargs):
+    if reverse:
+        if action in ('post_add', 'post_remove', 'post_clear'):
+            ical.touch('subgroup', [instance.pk])
+    elif action == 'pre_clear':
+        instance._feed_subgroups = list(instance.groups.values_list('id', flat=True))
+    elif action == 'post_clear':
+        ical.touch('subgroup', getattr(instance, '_feed_subgroups', ()))
+    elif action in ('post_add', 'post_remove'):
+        ical.touch('subgroup', pk_set)
+
+
+@receiver(post_delete, sender=Subgroup)
+def touch_deleted_subgroup_feed(sender, instance, **kwargs):
+    # Clients holding its ETag get a 404 instead of 304s
+    ical.touch('subgroup', [instance.pk])
+
+
+@receiver(post_save, sender=Measurement)
+def add_service_time(sender, instance, created, raw=False, **kwargs):
+    # Bulk inserts call waittime.add_measurements() themselves
+    if created and not raw:
+        waittime.add_measurements([instance])
+
+
+@receiver(pre_save, sender=CompletedAssignment)
+@receiver(pre_save, sender=Assignment)
+def remember_progress_keys(sender, instance, raw=False, **kwargs):
+    # Moving a completion (or an assignment) to another student or
+    # discipline leaves the old progress row to refresh too
+    instance._old_progress_keys = None
+    if raw or instance.pk is None:
+        return
+    if sender is Assignment:
+        fields = ('id', 'discipline_id')
+    else:
+        fields = ('student_id', 'assignment__discipline_id')
+    instance._old_progress_keys = sender.objects.filter(
+        pk=instance.pk
+    ).values_list(*fields).first()
+
+
+@receiver(post_save, sender=CompletedAssignment)
+@receiver(post_delete, sender=CompletedAssignment)
+def refresh_progress(sender, instance, raw=False, **kwargs):
+    if raw:
+        return
+    students = {instance.student_id}
+    disciplines = {instance.assignment.discipline_id}
+    old = getattr(instance, '_old_progress_keys', None)
+    if old is not None:
+        students.add(old[0])
+        disciplines.add(old[1])
+    progress.refresh(students, disciplines)
+
+
+@receiver(post_save, sender=Assignment)
+def refresh_assignment_progress(sender, instance, raw=False, **kwargs):
+    old = getattr(instance, '_old_progress_keys', None)
+    if raw or old is None or old[1] == instance.discipline_id:
+        return
+    progress.refresh(
+        CompletedAssignment.objects.filter(
+            assignment=instance
+        ).values_list('student_id', flat=True),
+        {old[1], instance.discipline_id}
+    )
+
+
+def bump_model_version(sender, **kwargs):
+    # Only once the change is committed: bumped before, a concurrent GET
+    # could still read the old rows and cache them under the new version
+    transaction.on_commit(lambda: caching.bump_version(sender))
+
+
+def bump_m2m_version(sender, instance, action, model, **kwargs):
+    if action in ('post_add', 'post_remove', 'post_clear'):
+        owner = type(instance)
+
+        def bump():
+            caching.bump_version(owner)
+            caching.bump_version(model)
+        transaction.on_commit(bump)
+
+
+for model in VERSIONED_MODELS:
+    post_save.connect(bump_model_version, sender=model)
+    post_delete.connect(bump_model_version, sender=model)
+for relation in VERSIONED_M2M:
+    m2m_changed.connect(bump_m2m_version, sender=relation.through)
@@ -1,3 +1,1770 @@
-from django.test import TestCase
+import asyncio
+import datetime
+import json
+import os
+import tempfile
+from collections import OrderedDict
+from io import StringIO
+from unittest import mock
+from django.core.cache import cache
+from django.core.management import call_command
+from django.db import transaction
+from django.test import TestCase, TransactionTestCase, override_settings
+from django.utils import timezone
+from klimr_main import caching, export, ical, models, occupancy, push, queues, \
+    rollover, timetable, waittime
+from klimr_main.caching import get_stats
+from klimr_main.pushserver import PushServer
+from klimr_main.views import LessonViewSet
 
-# Create your tests here.
+
+def make_semester(start_on):
+    return models.Semester.objects.create(
+        start_on=start_on,
+        test_week_on=start_on + datetime.timedelta(weeks=8),
+        test_week_end_on=start_on + datetime.timedelta(weeks=9),
+        session_on=start_on + datetime.timedelta(weeks=17),
+        session_end_on=start_on + datetime.timedelta(weeks=20),
+    )
+
+
+def make_person(n):
+    return models.Person.objects.create(
+        first_name='First%d' % n,
+        middle_name='Middle%d' % n,
+        last_name='Last%d' % n
+    )
+
+
+class OnCommitMixin(object):
+    """
+    Run transaction.on_commit() callbacks (version bumps) right away,
+    TestCase never commits
+    """
+    @classmethod
+    def setUpClass(cls):
+        super(OnCommitMixin, cls).setUpClass()
+        cls.on_commit_patcher = mock.patch('django.db.transaction.on_commit', lambda x: x())
+        cls.on_commit_patcher.start()
+
+    @classmethod
+    def tearDownClass(cls):
+        cls.on_commit_patcher.stop()
+        super(OnCommitMixin, cls).tearDownClass()
+
+
+class GroupStateQueriesTest(TestCase):
+    def setUp(self):
+        department = models.Department.objects.create(name='IMCS')
+        self.course = models.Course.objects.create(
+            name='Applied Math', description='', department=department
+        )
+        self.semesters = [
+            make_semester(datetime.date(2016, 9, 1)),
+            make_semester(datetime.date(2017, 2, 1)),
+            make_semester(datetime.date(2017, 9, 1)),
+        ]
+        self.group = models.Group.objects.create(course=self.course)
+
+    def populate(self, semester, subgroups, students):
+        state = models.GroupSemesterState.objects.create(
+            name='B8103a', group=self.group, semester=semester
+        )
+        n = 0
+        for i in range(subgroups):
+            subgroup = models.Subgroup.objects.create(
+                name=str(i + 1), group=state, primary=True
+            )
+            for _ in range(students):
+                n += 1
+                student = models.Student.objects.create(person=make_person(n))
+                student.subgroups.add(subgroup)
+        return state
+
+    def test_retrieve_query_budget(self):
+        self.populate(self.semesters[0], 2, 3)
+        self.populate(self.semesters[2], 2, 3)
+        with self.assertNumQueries(4):
+            small = self.client.get('/api/info/group/%d/' % self.group.pk).json()
+        self.populate(self.semesters[1], 1, 1)
+        self.group.states.get(semester=self.semesters[2]).delete()
+        self.populate(self.semesters[2], 3, 20)
+        with self.assertNumQueries(4):
+            big = self.client.get('/api/info/group/%d/' % self.group.pk).json()
+        self.assertEqual(len(small['primary_subgroups']), 2)
+        self.assertEqual(len(big['primary_subgroups']), 3)
+        self.assertEqual(len(big['primary_subgroups'][2]['students']), 20)
+        self.assertEqual(big['year'], '2')
+        self.assertEqual(big['course']['name'], 'Applied Math')
+
+    def test_state_list_query_budget(self):
+        for semester in self.semesters:
+            self.populate(semester, 2, 5)
+        with self.assertNumQueries(4):
+            states = self.client.get('/api/info/group/%d/state/' % self.group.pk).json()
+        self.assertEqual([x['year'] for x in states], ['1', '1', '2'])
+        self.assertEqual(len(states[0]['primary_subgroups'][1]['students']), 5)
+
+    def test_single_subgroup(self):
+        state = self.populate(self.semesters[0], 1, 4)
+        response = self.client.get(
+            '/api/info/group/%d/state/%d/' % (self.group.pk, state.pk)
+        ).json()
+        self.assertEqual(len(response['students']), 4)
+        self.assertFalse(response['students'][0]['expelled'])
+
+
+class GroupDirectoryTest(TestCase):
+    def setUp(self):
+        department = models.Department.objects.create(name='IMCS')
+        self.course = models.Course.objects.create(
+            name='Applied Math', description='', department=department
+        )
+        self.autumn = make_semester(datetime.date(2016, 9, 1))
+        self.spring = make_semester(datetime.date(2017, 2, 1))
+        for i in range(12):
+            group = models.Group.objects.create(course=self.course)
+            models.GroupSemesterState.objects.create(
+                name='B81%02d' % i, group=group, semester=self.autumn
+            )
+            if i % 2:
+                models.GroupSemesterState.objects.create(
+                    name='B82%02d' % i, group=group, semester=self.spring
+                )
+
+    def test_list_query_budget(self):
+        # COUNT for the paginator plus the page itself
+        with self.assertNumQueries(2):
+            page = self.client.get('/api/info/group/').json()
+        self.assertEqual(page['count'], 12)
+        groups = page['results']
+        self.assertEqual(groups[1]['name'], 'B8201')
+        self.assertEqual(groups[1]['last_semester'], {
+            'id': self.spring.id, 'start_on': '2017-02-01'
+        })
+        self.assertEqual(groups[0]['course']['name'], 'Applied Math')
+
+    def test_filter_and_order(self):
+        groups = self.client.get('/api/info/group/', {
+            'semester': self.autumn.id, 'ordering': '-name'
+        }).json()['results']
+        self.assertEqual(
+            [x['name'] for x in groups],
+            ['B8110', 'B8108', 'B8106', 'B8104', 'B8102', 'B8100']
+        )
+        page = self.client.get('/api/info/group/', {'name': '82'}).json()
+        self.assertEqual(page['count'], 6)
+        year = models.Semester.objects.get(pk=self.spring.pk).year
+        self.assertEqual(
+            self.client.get('/api/info/group/', {'year': year}).json()['count'],
+            models.Group.objects.filter(current_state__semester__year=year).count()
+        )
+        self.assertEqual(
+            self.client.get('/api/info/group/', {'year': year + 10}).json()['count'], 0
+        )
+        for param in ('course', 'semester', 'year'):
+            self.assertEqual(
+                self.client.get('/api/info/group/', {param: 'abc'}).status_code, 400
+            )
+
+
+class GroupStatePointersTest(TestCase):
+    def setUp(self):
+        department = models.Department.objects.create(name='IMCS')
+        course = models.Course.objects.create(
+            name='Applied Math', description='', department=department
+        )
+        self.autumn = make_semester(datetime.date(2016, 9, 1))
+        self.spring = make_semester(datetime.date(2017, 2, 1))
+        self.group = models.Group.objects.create(course=course)
+
+    def refresh(self):
+        return models.Group.objects.select_related(
+            'course', 'first_state__semester', 'current_state__semester'
+        ).get(pk=self.group.pk)
+
+    def test_pointers_follow_writes(self):
+        self.assertIsNone(self.refresh().name)
+        spring = models.GroupSemesterState.objects.create(
+            name='B8203', group=self.group, semester=self.spring
+        )
+        autumn = models.GroupSemesterState.objects.create(
+            name='B8103', group=self.group, semester=self.autumn
+        )
+        group = self.refresh()
+        self.assertEqual(group.first_state, autumn)
+        self.assertEqual(group.current_state, spring)
+        with self.assertNumQueries(0):
+            self.assertEqual(group.name, 'B8203')
+            self.assertEqual(str(group), 'Applied Math (2016-09-01)')
+
+        self.autumn.start_on = datetime.date(2017, 9, 1)
+        self.autumn.save()
+        self.assertEqual(self.refresh().name, 'B8103')
+
+        autumn.delete()
+        group = self.refresh()
+        self.assertEqual(group.first_state, spring)
+        self.assertEqual(group.current_state, spring)
+
+    def test_stale_instance_save(self):
+        # self.group was loaded before the state existed
+        state = models.GroupSemesterState.objects.create(
+            name='B8103', group=self.group, semester=self.autumn
+        )
+        self.group.save()
+        group = self.refresh()
+        self.assertEqual(group.first_state, state)
+        self.assertEqual(group.current_state, state)
+
+    def test_rebuild_command(self):
+        state = models.GroupSemesterState.objects.create(
+            name='B8103', group=self.group, semester=self.autumn
+        )
+        models.Group.objects.update(first_state=None, current_state=None)
+        call_command('rebuild_group_states', stdout=StringIO())
+        self.assertEqual(self.refresh().current_state, state)
+
+
+class SemesterOrdinalTest(TestCase):
+    def test_renumber_on_write(self):
+        spring = make_semester(datetime.date(2017, 2, 1))
+        autumn = make_semester(datetime.date(2017, 9, 1))
+        first = make_semester(datetime.date(2016, 9, 1))
+        ordinals = dict(models.Semester.objects.values_list('id', 'ordinal'))
+        self.assertEqual(ordinals, {first.id: 0, spring.id: 1, autumn.id: 2})
+        self.assertEqual(models.Semester.objects.get(pk=autumn.pk).year, 2)
+
+        first.delete()
+        autumn = models.Semester.objects.get(pk=autumn.pk)
+        self.assertEqual((autumn.ordinal, autumn.year), (1, 1))
+
+        autumn.start_on = datetime.date(2016, 9, 1)
+        autumn.save()
+        ordinals = dict(models.Semester.objects.values_list('id', 'ordinal'))
+        self.assertEqual(ordinals, {autumn.id: 0, spring.id: 1})
+
+
+class TeacherDetailsTest(TestCase):
+    def setUp(self):
+        math = models.Department.objects.create(name='Math')
+        physics = models.Department.objects.create(name='Physics')
+        course = models.Course.objects.create(
+            name='Applied Math', description='', department=math
+        )
+        semester = make_semester(datetime.date(2016, 9, 1))
+        self.person = make_person(0)
+        self.teachers = [
+            models.Teacher.objects.create(person=self.person, department=math),
+            models.Teacher.objects.create(person=self.person, department=physics),
+        ]
+        discipline = models.Discipline.objects.create(name='Calculus', description='')
+        discipline.teachers.add(*self.teachers)
+        self.discipline = discipline
+        timing = models.LessonTiming.objects.create(
+            start=datetime.time(8, 30), end=datetime.time(10, 0)
+        )
+        classroom = models.Classroom.objects.create(name='D734', comments='')
+
+        subgroups = []
+        for i in range(3):
+            group = models.Group.objects.create(course=course)
+            state = models.GroupSemesterState.objects.create(
+                name='B81%02d' % i, group=group, semester=semester
+            )
+            subgroups.append(models.Subgroup.objects.create(
+                name='1', group=state, primary=True
+            ))
+        models.Lesson.objects.bulk_create(
+            models.Lesson(
+                date=semester.start_on + datetime.timedelta(days=i // 4),
+                start_time=timing, end_time=timing, discipline=discipline,
+                teacher=self.teachers[0], classroom=classroom, state=0
+            )
+            for i in range(2000)
+        )
+        Through = models.Lesson.groups.through
+        Through.objects.bulk_create(
+            Through(lesson_id=lesson_id, subgroup=subgroups[lesson_id % 2])
+            for lesson_id in models.Lesson.objects.values_list('id', flat=True)
+        )
+
+    def test_person_query_budget(self):
+        with self.assertNumQueries(5):
+            teachers = self.client.get('/api/info/teacher/%d/' % self.person.pk).json()
+        self.assertEqual(len(teachers), 2)
+        self.assertEqual(
+            teachers[0]['disciplines'], [{'id': self.discipline.id, 'name': 'Calculus'}]
+        )
+        self.assertEqual(
+            [x['name'] for x in teachers[0]['groups']], ['B8100', 'B8101']
+        )
+        self.assertEqual(teachers[1]['groups'], [])
+
+    def test_relation_matches_property(self):
+        teacher = self.client.get('/api/info/teacher/-%d/' % self.teachers[0].pk).json()
+        self.assertEqual(
+            [x['id'] for x in teacher['groups']],
+            sorted(self.teachers[0].groups.values_list('id', flat=True))
+        )
+
+
+class ScheduleTest(TestCase):
+    def setUp(self):
+        department = models.Department.objects.create(name='Math')
+        course = models.Course.objects.create(
+            name='Applied Math', description='', department=department
+        )
+        semester = make_semester(datetime.date(2017, 9, 4))
+        group = models.Group.objects.create(course=course)
+        state = models.GroupSemesterState.objects.create(
+            name='B8103', group=group, semester=semester
+        )
+        self.subgroup = models.Subgroup.objects.create(name='1', group=state, primary=True)
+        teacher = models.Teacher.objects.create(person=make_person(0), department=department)
+        discipline = models.Discipline.objects.create(name='Calculus', description='')
+        classroom = models.Classroom.objects.create(name='D734', comments='')
+        timings = [
+            models.LessonTiming.objects.create(
+                start=datetime.time(8 + 2 * i, 30), end=datetime.time(10 + 2 * i, 0)
+            )
+            for i in range(3)
+        ]
+        # Two weeks, three lessons a day, created out of order
+        for day in reversed(range(14)):
+            for timing in reversed(timings):
+                lesson = models.Lesson.objects.create(
+                    date=semester.start_on + datetime.timedelta(days=day),
+                    start_time=timing, end_time=timing, discipline=discipline,
+                    teacher=teacher, classroom=classroom, state=0
+                )
+                lesson.groups.add(self.subgroup)
+        self.url = '/api/schedule/group/%d/' % self.subgroup.pk
+
+    def test_keyset_pages(self):
+        params = {'from': '2017-09-04', 'to': '2017-09-10', 'limit': 4}
+        seen = []
+        url = self.url
+        while url:
+            with self.assertNumQueries(2):
+                page = self.client.get(url, params).json()
+            params = {}
+            seen.extend((x['date'], x['start_time']) for x in page['results'])
+            url = page['next']
+        self.assertEqual(len(seen), 21)
+        self.assertEqual(seen, sorted(seen))
+        self.assertEqual(seen[0][0], '2017-09-04')
+        self.assertEqual(seen[-1][0], '2017-09-10')
+
+    def test_stream_matches_pages(self):
+        view = self.client.get(self.url, {'from': '2017-09-01', 'to': '2017-09-30', 'limit': 100})
+        with mock.patch.object(LessonViewSet, 'stream_batch_size', 5):
+            response = self.client.get(self.url, {'from': '2017-09-01', 'to': '2017-09-30', 'stream': 1})
+            streamed = json.loads(b''.join(response.streaming_content).decode())
+        self.assertEqual(len(streamed), 42)
+        self.assertEqual(streamed, view.json()['results'])
+
+    def test_invalid_range(self):
+        self.assertEqual(self.client.get(self.url, {'from': 'yesterday'}).status_code, 400)
+        self.assertEqual(self.client.get(self.url, {'cursor': '1,2'}).status_code, 400)
+
+
+class MaterializeTest(TestCase):
+    def setUp(self):
+        department = models.Department.objects.create(name='Math')
+        course = models.Course.objects.create(
+            name='Applied Math', description='', department=department
+        )
+        # Friday, so the first week is a short one
+        self.semester = make_semester(datetime.date(2017, 9, 1))
+        group = models.Group.objects.create(course=course)
+        state = models.GroupSemesterState.objects.create(
+            name='B8103', group=group, semester=self.semester
+        )
+        self.subgroups = [
+            models.Subgroup.objects.create(name=str(i), group=state, primary=True)
+            for i in range(2)
+        ]
+        timing = models.LessonTiming.objects.create(
+            start=datetime.time(8, 30), end=datetime.time(10, 0)
+        )
+        teacher = models.Teacher.objects.create(person=make_person(0), department=department)
+        discipline = models.Discipline.objects.create(name='Calculus', description='')
+        classroom = models.Classroom.objects.create(name='D734', comments='')
+        self.prototypes = []
+        for weektype in (0, 1, 2):
+            prototype = models.LessonPrototype.objects.create(
+                day_of_week=0, weektype=weektype, start_time=timing, end_time=timing,
+                discipline=discipline, teacher=teacher, classroom=classroom
+            )
+            prototype.groups.add(*self.subgroups)
+            self.prototypes.append(prototype)
+        models.Holiday.objects.create(date=datetime.date(2017, 9, 11), reason='Test')
+
+    def test_expand_and_idempotent(self):
+        self.assertEqual(timetable.materialize_semester(self.semester, batch_size=7), 30)
+        self.assertEqual(timetable.materialize_semester(self.semester), 0)
+        dates = lambda weektype: list(models.Lesson.objects.filter(
+            prototype=self.prototypes[weektype]
+        ).values_list('date', flat=True))
+        both, odd, even = dates(0), dates(1), dates(2)
+        # 17 Mondays before the session, minus a holiday and the test week
+        self.assertEqual(len(both), 15)
+        self.assertNotIn(datetime.date(2017, 9, 11), both)
+        self.assertNotIn(datetime.date(2017, 10, 30), both)
+        self.assertEqual(sorted(odd + even), both)
+        # Week of Sep 1 is the first one, so Monday Sep 4 is in an even week
+        self.assertEqual(even[0], datetime.date(2017, 9, 4))
+        # Sep 11 (odd) is a holiday
+        self.assertEqual(odd[0], datetime.date(2017, 9, 25))
+        Links = models.Lesson.groups.through
+        self.assertEqual(Links.objects.count(), 30 * 2)
+
+
+@override_settings(SCHEDULE_VIRTUAL_LESSONS=True)
+class VirtualScheduleTest(MaterializeTest):
+    def get(self, **params):
+        params.setdefault('from', '2017-09-01')
+        params.setdefault('to', '2017-09-30')
+        return self.client.get(
+            '/api/schedule/group/%d/' % self.subgroups[0].pk, params
+        ).json()
+
+    def test_virtual_occurrences(self):
+        lessons = self.get()['results']
+        # Both-weeks prototype on 4, 18, 25 plus even on 4, 18 and odd on 25
+        self.assertEqual(
+            sorted((x['date'], x['prototype']) for x in lessons),
+            [('2017-09-04', self.prototypes[0].id), ('2017-09-04', self.prototypes[2].id),
+             ('2017-09-18', self.prototypes[0].id), ('2017-09-18', self.prototypes[2].id),
+             ('2017-09-25', self.prototypes[0].id), ('2017-09-25', self.prototypes[1].id)]
+        )
+        self.assertIsNone(lessons[0]['id'])
+        self.assertEqual(len(lessons[0]['groups']), 2)
+        self.assertFalse(models.Lesson.objects.exists())
+
+    def test_stored_lesson_wins(self):
+        response = self.client.post(
+            '/api/schedule/prototype/%d/2017-09-18/' % self.prototypes[0].id,
+            {'state': 3, 'reason': 'Flu'}
+        )
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(models.Lesson.objects.get().groups.count(), 2)
+        lessons = self.get(limit=3)
+        self.assertEqual(len(lessons['results']), 3)
+        lessons = self.client.get(lessons['next']).json()['results']
+        self.assertEqual(len(lessons), 3)
+        self.assertEqual(lessons[0]['state'], 3)
+        self.assertEqual(lessons[0]['reason'], 'Flu')
+        self.assertEqual(lessons[0]['id'], response.json()['id'])
+
+    def test_stream(self):
+        timetable.materialize_occurrence(
+            self.prototypes[0], datetime.date(2017, 9, 18), state=3
+        )
+        pages = self.get(limit=100)['results']
+        with mock.patch.object(LessonViewSet, 'stream_days', 3):
+            response = self.client.get(
+                '/api/schedule/group/%d/' % self.subgroups[0].pk,
+                {'from': '2017-09-01', 'to': '2017-09-30', 'stream': 1}
+            )
+            self.assertTrue(response.streaming)
+            streamed = json.loads(b''.join(response.streaming_content).decode())
+        self.assertEqual(len(streamed), 6)
+        self.assertEqual(streamed, pages)
+
+    def test_materialize_checks_occurrence(self):
+        response = self.client.post(
+            '/api/schedule/prototype/%d/2017-09-11/' % self.prototypes[0].id
+        )
+        self.assertEqual(response.status_code, 404)
+
+
+class SemesterCalendarTest(TestCase):
+    def setUp(self):
+        self.semester = make_semester(datetime.date(2017, 9, 1))
+        timetable.invalidate_calendars()
+
+    def test_cached_and_invalidated(self):
+        calendar = timetable.get_calendar(self.semester)
+        with self.assertNumQueries(0):
+            self.assertIs(timetable.get_calendar(self.semester), calendar)
+        holiday = models.Holiday.objects.create(date=datetime.date(2017, 9, 4), reason='Test')
+        calendar = timetable.get_calendar(self.semester)
+        self.assertEqual(calendar.get_flags(holiday.date), calendar.HOLIDAY)
+        self.semester.test_week_on = datetime.date(2017, 9, 4)
+        self.assertEqual(
+            timetable.get_calendar(self.semester).get_flags(holiday.date),
+            calendar.HOLIDAY | calendar.TEST_WEEK
+        )
+
+    def test_endpoint(self):
+        days = self.client.get('/api/info/semester/%d/calendar/' % self.semester.pk).json()
+        self.assertEqual(len(days), 20 * 7 + 1)
+        self.assertEqual(days[0], OrderedDict([
+            ('date', '2017-09-01'), ('week', 1), ('parity', 'odd'),
+            ('holiday', False), ('test_week', False), ('session', False)
+        ]))
+        self.assertEqual(days[3]['week'], 2)
+        self.assertTrue(days[8 * 7]['test_week'])
+        self.assertTrue(days[-1]['session'])
+
+
+class ResponseCacheTest(OnCommitMixin, TestCase):
+    def setUp(self):
+        cache.clear()
+        self.department = models.Department.objects.create(name='Math')
+        models.Course.objects.create(
+            name='Applied Math', description='', department=self.department
+        )
+
+    def test_hit_and_invalidate(self):
+        self.assertEqual(len(self.client.get('/api/info/course/').json()['results']), 1)
+        with self.assertNumQueries(0):
+            courses = self.client.get('/api/info/course/').json()['results']
+        self.assertEqual(courses[0]['department']['name'], 'Math')
+
+        self.department.name = 'Mathematics'
+        self.department.save()
+        courses = self.client.get('/api/info/course/').json()['results']
+        self.assertEqual(courses[0]['department']['name'], 'Mathematics')
+        self.assertEqual(
+            self.client.get('/api/info/cache-stats/').json(),
+            {'hits': 1, 'misses': 2}
+        )
+
+    def test_query_params_and_m2m(self):
+        discipline = models.Discipline.objects.create(name='Calculus', description='')
+        url = '/api/info/discipline/%d/' % discipline.pk
+        self.assertEqual(self.client.get(url).json()['teachers'], [])
+        teacher = models.Teacher.objects.create(
+            person=make_person(0), department=self.department
+        )
+        discipline.teachers.add(teacher)
+        self.assertEqual(self.client.get(url).json()['teachers'], [teacher.pk])
+        self.assertEqual(self.client.get(url, {'page': 1}).status_code, 200)
+        self.assertEqual(get_stats(), {'hits': 0, 'misses': 3})
+
+
+class VersionBumpTest(TransactionTestCase):
+    def test_bumped_on_commit(self):
+        cache.clear()
+        version = caching.get_versions(models.Department)
+        with transaction.atomic():
+            department = models.Department.objects.create(name='Math')
+            # Other connections can't see the row yet
+            self.assertEqual(caching.get_versions(models.Department), version)
+        self.assertNotEqual(caching.get_versions(models.Department), version)
+        version = caching.get_versions(models.Department)
+        with transaction.atomic():
+            department.name = 'Mathematics'
+            department.save()
+            transaction.set_rollback(True)
+        self.assertEqual(caching.get_versions(models.Department), version)
+
+
+class ConditionalGetTest(OnCommitMixin, ScheduleTest):
+    def setUp(self):
+        cache.clear()
+        super(ConditionalGetTest, self).setUp()
+        self.params = {'from': '2017-09-04', 'to': '2017-09-10'}
+
+    def test_not_modified(self):
+        response = self.client.get(self.url, self.params)
+        etag = response['ETag']
+        with self.assertNumQueries(0):
+            response = self.client.get(self.url, self.params, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 304)
+        self.assertEqual(response.content, b'')
+        # The ETag is the only validator
+        self.assertFalse(response.has_header('Last-Modified'))
+        response = self.client.get(
+            self.url, self.params, HTTP_IF_MODIFIED_SINCE='Mon, 01 Jan 2035 00:00:00 GMT'
+        )
+        self.assertEqual(response.status_code, 200)
+
+        # Other range, other ETag
+        response = self.client.get(self.url, {'from': '2017-09-11'}, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 200)
+
+        lesson = models.Lesson.objects.first()
+        lesson.state = 3
+        lesson.save()
+        response = self.client.get(self.url, self.params, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 200)
+        self.assertNotEqual(response['ETag'], etag)
+
+    def test_m2m_change(self):
+        etag = self.client.get('/api/info/group/', {'page': 1})['ETag']
+        self.assertEqual(self.client.get(
+            '/api/info/group/', {'page': 1}, HTTP_IF_NONE_MATCH=etag
+        ).status_code, 304)
+        models.Student.objects.create(person=make_person(1)).subgroups.add(self.subgroup)
+        self.assertEqual(self.client.get(
+            '/api/info/group/', {'page': 1}, HTTP_IF_NONE_MATCH=etag
+        ).status_code, 200)
+
+    def test_detail_and_list_views(self):
+        lesson = models.Lesson.objects.first()
+        person = models.Person.objects.first()
+        urls = [
+            '/api/schedule/%d/' % lesson.pk,
+            '/api/info/person/',
+            '/api/info/person/%d/' % person.pk,
+            '/api/info/person/search/?q=last0',
+        ]
+        etags = {}
+        for url in urls:
+            etags[url] = self.client.get(url)['ETag']
+            with self.assertNumQueries(0):
+                response = self.client.get(url, HTTP_IF_NONE_MATCH=etags[url])
+            self.assertEqual(response.status_code, 304, url)
+        person.last_name = 'Last00'
+        person.save()
+        for url in urls:
+            self.assertEqual(
+                self.client.get(url, HTTP_IF_NONE_MATCH=etags[url]).status_code, 200, url
+            )
+
+
+class QueueTestCase(TestCase):
+    def setUp(self):
+        cache.clear()
+        queues._queues.clear()
+        department = models.Department.objects.create(name='Math')
+        timing = models.LessonTiming.objects.create(
+            start=datetime.time(8, 30), end=datetime.time(10, 0)
+        )
+        self.lesson = models.Lesson.objects.create(
+            date=datetime.date(2017, 9, 4), start_time=timing, end_time=timing,
+            discipline=models.Discipline.objects.create(name='Calculus', description=''),
+            teacher=models.Teacher.objects.create(
+                person=make_person(0), department=department
+            ),
+            classroom=models.Classroom.objects.create(name='D734', comments=''),
+            state=0
+        )
+        self.students = [
+            models.Student.objects.create(person=make_person(i + 1)) for i in range(5)
+        ]
+        self.url = '/api/schedule/%d/queue/' % self.lesson.pk
+
+    def join_all(self):
+        return [
+            self.client.post(self.url, {'student': x.pk, 'reason': 1}).json()['id']
+            for x in self.students
+        ]
+
+    def get_order(self):
+        return [x['id'] for x in self.client.get(self.url).json()]
+
+    def get_stored_order(self):
+        return list(models.AdvisedQueue.objects.filter(
+            record__lesson=self.lesson, record__left_on__isnull=True
+        ).order_by('rank').values_list('record_id', flat=True))
+
+    def measure(self, times_and_reasons):
+        for i, (time, reason) in enumerate(times_and_reasons):
+            record = models.QueueRecord.objects.create(
+                student=self.students[i % len(self.students)],
+                lesson=self.lesson, reason=reason
+            )
+            models.Measurement.objects.create(
+                user=self.students[0].person, lesson=self.lesson,
+                record=record, time=time
+            )
+
+
+class QueueTest(QueueTestCase):
+    def test_join_and_peek(self):
+        records = self.join_all()
+        with self.assertNumQueries(0):
+            queue = self.client.get(self.url).json()
+        self.assertEqual([x['id'] for x in queue], records)
+        self.assertEqual([x['position'] for x in queue], [1, 2, 3, 4, 5])
+        self.assertEqual(len(self.client.get(self.url, {'count': 2}).json()), 2)
+        self.assertEqual(len(self.client.get(self.url, {'count': -2}).json()), 1)
+        response = self.client.get('%s%d/' % (self.url, records[3]))
+        self.assertEqual(response.json()['position'], 4)
+
+        response = self.client.post(self.url, {'student': self.students[0].pk, 'reason': 0})
+        self.assertEqual(response.status_code, 400)
+        response = self.client.post(
+            '/api/schedule/0/queue/', {'student': self.students[0].pk, 'reason': 0}
+        )
+        self.assertEqual(response.status_code, 404)
+
+    def test_unknown_lesson(self):
+        for url in ('/api/schedule/0/queue/', '/api/schedule/0/queue/1/'):
+            self.assertEqual(self.client.get(url).status_code, 404)
+        self.assertNotIn(0, queues._queues)
+
+    def test_leave_and_next(self):
+        records = self.join_all()
+        response = self.client.delete('%s%d/' % (self.url, records[1]))
+        self.assertEqual(response.status_code, 204)
+        self.assertEqual(self.client.post(self.url + 'next/').json()['id'], records[0])
+        self.assertEqual(self.get_order(), records[2:])
+        self.assertEqual(self.get_stored_order(), records[2:])
+        self.assertEqual(models.QueueRecord.objects.filter(left_on__isnull=False).count(), 2)
+        self.assertEqual(self.client.get('%s%d/' % (self.url, records[1])).status_code, 404)
+        # Served students may queue again
+        response = self.client.post(self.url, {'student': self.students[0].pk, 'reason': 2})
+        self.assertEqual(response.json()['position'], 4)
+
+    def test_move(self):
+        records = self.join_all()
+        expected = list(records)
+        # Enough moves to the front to run out of room between ranks
+        for i in range(15):
+            record = expected.pop()
+            expected.insert(0, record)
+            response = self.client.post(
+                '%s%d/move/' % (self.url, record), {'position': 1}
+            )
+            self.assertEqual(response.json()['position'], 1)
+        self.assertEqual(self.get_order(), expected)
+        self.assertEqual(self.get_stored_order(), expected)
+        self.client.post('%s%d/move/' % (self.url, expected[0]), {'position': 3})
+        expected.insert(2, expected.pop(0))
+        self.assertEqual(self.get_stored_order(), expected)
+
+    def test_reload_after_other_process(self):
+        records = self.join_all()
+        self.get_order()
+        # Another process took the first record and bumped the counter
+        models.QueueRecord.objects.filter(pk=records[0]).update(left_on=timezone.now())
+        self.assertEqual(self.get_order(), records)
+        caching.bump_counter(queues.QUEUE_VERSION_KEY % self.lesson.pk)
+        self.assertEqual(self.get_order(), records[1:])
+
+
+class PushTest(QueueTestCase):
+    def setUp(self):
+        super(PushTest, self).setUp()
+        self.messages = []
+        self.broker = push.get_broker()
+        self.broker.listen(self.listen)
+
+    def tearDown(self):
+        self.broker.unlisten(self.listen)
+
+    def listen(self, channel, data):
+        self.messages.append((channel, data))
+
+    def test_queue_changes(self):
+        records = self.join_all()
+        self.client.post('%s%d/move/' % (self.url, records[4]), {'position': 1})
+        self.client.post(self.url + 'next/')
+        channel = 'lesson:%d' % self.lesson.pk
+        self.assertEqual({x[0] for x in self.messages}, {channel})
+        messages = [x[1] for x in self.messages]
+        self.assertEqual([x['op'] for x in messages], ['join'] * 5 + ['move', 'next'])
+        self.assertEqual([x['length'] for x in messages], [1, 2, 3, 4, 5, 5, 4])
+        self.assertEqual(messages[5]['position'], 1)
+        self.assertEqual(messages[6]['record'], records[4])
+        self.assertIsNone(messages[6]['position'])
+        versions = [x['version'] for x in messages]
+        self.assertEqual(versions, list(range(versions[0], versions[0] + 7)))
+
+    def test_lesson_state(self):
+        subgroup = models.Subgroup.objects.create(
+            name='1', primary=True, group=models.GroupSemesterState.objects.create(
+                name='B8103', semester=make_semester(datetime.date(2017, 9, 4)),
+                group=models.Group.objects.create(course=models.Course.objects.create(
+                    name='Applied Math', description='',
+                    department=models.Department.objects.first()
+                ))
+            )
+        )
+        self.lesson.groups.add(subgroup)
+        self.lesson.state = 3
+        self.lesson.reason = 'Sick'
+        with mock.patch('klimr_main.signals.transaction.on_commit', lambda x: x()):
+            self.lesson.save()
+        data = {'type': 'lesson', 'id': self.lesson.pk, 'state': 3, 'reason': 'Sick'}
+        self.assertEqual(self.messages, [
+            ('lesson:%d' % self.lesson.pk, data), ('subgroup:%d' % subgroup.pk, data)
+        ])
+
+    def test_server(self):
+        loop = asyncio.new_event_loop()
+
+        async def run():
+            server = PushServer(loop=loop)
+            await server.start('127.0.0.1', 0)
+            port = server.server.sockets[0].getsockname()[1]
+            reader, writer = await asyncio.open_connection('127.0.0.1', port, loop=loop)
+            writer.write(b'GET /events/lesson/1/ HTTP/1.1\r\n\r\n')
+            headers = await reader.readuntil(b'retry: 3000\n\n')
+            self.assertIn(b'text/event-stream', headers)
+            body = json.dumps([
+                {'channel': 'lesson:2', 'data': {'type': 'lesson', 'id': 2}},
+                {'channel': 'lesson:1', 'data': {'type': 'lesson', 'id': 1}},
+            ]).encode('utf-8')
+            publisher, request = await asyncio.open_connection('127.0.0.1', port, loop=loop)
+            request.write(b'POST /publish HTTP/1.1\r\nContent-Length: %d\r\n\r\n' % len(body) + body)
+            self.assertIn(b'204', await publisher.read())
+            event = await reader.readuntil(b'\n\n')
+            self.assertEqual(event, b'id: 1\nevent: lesson\ndata: {"type":"lesson","id":1}\n\n')
+            writer.close()
+            await server.stop()
+        try:
+            loop.run_until_complete(run())
+        finally:
+            loop.close()
+
+
+class WaitTimeTest(QueueTestCase):
+    def get_stats(self):
+        return sorted(models.ServiceTimeStats.objects.values_list(
+            'reason', 'count', 'total'
+        ))
+
+    def test_incremental_and_rebuild(self):
+        # 100s/300s for assignments, 60s for autographs; the first
+        # measurement and the 2h break don't count
+        self.measure([(0, 1), (100, 1), (400, 1), (460, 0), (7660, 1), (7720, 0)])
+        stats = self.get_stats()
+        self.assertEqual(stats, [(0, 2, 120.0), (1, 2, 400.0)])
+        self.assertEqual(waittime.rebuild(), 2)
+        self.assertEqual(self.get_stats(), stats)
+
+    def test_estimates(self):
+        estimator = waittime.get_estimator()
+        self.assertEqual(
+            estimator.service_time(self.lesson.discipline_id, self.lesson.teacher_id, 1),
+            waittime.DEFAULT_SERVICE_TIME
+        )
+        self.measure([(i * 100, 1) for i in range(21)])
+        estimator = waittime.get_estimator()
+        service = estimator.service_time(self.lesson.discipline_id, self.lesson.teacher_id, 1)
+        # 20 samples of 100s pull the default towards them
+        self.assertLess(service, 150)
+        self.assertGreater(service, 100)
+        # Another teacher falls back to the discipline
+        other = estimator.service_time(self.lesson.discipline_id, 0, 1)
+        self.assertGreater(other, service)
+        self.assertLess(other, waittime.DEFAULT_SERVICE_TIME)
+
+        models.QueueRecord.objects.update(left_on=timezone.now())
+        records = self.join_all()
+        queue = self.client.get(self.url).json()
+        self.assertEqual([x['wait'] for x in queue], [round(service * i) for i in range(5)])
+        self.assertEqual(self.client.get(
+            '%s%d/' % (self.url, records[2])
+        ).json()['service'], round(service))
+
+
+class AdvisedQueueTest(QueueTestCase):
+    def setUp(self):
+        super(AdvisedQueueTest, self).setUp()
+        # 60s autographs, 600s+ assignments
+        self.measure([(i * 60, 0) for i in range(21)] + [(2000 + i * 600, 1) for i in range(10)])
+        models.QueueRecord.objects.update(left_on=timezone.now())
+        self.students += [
+            models.Student.objects.create(person=make_person(i + 10)) for i in range(3)
+        ]
+
+    def join(self, student, reason):
+        return self.client.post(self.url, {'student': student.pk, 'reason': reason}).json()
+
+    def test_shortest_first_with_overtake_limit(self):
+        assignments = [self.join(x, 1)['id'] for x in self.students[:4]]
+        ranks = dict(models.AdvisedQueue.objects.values_list('record_id', 'rank'))
+        autographs = [self.join(x, 0) for x in self.students[4:]]
+        self.assertEqual([x['position'] for x in autographs], [1, 2, 3, 8])
+        order = self.get_order()
+        self.assertEqual(
+            order, [x['id'] for x in autographs[:3]] + assignments + [autographs[3]['id']]
+        )
+        self.assertEqual(self.get_stored_order(), order)
+        # Joining didn't touch the ranks of the others
+        stored = dict(models.AdvisedQueue.objects.values_list('record_id', 'rank'))
+        self.assertEqual({x: stored[x] for x in ranks}, ranks)
+        self.assertLess(autographs[1]['wait'], autographs[3]['wait'])
+
+        # Reloaded queues know who was overtaken already
+        queues._queues.clear()
+        self.assertEqual(queues.get_queue(self.lesson.pk).get(assignments[0]).overtaken, 3)
+
+    @override_settings(QUEUE_MAX_OVERTAKES=0)
+    def test_first_come_first_served(self):
+        records = [self.join(x, i % 2)['id'] for i, x in enumerate(self.students)]
+        self.assertEqual(self.get_order(), records)
+
+
+class MeasurementIngestTest(QueueTestCase):
+    bulk_url = '/api/measurement/bulk/'
+
+    def setUp(self):
+        super(MeasurementIngestTest, self).setUp()
+        self.records = self.join_all()
+        self.person = self.students[0].person_id
+
+    def item(self, i, **kwargs):
+        item = {'user': self.person, 'lesson': self.lesson.pk,
+                'record': self.records[i], 'time': i * 100}
+        item.update(kwargs)
+        return item
+
+    def test_json(self):
+        items = [self.item(i) for i in range(5)] + [
+            self.item(0, user=0),
+            self.item(1, lesson=0),
+            self.item(2, record=0, time='x'),
+            [],
+        ]
+        # Lookups and inserts don't depend on the number of items
+        with self.assertNumQueries(12):
+            response = self.client.post(
+                self.bulk_url + '?batch_size=2', json.dumps(items),
+                content_type='application/json'
+            )
+        self.assertEqual(response.status_code, 201)
+        result = response.json()
+        self.assertEqual(result['created'], 5)
+        self.assertEqual([x['index'] for x in result['errors']], [5, 6, 7, 8])
+        self.assertEqual(list(result['errors'][0]['errors']), ['user'])
+        self.assertEqual(list(result['errors'][1]['errors']), ['lesson'])
+        self.assertEqual(result['errors'][2]['errors'], {'time': ['A valid integer is required.']})
+        self.assertEqual(models.Measurement.objects.count(), 5)
+        # Service times of the bulk insert were folded in
+        self.assertEqual(
+            list(models.ServiceTimeStats.objects.values_list('count', 'total')), [(4, 400.0)]
+        )
+
+    def test_ndjson(self):
+        body = '\n'.join(json.dumps(self.item(i)) for i in range(3)) + '\n{oops\n\n'
+        response = self.client.post(self.bulk_url, body, content_type='application/x-ndjson')
+        self.assertEqual(response.json()['created'], 3)
+        self.assertEqual(response.json()['errors'][0]['index'], 3)
+        response = self.client.post(self.bulk_url, '{oops', content_type='application/x-ndjson')
+        self.assertEqual(response.status_code, 400)
+        response = self.client.post(
+            self.bulk_url, b'{"time": 1}\n\xff\xfe\n', content_type='application/x-ndjson'
+        )
+        self.assertEqual(response.status_code, 400)
+        response = self.client.post(self.bulk_url, '{}', content_type='application/json')
+        self.assertEqual(response.status_code, 400)
+
+
+class ProgressTest(TestCase):
+    def setUp(self):
+        department = models.Department.objects.create(name='Math')
+        self.group = models.Group.objects.create(course=models.Course.objects.create(
+            name='Applied Math', description='', department=department
+        ))
+        state = models.GroupSemesterState.objects.create(
+            name='B8103', group=self.group, semester=make_semester(datetime.date(2017, 9, 4))
+        )
+        subgroups = [
+            models.Subgroup.objects.create(name=str(i), group=state, primary=i == 1)
+            for i in range(1, 3)
+        ]
+        self.students = []
+        for i in range(3):
+            student = models.Student.objects.create(person=make_person(i))
+            student.subgroups.add(*subgroups[:i + 1 if i < 2 else 1])
+            self.students.append(student)
+        self.disciplines = [
+            models.Discipline.objects.create(name=x, description='') for x in ('Calculus', 'Algebra')
+        ]
+        self.assignments = [
+            models.Assignment.objects.create(discipline=x, name=str(i), description='')
+            for x in self.disciplines for i in range(3)
+        ]
+        self.url = '/api/info/group/%d/progress/' % self.group.pk
+
+    def complete(self, student, assignment, day):
+        return models.CompletedAssignment.objects.create(
+            student=self.students[student], assignment=self.assignments[assignment],
+            completed_on=datetime.date(2017, 9, day)
+        )
+
+    def get_progress(self):
+        return sorted(models.AssignmentProgress.objects.values_list(
+            'student_id', 'discipline_id', 'completed', 'last_completed_on'
+        ))
+
+    def test_incremental(self):
+        self.complete(0, 0, 5)
+        last = self.complete(0, 1, 7)
+        self.complete(1, 3, 6)
+        s, d = self.students, self.disciplines
+        self.assertEqual(self.get_progress(), [
+            (s[0].pk, d[0].pk, 2, datetime.date(2017, 9, 7)),
+            (s[1].pk, d[1].pk, 1, datetime.date(2017, 9, 6)),
+        ])
+        last.delete()
+        self.assertEqual(self.get_progress()[0], (s[0].pk, d[0].pk, 1, datetime.date(2017, 9, 5)))
+        # Moved to another student
+        completion = models.CompletedAssignment.objects.get(student=s[1])
+        completion.student = s[2]
+        completion.save()
+        self.assertEqual(self.get_progress()[1], (s[2].pk, d[1].pk, 1, datetime.date(2017, 9, 6)))
+        # Assignment moved to another discipline
+        assignment = self.assignments[0]
+        assignment.discipline = d[1]
+        assignment.save()
+        expected = [
+            (s[0].pk, d[1].pk, 1, datetime.date(2017, 9, 5)),
+            (s[2].pk, d[1].pk, 1, datetime.date(2017, 9, 6)),
+        ]
+        self.assertEqual(self.get_progress(), expected)
+        models.AssignmentProgress.objects.all().delete()
+        out = StringIO()
+        call_command('rebuild_progress', stdout=out)
+        self.assertIn('Rebuilt 2 row(s)', out.getvalue())
+        self.assertEqual(self.get_progress(), expected)
+
+    def test_group_progress(self):
+        for student in range(3):
+            for assignment in range(student + 1):
+                self.complete(student, assignment, 10 + assignment)
+        self.complete(1, 4, 20)
+        with self.assertNumQueries(1):
+            progress = self.client.get(self.url).json()
+        # The student in both subgroups is listed once per discipline
+        self.assertEqual(
+            [(x['person']['last_name'], x['completed']) for x in progress],
+            [('Last0', 1), ('Last1', 2), ('Last1', 1), ('Last2', 3)]
+        )
+        progress = self.client.get(self.url, {'discipline': self.disciplines[1].pk}).json()
+        self.assertEqual([x['student'] for x in progress], [self.students[1].pk])
+        self.assertEqual(self.client.get(self.url, {'state': 0}).json(), [])
+        for param in ('state', 'discipline'):
+            self.assertEqual(self.client.get(self.url, {param: 'x'}).status_code, 400)
+
+    def mark(self, url, data):
+        return self.client.post(url, json.dumps(data), content_type='application/json')
+
+    def test_mark_completed(self):
+        timing = models.LessonTiming.objects.create(
+            start=datetime.time(8, 30), end=datetime.time(10, 0)
+        )
+        department = models.Department.objects.first()
+        lesson = models.Lesson.objects.create(
+            date=datetime.date(2017, 9, 4), start_time=timing, end_time=timing,
+            discipline=self.disciplines[0], state=0,
+            teacher=models.Teacher.objects.create(person=make_person(9), department=department),
+            classroom=models.Classroom.objects.create(name='D734', comments='')
+        )
+        lesson.groups.add(*models.Subgroup.objects.all())
+        lesson.assignments.add(*self.assignments[:2])
+        url = '/api/schedule/%d/completed/' % lesson.pk
+        self.complete(0, 0, 1)
+        response = self.mark(url, {})
+        self.assertEqual(response.status_code, 201)
+        self.assertEqual(response.json(), {'created': 5, 'existing': 1})
+        s, d = self.students, self.disciplines
+        self.assertEqual(self.get_progress(), [
+            (s[0].pk, d[0].pk, 2, datetime.date(2017, 9, 4)),
+            (s[1].pk, d[0].pk, 2, datetime.date(2017, 9, 4)),
+            (s[2].pk, d[0].pk, 2, datetime.date(2017, 9, 4)),
+        ])
+        response = self.mark(url, {
+            'assignments': [self.assignments[2].pk], 'students': [s[1].pk],
+            'completed_on': '2017-09-08'
+        })
+        self.assertEqual(response.json(), {'created': 1, 'existing': 0})
+        self.assertEqual(self.get_progress()[1], (s[1].pk, d[0].pk, 3, datetime.date(2017, 9, 8)))
+        self.assertEqual(self.mark(url, {
+            'assignments': [self.assignments[2].pk], 'students': [s[1].pk]
+        }).status_code, 200)
+        # Other discipline
+        self.assertEqual(self.mark(
+            url, {'assignments': [self.assignments[3].pk]}
+        ).status_code, 400)
+        # Not in the lesson's subgroups
+        stranger = models.Student.objects.create(person=make_person(5))
+        self.assertEqual(self.mark(url, {'students': [stranger.pk]}).status_code, 400)
+        # The number of queries doesn't depend on the number of students
+        for i in range(30):
+            models.Student.objects.create(person=make_person(10 + i)).subgroups.add(
+                models.Subgroup.objects.first()
+            )
+        with self.assertNumQueries(15):
+            response = self.mark(url, {
+                'assignments': [x.pk for x in self.assignments[:3]]
+            })
+        self.assertEqual(response.json(), {'created': 92, 'existing': 7})
+
+    def test_mark_expelled(self):
+        timing = models.LessonTiming.objects.create(
+            start=datetime.time(8, 30), end=datetime.time(10, 0)
+        )
+        lesson = models.Lesson.objects.create(
+            date=datetime.date(2017, 9, 4), start_time=timing, end_time=timing,
+            discipline=self.disciplines[0], state=0,
+            teacher=models.Teacher.objects.create(
+                person=make_person(9), department=models.Department.objects.first()
+            ),
+            classroom=models.Classroom.objects.create(name='D734', comments='')
+        )
+        lesson.groups.add(*models.Subgroup.objects.all())
+        expelled = self.students[2]
+        expelled.expelled_in = models.Semester.objects.first()
+        expelled.save()
+        url = '/api/schedule/%d/completed/' % lesson.pk
+        assignments = [self.assignments[0].pk]
+        self.assertEqual(self.mark(url, {'assignments': assignments}).json(), {
+            'created': 2, 'existing': 0
+        })
+        self.assertNotIn(expelled.pk, [x[0] for x in self.get_progress()])
+        self.assertEqual(self.mark(
+            url, {'assignments': assignments, 'students': [expelled.pk]}
+        ).status_code, 400)
+        self.assertEqual(self.mark(
+            url, {'assignments': assignments, 'include_expelled': True}
+        ).json(), {'created': 1, 'existing': 2})
+        self.assertIn(expelled.pk, [x[0] for x in self.get_progress()])
+
+
+class RosterImportTest(TestCase):
+    def setUp(self):
+        cache.clear()
+        department = models.Department.objects.create(name='Math')
+        self.course = models.Course.objects.create(
+            name='Applied Math', description='', department=department
+        )
+        self.semester = make_semester(datetime.date(2017, 9, 4))
+        self.url = '/api/roster/import/?semester=%d' % self.semester.pk
+
+    def roster(self, count, group_size=4):
+        lines = ['last_name,first_name,middle_name,group,subgroup,course']
+        for i in range(count):
+            lines.append('Last%d,First%d,Middle%d,B81%02d,%d,%d' % (
+                i, i, i, i // group_size, i % 2 + 1, self.course.pk
+            ))
+        return '\n'.join(lines) + '\n'
+
+    def test_csv(self):
+        existing = make_person(1)
+        response = self.client.post(self.url, self.roster(10), content_type='text/csv')
+        self.assertEqual(response.status_code, 201)
+        result = response.json()
+        self.assertEqual(
+            [result[x] for x in ('rows', 'groups', 'subgroups', 'persons', 'students', 'links')],
+            [10, 3, 6, 9, 10, 10]
+        )
+        self.assertEqual(result['errors'], [])
+        self.assertIn('total', result['timings'])
+        self.assertEqual(models.Student.objects.get(person=existing).subgroups.get().name, '2')
+        state = models.GroupSemesterState.objects.get(name='B8100')
+        self.assertEqual(state.group.current_state, state)
+        self.assertEqual(
+            sorted(state.subgroup_set.values_list('name', 'primary')), [('1', True), ('2', False)]
+        )
+        # Importing again only adds what's new, with the same number of
+        # queries however many rows there are
+        with self.assertNumQueries(17):
+            result = self.client.post(
+                self.url, self.roster(11), content_type='text/csv'
+            ).json()
+        self.assertEqual(
+            [result[x] for x in ('rows', 'groups', 'subgroups', 'persons', 'students', 'links')],
+            [11, 0, 0, 1, 1, 1]
+        )
+        with self.assertNumQueries(17):
+            self.client.post(self.url, self.roster(12), content_type='text/csv')
+        self.assertEqual(models.Student.objects.count(), 12)
+
+    def test_errors(self):
+        rows = [
+            {'last_name': 'Last0', 'first_name': 'First0', 'group': 'B8100', 'subgroup': '1',
+             'course': self.course.pk},
+            {'last_name': 'Last1', 'first_name': '', 'group': 'B8100', 'subgroup': '1'},
+            {'last_name': 'Last2', 'first_name': 'First2', 'group': 'B8200', 'subgroup': '1'},
+            {'last_name': 'Last3', 'first_name': 'First3', 'group': 'B8100', 'subgroup': '1',
+             'course': 'x'},
+            'x',
+        ]
+        response = self.client.post(self.url, json.dumps(rows), content_type='application/json')
+        self.assertEqual(response.status_code, 201)
+        result = response.json()
+        self.assertEqual(result['rows'], 1)
+        self.assertEqual([x['index'] for x in result['errors']], [1, 2, 3, 4])
+        self.assertEqual(list(result['errors'][0]['errors']), ['first_name'])
+        self.assertEqual(list(result['errors'][1]['errors']), ['course'])
+        self.assertEqual(self.client.post(
+            '/api/roster/import/', json.dumps(rows), content_type='application/json'
+        ).status_code, 400)
+
+    def test_command(self):
+        out = StringIO()
+        with tempfile.TemporaryDirectory() as directory:
+            path = os.path.join(directory, 'roster.csv')
+            with open(path, 'w') as f:
+                f.write(self.roster(5))
+            call_command('import_roster', str(self.semester.pk), path, stdout=out)
+        self.assertIn('Imported 5 row(s): 2 group(s), 3 subgroup(s), 5 person(s)', out.getvalue())
+
+
+class RolloverTest(TestCase):
+    def setUp(self):
+        department = models.Department.objects.create(name='Math')
+        course = models.Course.objects.create(
+            name='Applied Math', description='', department=department
+        )
+        self.source = make_semester(datetime.date(2017, 2, 6))
+        self.target = make_semester(datetime.date(2017, 9, 4))
+        self.discipline = models.Discipline.objects.create(name='Calculus', description='')
+        self.teacher = models.Teacher.objects.create(person=make_person(0), department=department)
+        self.students = [models.Student.objects.create(person=make_person(i + 1)) for i in range(4)]
+        self.students[3].expelled_in = self.source
+        self.students[3].save()
+        self.groups = []
+        for i in range(3):
+            group = models.Group.objects.create(course=course)
+            state = models.GroupSemesterState.objects.create(
+                name='B81%02d' % i, group=group, semester=self.source,
+                # The praepostor of the second group was expelled
+                praepostor=self.students[3 if i == 1 else 0]
+            )
+            for j in range(2):
+                subgroup = models.Subgroup.objects.create(
+                    name=str(j + 1), group=state, primary=j == 0
+                )
+                subgroup.disciplines.add(self.discipline)
+                subgroup.teachers.add(self.teacher)
+                subgroup.student_set.add(*self.students[j:j + 3])
+            self.groups.append(group)
+
+    def test_rollover(self):
+        out = StringIO()
+        call_command('rollover_semester', str(self.source.pk), str(self.target.pk),
+                     '--dry-run', stdout=out)
+        self.assertIn(
+            'Would copy 3 states, 6 subgroups, 6 disciplines, 6 teachers, 15 students',
+            out.getvalue()
+        )
+        self.assertFalse(models.GroupSemesterState.objects.filter(semester=self.target).exists())
+
+        # Already rolled over groups are skipped
+        models.GroupSemesterState.objects.create(
+            name='B8202', group=self.groups[2], semester=self.target
+        )
+        with self.assertNumQueries(18):
+            counts = rollover.rollover(self.source, self.target)
+        self.assertEqual(list(counts.values()), [2, 4, 4, 4, 10])
+        praepostors = [self.students[0], None]
+        for group, praepostor in zip(self.groups[:2], praepostors):
+            group.refresh_from_db()
+            state = group.current_state
+            self.assertEqual(state.semester, self.target)
+            self.assertEqual(state.praepostor, praepostor)
+            self.assertEqual(group.first_state.semester, self.source)
+            subgroups = state.subgroup_set.order_by('name')
+            self.assertEqual([(x.name, x.primary) for x in subgroups], [('1', True), ('2', False)])
+            self.assertEqual(
+                [sorted(x.student_set.values_list('id', flat=True)) for x in subgroups],
+                [[x.pk for x in self.students[:3]], [x.pk for x in self.students[1:3]]]
+            )
+            self.assertEqual(list(subgroups[1].teachers.all()), [self.teacher])
+            self.assertEqual(list(subgroups[1].disciplines.all()), [self.discipline])
+        self.assertEqual(list(rollover.rollover(self.source, self.target).values()), [0] * 5)
+
+
+class PersonSearchTest(TestCase):
+    def setUp(self):
+        department = models.Department.objects.create(name='Math')
+        names = [
+            ('Ёлкин', 'Пётр', 'Иванович'),
+            ('Елисеева', 'Анна', 'Петровна'),
+            ('Иванов', 'Иван', 'Сергеевич'),
+            ('Иванова', 'Мария', 'Ивановна'),
+            ('Петров-Иванов', 'Олег', ''),
+        ]
+        self.persons = [
+            models.Person.objects.create(last_name=x, first_name=y, middle_name=z)
+            for x, y, z in names
+        ]
+        models.Teacher.objects.create(person=self.persons[2], department=department)
+        models.Student.objects.create(person=self.persons[3])
+        self.url = '/api/info/person/search/'
+
+    def get_names(self, q, **params):
+        params['q'] = q
+        return [x['last_name'] for x in self.client.get(self.url, params).json()]
+
+    def test_search(self):
+        self.assertEqual(self.get_names('елк'), ['Ёлкин'])
+        self.assertEqual(self.get_names('ЁЛ'), ['Елисеева', 'Ёлкин'])
+        # Exact words rank above prefixes
+        self.assertEqual(self.get_names('иванов'), ['Иванов', 'Петров-Иванов', 'Ёлкин', 'Иванова'])
+        self.assertEqual(self.get_names('иван иванов'), ['Иванов', 'Петров-Иванов', 'Ёлкин', 'Иванова'])
+        self.assertEqual(self.get_names('пет ив'), ['Ёлкин', 'Петров-Иванов'])
+        self.assertEqual(self.get_names('иванов', limit=1), ['Иванов'])
+        # Typos
+        self.assertEqual(self.get_names('Ивонова'), ['Иванова'])
+        self.assertEqual(self.get_names('Ивонов'), ['Иванов', 'Петров-Иванов'])
+        self.assertEqual(self.get_names('Елисеевна'), ['Елисеева'])
+        self.assertEqual(self.get_names('Жуков'), [])
+        self.assertEqual(self.get_names(' '), [])
+
+    def test_roles(self):
+        with self.assertNumQueries(3):
+            result = self.client.get(self.url, {'q': 'иванов'}).json()
+        self.assertEqual(
+            [(x['is_teacher'], x['is_student']) for x in result],
+            [(True, False), (False, False), (False, False), (False, True)]
+        )
+        self.assertEqual(self.get_names('иванов', role='student'), ['Иванова'])
+        self.assertEqual(self.get_names('иванов', role='teacher'), ['Иванов'])
+
+    def test_index(self):
+        person = self.persons[0]
+        person.last_name = 'Жуков'
+        person.save()
+        self.assertEqual(self.get_names('жук'), ['Жуков'])
+        self.assertEqual(self.get_names('ёлкин'), [])
+        models.PersonNameToken.objects.all().delete()
+        out = StringIO()
+        call_command('rebuild_person_index', stdout=out)
+        self.assertIn('Indexed 15 token(s)', out.getvalue())
+        self.assertEqual(self.get_names('жук'), ['Жуков'])
+
+
+class PersonDirectoryTest(TestCase):
+    def setUp(self):
+        departments = [
+            models.Department.objects.create(name=x) for x in ('Physics', 'Math')
+        ]
+        course = models.Course.objects.create(
+            name='Applied Math', description='', department=departments[1]
+        )
+        state = models.GroupSemesterState.objects.create(
+            name='B8103', group=models.Group.objects.create(course=course),
+            semester=make_semester(datetime.date(2017, 9, 4))
+        )
+        subgroup = models.Subgroup.objects.create(name='1', group=state, primary=True)
+        self.persons = [make_person(i) for i in range(30)]
+        for i, person in enumerate(self.persons):
+            if i % 2:
+                models.Student.objects.create(person=person).subgroups.add(subgroup)
+            if i % 3 == 0:
+                for department in departments[:i % 2 + 1]:
+                    models.Teacher.objects.create(person=person, department=department)
+
+    def test_roles(self):
+        with self.assertNumQueries(5):
+            persons = self.client.get('/api/info/person/', {'page': 1}).json()
+        persons = {x['id']: x for x in persons['results']}
+        for i, person in enumerate(self.persons[:10]):
+            result = persons[person.pk]
+            self.assertEqual(result['is_student'], bool(i % 2))
+            self.assertEqual(result['is_teacher'], i % 3 == 0)
+            self.assertEqual(
+                [x['name'] for x in result['teacher_departments']],
+                [[], ['Physics'], ['Math', 'Physics']][(i % 3 == 0) * (i % 2 + 1)]
+            )
+            self.assertEqual(
+                [x['name'] for x in result['student_departments']], ['Math'] if i % 2 else []
+            )
+            # Same answers w/o prefetching
+            self.assertEqual(person.is_student(), bool(i % 2))
+            self.assertEqual(person.is_teacher(), i % 3 == 0)
+            self.assertEqual(
+                [x['name'] for x in result['teacher_departments']],
+                [x.name for x in person.get_teachers_departments()]
+            )
+            self.assertEqual(
+                [x['name'] for x in result['student_departments']],
+                [x.name for x in person.get_students_departments()]
+            )
+
+
+class ExportTest(TestCase):
+    def setUp(self):
+        cache.clear()
+        self.root = tempfile.TemporaryDirectory()
+        self.settings = override_settings(
+            TIMETABLE_EXPORT_ROOT=self.root.name, TIMETABLE_EXPORT_ACCEL=''
+        )
+        self.settings.enable()
+        department = models.Department.objects.create(name='Math')
+        course = models.Course.objects.create(
+            name='Applied Math', description='', department=department
+        )
+        self.semester = make_semester(datetime.date(2017, 9, 4))
+        state = models.GroupSemesterState.objects.create(
+            name='B8103', group=models.Group.objects.create(course=course),
+            semester=self.semester
+        )
+        self.subgroups = [
+            models.Subgroup.objects.create(name=str(i), group=state, primary=not i)
+            for i in range(2)
+        ]
+        self.timings = [
+            models.LessonTiming.objects.create(
+                start=datetime.time(8 + 2 * i, 30), end=datetime.time(10 + 2 * i, 0)
+            )
+            for i in range(2)
+        ]
+        teacher = models.Teacher.objects.create(person=make_person(0), department=department)
+        discipline = models.Discipline.objects.create(name='Calculus', description='')
+        classroom = models.Classroom.objects.create(name='D734', comments='')
+        self.lessons = []
+        for day in range(3):
+            for timing in reversed(self.timings):
+                lesson = models.Lesson.objects.create(
+                    date=self.semester.start_on + datetime.timedelta(days=day),
+                    start_time=timing, end_time=timing, discipline=discipline,
+                    teacher=teacher, classroom=classroom, state=0
+                )
+                lesson.groups.add(*self.subgroups[:day % 2 + 1])
+                self.lessons.append(lesson)
+        # Outside of the semester
+        models.Lesson.objects.create(
+            date=datetime.date(2017, 8, 1), start_time=self.timings[0],
+            end_time=self.timings[0], discipline=discipline, teacher=teacher,
+            classroom=classroom, state=0
+        )
+        self.url = '/api/info/semester/%d/timetable/' % self.semester.pk
+
+    def tearDown(self):
+        self.settings.disable()
+        self.root.cleanup()
+
+    def get(self, **headers):
+        response = self.client.get(self.url, **headers)
+        if response.status_code == 200:
+            response.data = json.loads(b''.join(response.streaming_content).decode('utf-8'))
+        return response
+
+    def test_layout(self):
+        response = self.get()
+        self.assertEqual(response.status_code, 200)
+        data = response.data
+        self.assertEqual(data['semester'], self.semester.pk)
+        self.assertEqual(data['start_on'], '2017-09-04')
+        self.assertEqual(response['ETag'], '"%s"' % data['version'])
+        self.assertEqual(
+            data['timings'],
+            [[x.pk, x.start.isoformat(), x.end.isoformat()] for x in self.timings]
+        )
+        self.assertEqual(data['teachers'], [[
+            self.lessons[0].teacher_id, 'Last0', 'First0', 'Middle0'
+        ]])
+        self.assertEqual(
+            [x[1:] for x in data['subgroups']], [['0', 'B8103'], ['1', 'B8103']]
+        )
+        self.assertEqual(len(data['lessons']), 6)
+        first, second = data['lessons'][:2]
+        self.assertEqual(first, [self.lessons[1].pk, 0, 0, 0, 0, 0, 0, 0, 0])
+        self.assertEqual(second, [self.lessons[0].pk, 0, 1, 1, 0, 0, 0, 0, 0])
+        self.assertEqual(data['lessons'][2][1:], [1, 0, 0, 0, 0, 0, 0, 0, 1])
+
+    def test_versions(self):
+        response = self.get()
+        version = response.data['version']
+        self.assertEqual(
+            self.get(HTTP_IF_NONE_MATCH=response['ETag']).status_code, 304
+        )
+        # Lessons of other semesters don't matter
+        other = make_semester(datetime.date(2018, 2, 5))
+        lesson = self.lessons[0]
+        lesson.date = other.start_on
+        lesson.save()
+        response = self.get()
+        self.assertNotEqual(response.data['version'], version)
+        self.assertEqual(len(response.data['lessons']), 5)
+        self.assertNotEqual(export.get_version(other), export.get_version(self.semester))
+        # Subgroup changes bump the version as well
+        version = response.data['version']
+        self.lessons[1].groups.remove(self.subgroups[0])
+        response = self.get()
+        self.assertNotEqual(response.data['version'], version)
+        self.assertEqual(response.data['lessons'][0][8:], [])
+        # Old snapshots that may still be sent are kept for a while
+        self.assertEqual(len(os.listdir(self.root.name)), 3)
+
+    def test_materialize(self):
+        version = export.get_version(self.semester)
+        models.LessonPrototype.objects.create(
+            day_of_week=3, weektype=0, start_time=self.timings[0],
+            end_time=self.timings[0], discipline=self.lessons[0].discipline,
+            teacher=self.lessons[0].teacher, classroom=self.lessons[0].classroom
+        ).groups.add(self.subgroups[0])
+        timetable.materialize_semester(self.semester)
+        self.assertNotEqual(export.get_version(self.semester), version)
+
+    def test_accel(self):
+        with override_settings(TIMETABLE_EXPORT_ACCEL='/internal/exports/'):
+            response = self.client.get(self.url)
+        name, version = export.get_export(self.semester)
+        self.assertEqual(response['X-Accel-Redirect'], '/internal/exports/' + name)
+        self.assertEqual(response.content, b'')
+        self.assertTrue(os.path.exists(os.path.join(self.root.name, name)))
+
+    def test_locked(self):
+        # Another process is writing the first snapshot
+        cache.add(export.LOCK_KEY % self.semester.pk, 'other', export.LOCK_TIMEOUT)
+        with mock.patch.object(export, 'WAIT_TIMEOUT', 0):
+            response = self.client.get(self.url)
+        self.assertEqual(response.status_code, 503)
+        self.assertEqual(os.listdir(self.root.name), [])
+        self.assertTrue(cache.get(export.LOCK_KEY % self.semester.pk))
+        # It's done, a later change gets the previous snapshot meanwhile
+        cache.delete(export.LOCK_KEY % self.semester.pk)
+        previous = self.get().data['version']
+        cache.add(export.LOCK_KEY % self.semester.pk, 'other', export.LOCK_TIMEOUT)
+        self.lessons[0].save()
+        self.assertEqual(self.get().data['version'], previous)
+
+    def test_command(self):
+        out = StringIO()
+        call_command('export_timetable', str(self.semester.pk), stdout=out)
+        self.assertIn(export.get_export(self.semester)[0], out.getvalue())
+
+
+class CalendarFeedTest(TestCase):
+    def setUp(self):
+        cache.clear()
+        # Before the semester, so it isn't over
+        patcher = mock.patch('django.utils.timezone.now', return_value=datetime.datetime(
+            2017, 9, 1, tzinfo=timezone.utc
+        ))
+        patcher.start()
+        self.addCleanup(patcher.stop)
+        department = models.Department.objects.create(name='Math')
+        course = models.Course.objects.create(
+            name='Applied Math', description='', department=department
+        )
+        self.semester = make_semester(datetime.date(2017, 9, 4))
+        models.Holiday.objects.create(date=datetime.date(2017, 9, 18), reason='Holiday')
+        state = models.GroupSemesterState.objects.create(
+            name='B8103', group=models.Group.objects.create(course=course),
+            semester=self.semester
+        )
+        self.subgroup = models.Subgroup.objects.create(name='1', group=state, primary=True)
+        timing = models.LessonTiming.objects.create(
+            start=datetime.time(8, 30), end=datetime.time(10, 0)
+        )
+        self.teacher = models.Teacher.objects.create(
+            person=make_person(0), department=department
+        )
+        self.classrooms = [
+            models.Classroom.objects.create(name=x, comments='') for x in ('D734', 'D735')
+        ]
+        discipline = models.Discipline.objects.create(
+            name='Математический анализ; часть 1, ' * 3, description=''
+        )
+        self.prototypes = []
+        for day_of_week, weektype in ((0, 0), (2, 1)):
+            prototype = models.LessonPrototype.objects.create(
+                day_of_week=day_of_week, weektype=weektype, start_time=timing,
+                end_time=timing, discipline=discipline, teacher=self.teacher,
+                classroom=self.classrooms[0]
+            )
+            prototype.groups.add(self.subgroup)
+            self.prototypes.append(prototype)
+        monday = self.prototypes[0]
+        self.cancelled = timetable.materialize_occurrence(
+            monday, datetime.date(2017, 9, 11), state=models.Lesson.CANCELLED
+        )
+        self.moved = timetable.materialize_occurrence(
+            monday, datetime.date(2017, 9, 25), classroom=self.classrooms[1]
+        )
+        self.stored = timetable.materialize_occurrence(
+            monday, datetime.date(2017, 10, 2), state=1
+        )
+        self.extra = models.Lesson.objects.create(
+            date=datetime.date(2017, 9, 7), start_time=timing, end_time=timing,
+            discipline=discipline, teacher=self.teacher, classroom=self.classrooms[0],
+            state=0
+        )
+        self.extra.groups.add(self.subgroup)
+
+    def get(self, url, **headers):
+        response = self.client.get(url, **headers)
+        if response.status_code == 200:
+            content = b''.join(response.streaming_content) if response.streaming \
+                else response.content
+            response.text = content.decode('utf-8')
+            for line in response.text.split('\r\n'):
+                self.assertLessEqual(len(line.encode('utf-8')), 75)
+        return response
+
+    def events(self, text):
+        events = {}
+        for block in text.replace('\r\n ', '').split('BEGIN:VEVENT\r\n')[1:]:
+            fields = dict(x.split(':', 1) for x in block.split('\r\n') if ':' in x)
+            events[fields['UID']] = fields
+        return events
+
+    def test_feeds(self):
+        # The subgroup, prototypes, lessons, stored occurrences, semesters
+        with self.assertNumQueries(5):
+            response = self.get(
+                '/api/calendar/subgroup/%d.ics' % self.subgroup.pk, HTTP_ACCEPT='text/calendar'
+            )
+        self.assertEqual(response['Content-Type'], 'text/calendar; charset=utf-8')
+        self.assertTrue(response.text.startswith('BEGIN:VCALENDAR\r\n'))
+        self.assertTrue(response.text.endswith('END:VCALENDAR\r\n'))
+        events = self.events(response.text)
+        self.assertEqual(len(events), 4)
+        monday = events['prototype-%d-%d@klimr' % (self.prototypes[0].pk, self.semester.pk)]
+        self.assertEqual(monday['DTSTART'], '20170904T083000')
+        self.assertEqual(monday['DTEND'], '20170904T100000')
+        self.assertEqual(monday['RRULE'], 'FREQ=WEEKLY;INTERVAL=1;UNTIL=20171225T083000')
+        # Cancelled, holiday, moved to another classroom, test week
+        self.assertEqual(monday['EXDATE'], ','.join([
+            '20170911T083000', '20170918T083000', '20170925T083000',
+            '20171030T083000', '20171106T083000',
+        ]))
+        self.assertEqual(monday['LOCATION'], 'D734')
+        self.assertEqual(monday['DESCRIPTION'], 'Last0 First0 Middle0')
+        self.assertTrue(monday['SUMMARY'].startswith('Математический анализ\\; часть 1\\, '))
+        wednesday = events['prototype-%d-%d@klimr' % (self.prototypes[1].pk, self.semester.pk)]
+        self.assertEqual(wednesday['DTSTART'], '20170906T083000')
+        self.assertEqual(wednesday['RRULE'], 'FREQ=WEEKLY;INTERVAL=2;UNTIL=20171227T083000')
+        self.assertEqual(wednesday['EXDATE'], '20171101T083000')
+        self.assertEqual(events['lesson-%d@klimr' % self.moved.pk]['LOCATION'], 'D735')
+        self.assertEqual(events['lesson-%d@klimr' % self.extra.pk]['DTSTART'], '20170907T083000')
+
+        teacher = self.get('/api/calendar/teacher/%d.ics' % self.teacher.pk)
+        self.assertEqual(self.events(teacher.text).keys(), events.keys())
+        moved = self.events(self.get(
+            '/api/calendar/classroom/%d.ics' % self.classrooms[1].pk
+        ).text)
+        self.assertEqual(list(moved), ['lesson-%d@klimr' % self.moved.pk])
+        self.assertEqual(self.client.get('/api/calendar/classroom/0.ics').status_code, 404)
+
+    def test_caching(self):
+        urls = [
+            '/api/calendar/subgroup/%d.ics' % self.subgroup.pk,
+            '/api/calendar/classroom/%d.ics' % self.classrooms[0].pk,
+            '/api/calendar/classroom/%d.ics' % self.classrooms[1].pk,
+        ]
+        first = [self.get(x) for x in urls]
+        with self.assertNumQueries(0):
+            cached = self.get(urls[0])
+            self.assertFalse(cached.streaming)
+            self.assertEqual(cached.text, first[0].text)
+            self.assertEqual(
+                self.get(urls[0], HTTP_IF_NONE_MATCH=first[0]['ETag']).status_code, 304
+            )
+        # State changes don't show in the feeds
+        self.stored.state = 2
+        self.stored.save()
+        self.assertEqual([self.get(x)['ETag'] for x in urls], [x['ETag'] for x in first])
+        self.stored.state = models.Lesson.CANCELLED
+        self.stored.save()
+        etags = [self.get(x)['ETag'] for x in urls]
+        self.assertNotEqual(etags[0], first[0]['ETag'])
+        self.assertNotEqual(etags[1], first[1]['ETag'])
+        self.assertEqual(etags[2], first[2]['ETag'])
+        self.assertIn('20171002T083000', self.get(urls[0]).text)
+        self.extra.groups.clear()
+        self.assertNotEqual(self.get(urls[0])['ETag'], etags[0])
+        self.assertEqual(self.get(urls[2])['ETag'], etags[2])
+        # Materializing doesn't change what the feeds show
+        etags = [self.get(x)['ETag'] for x in urls]
+        texts = [self.get(x).text for x in urls]
+        timetable.materialize_semester(self.semester)
+        self.assertEqual([self.get(x)['ETag'] for x in urls], etags)
+        cache.clear()
+        self.assertEqual(
+            [self.events(self.get(x).text) for x in urls], [self.events(x) for x in texts]
+        )
+
+
+class OccupancyTest(OnCommitMixin, TestCase):
+    def setUp(self):
+        cache.clear()
+        timetable.invalidate_calendars()
+        department = models.Department.objects.create(name='Math')
+        self.semester = make_semester(datetime.date(2017, 9, 4))
+        self.timings = [
+            models.LessonTiming.objects.create(
+                start=datetime.time(8 + 2 * i, 30), end=datetime.time(10 + 2 * i, 0)
+            )
+            for i in range(3)
+        ]
+        self.halls = [
+            models.Classroom.objects.create(name=x, comments='', classroom_type=1)
+            for x in ('D734', 'D735', 'D736')
+        ]
+        self.lab = models.Classroom.objects.create(name='L1', comments='', classroom_type=2)
+        teacher = models.Teacher.objects.create(person=make_person(0), department=department)
+        discipline = models.Discipline.objects.create(name='Calculus', description='')
+        self.prototypes = [
+            # Every Monday, and a double lesson on odd Mondays
+            models.LessonPrototype.objects.create(
+                day_of_week=0, weektype=weektype, start_time=self.timings[0],
+                end_time=self.timings[end], discipline=discipline, teacher=teacher,
+                classroom=self.halls[i]
+            )
+            for i, (weektype, end) in enumerate([(0, 0), (1, 1)])
+        ]
+        self.lesson = models.Lesson.objects.create(
+            date=datetime.date(2017, 9, 4), start_time=self.timings[2],
+            end_time=self.timings[2], discipline=discipline, teacher=teacher,
+            classroom=self.halls[2], state=0
+        )
+
+    def free(self, date, timing=None, **params):
+        params['date'] = date
+        if timing is not None:
+            params['timing'] = self.timings[timing].pk
+        response = self.client.get('/api/info/classroom/free/', params)
+        self.assertEqual(response.status_code, 200)
+        return [x['name'] for x in response.json()]
+
+    def test_free(self):
+        self.assertEqual(self.free('2017-09-04', 0, type=1), ['D736'])
+        self.assertEqual(self.free('2017-09-04', 1, type=1), ['D734', 'D736'])
+        self.assertEqual(self.free('2017-09-04', 2), ['D734', 'D735', 'L1'])
+        self.assertEqual(self.free(
+            '2017-09-04', start=self.timings[0].pk, end=self.timings[2].pk, type=1
+        ), [])
+        self.assertEqual(self.free('2017-09-11', 0, type=1), ['D735', 'D736'])
+        self.assertEqual(self.free('2017-09-04', 1, to='2017-09-11', type=1), ['D734', 'D736'])
+        # Test week
+        self.assertEqual(self.free('2017-10-30', 0, type=1), ['D734', 'D735', 'D736'])
+        self.assertEqual(self.free('2017-09-04', 0, type=2), ['L1'])
+        for params in ({'date': '2017-09-04'}, {'timing': self.timings[0].pk},
+                       {'date': '2017-09-04', 'timing': 0},
+                       {'date': '2017-09-04', 'to': '2017-12-04', 'timing': self.timings[0].pk},
+                       {'date': '2017-09-04', 'start': self.timings[1].pk,
+                        'end': self.timings[0].pk}):
+            response = self.client.get('/api/info/classroom/free/', params)
+            self.assertEqual(response.status_code, 400)
+
+    def test_incremental(self):
+        index = occupancy.get_index()
+        slots = [(datetime.date(2017, 9, x), y.pk) for x in (4, 11) for y in self.timings]
+        index.get_free(slots)
+        with self.assertNumQueries(0):
+            index.get_free(slots)
+        # Cancelling a lesson rebuilds its day only
+        timetable.materialize_occurrence(
+            self.prototypes[0], datetime.date(2017, 9, 4), state=models.Lesson.CANCELLED
+        )
+        with self.assertNumQueries(1):
+            self.assertIs(occupancy.get_index(), index)
+            self.assertEqual(self.free('2017-09-04', 0, type=1), ['D734', 'D736'])
+        # State changes don't
+        models.Lesson.objects.filter(prototype=self.prototypes[0]).get().delete()
+        self.lesson.state = 1
+        self.lesson.save()
+        with self.assertNumQueries(1):
+            self.assertEqual(self.free('2017-09-04', 0, type=1), ['D736'])
+        self.lesson.classroom = self.halls[0]
+        self.lesson.save()
+        self.assertEqual(self.free('2017-09-04', 2), ['D735', 'D736', 'L1'])
+        self.lesson.date = datetime.date(2017, 9, 5)
+        self.lesson.save()
+        self.assertEqual(self.free('2017-09-04', 2), ['D734', 'D735', 'D736', 'L1'])
+        self.assertEqual(self.free('2017-09-05', 2), ['D735', 'D736', 'L1'])
+        # Holidays start the index over
+        models.Holiday.objects.create(date=datetime.date(2017, 9, 11), reason='Holiday')
+        self.assertIsNot(occupancy.get_index(), index)
+        self.assertEqual(self.free('2017-09-11', 0, type=1), ['D734', 'D735', 'D736'])
+        # Materializing changes nothing
+        self.assertEqual(self.free('2017-09-18', 0, type=1), ['D736'])
+        timetable.materialize_semester(self.semester)
+        with self.assertNumQueries(0):
+            self.assertEqual(self.free('2017-09-18', 0, type=1), ['D736'])
@@ -0,0 +1,280 @@
+"""
+Turning LessonPrototype rows (weekday, odd/even week, timings,
+subgroups) into lessons for a semester: either stored in bulk as
+Lesson rows or computed on the fly for a date range
+"""
+import datetime
+import threading
+from array import array
+from django.db import transaction
+from klimr_main import caching, export
+from klimr_main.models import Semester, Holiday, Lesson, LessonPrototype
+
+
+class SemesterCalendar(object):
+    """
+    Per-day flags of a semester, from start_on to session_end_on,
+    packed into a byte array
+    """
+    HOLIDAY = 1
+    TEST_WEEK = 2
+    SESSION = 4
+
+    def __init__(self, semester, holidays):
+        self.semester_id = semester.id
+        self.start_on = semester.start_on
+        self.end_on = semester.session_end_on
+        self.first_monday = semester.start_on - datetime.timedelta(
+            days=semester.start_on.weekday()
+        )
+        self.flags = array('B', bytes((self.end_on - self.start_on).days + 1))
+        for i in range(len(self.flags)):
+            day = self.start_on + datetime.timedelta(days=i)
+            if day in holidays:
+                self.flags[i] |= self.HOLIDAY
+            if semester.test_week_on <= day <= semester.test_week_end_on:
+                self.flags[i] |= self.TEST_WEEK
+            if semester.session_on <= day <= semester.session_end_on:
+                self.flags[i] |= self.SESSION
+
+    def week_number(self, day):
+        """
+        1-based number of the week `day` falls into, counting from the
+        week (Monday to Sunday) the semester starts in
+        """
+        return (day - self.first_monday).days // 7 + 1
+
+    def is_odd_week(self, day):
+        return self.week_number(day) % 2 == 1
+
+    def get_flags(self, day):
+        return self.flags[(day - self.start_on).days]
+
+    def teaching_days(self, start=None, end=None):
+        """
+        Days from start_on up to the session without the test week and
+        holidays, optionally limited to [start, end]
+        """
+        first = max(self.start_on, start or self.start_on)
+        last = self.end_on if end is None else min(self.end_on, end)
+        for i in range((first - self.start_on).days, (last - self.start_on).days + 1):
+            if not self.flags[i]:
+                yield self.start_on + datetime.timedelta(days=i)
+
+    def __iter__(self):
+        """
+        (date, week number, is odd week, flags) for every day
+        """
+        for i, flags in enumerate(self.flags):
+            day = self.start_on + datetime.timedelta(days=i)
+            yield day, self.week_number(day), self.is_odd_week(day), flags
+
+
+_calendars = {}
+_calendars_lock = threading.Lock()
+
+
+def _fingerprint(semester):
+    # The Holiday version catches holidays edited by other processes
+    return (semester.start_on, semester.test_week_on, semester.test_week_end_on,
+            semester.session_on, semester.session_end_on,
+            caching.get_versions(Holiday))
+
+
+def get_calendar(semester):
+    """
+    SemesterCalendar of `semester`, cached for the whole process.
+    Dropped by invalidate_calendars() on Semester/Holiday changes; a
+    calendar built from other semester dates or before a holiday was
+    changed in another process is never returned.
+    """
+    cached = _calendars.get(semester.id)
+    if cached is not None and cached[0] == _fingerprint(semester):
+        return cached[1]
+    holidays = set(Holiday.objects.filter(
+        date__gte=semester.start_on, date__lte=semester.session_end_on
+    ).values_list('date', flat=True))
+    calendar = SemesterCalendar(semester, holidays)
+    with _calendars_lock:
+        _calendars[semester.id] = (_fingerprint(semester), calendar)
+    return calendar
+
+
+def invalidate_calendars():
+    with _calendars_lock:
+        _calendars.clear()
+
+
+def week_number(semester, date):
+    return get_calendar(semester).week_number(date)
+
+
+def semester_days(semester, start=None, end=None):
+    """
+    Teaching days of a semester: from start_on up to the session,
+    without the test week and holidays, optionally limited to
+    [start, end]
+    """
+    return get_calendar(semester).teaching_days(start, end)
+
+
+def occurs_on(prototype, semester, date):
+    if date.weekday() != prototype.day_of_week:
+        return False
+    if prototype.weektype == 0:
+        return True
+    return week_number(semester, date) % 2 == prototype.weektype % 2
+
+
+def expand(semester, prototypes, start=None, end=None):
+    """
+    Yield (prototype, date) for every occurrence of `prototypes` in
+    `semester` (or its [start, end] part), date by date
+    """
+    by_weekday = {}
+    for prototype in prototypes:
+        by_weekday.setdefault(prototype.day_of_week, []).append(prototype)
+    calendar = get_calendar(semester)
+    for day in calendar.teaching_days(start, end):
+        weektype = 1 if calendar.is_odd_week(day) else 2
+        for prototype in by_weekday.get(day.weekday(), ()):
+            if prototype.weektype in (0, weektype):
+                yield prototype, day
+
+
+def occurrence(prototype, day):
+    """
+    Unsaved Lesson for `prototype` on `day`, as it would be
+    materialized. Its subgroups are in `virtual_groups`.
+    """
+    lesson = Lesson(
+        date=day,
+        start_time=prototype.start_time,
+        end_time=prototype.end_time,
+        discipline=prototype.discipline,
+        teacher=prototype.teacher,
+        classroom=prototype.classroom,
+        prototype=prototype,
+        state=0
+    )
+    lesson.virtual_groups = prototype.groups.all()
+    return lesson
+
+
+def virtual_lessons(prototypes, start, end, exclude=()):
+    """
+    Compute the occurrences of `prototypes` between `start` and `end`
+    in memory instead of reading stored Lessons. (prototype id, date)
+    pairs in `exclude` (usually ones that already have a stored Lesson)
+    are skipped. Prefetch `groups` and the related objects you are going
+    to serialize on `prototypes` beforehand.
+    """
+    prototypes = list(prototypes)
+    semesters = Semester.objects.filter(
+        start_on__lte=end, session_on__gt=start
+    ).order_by('start_on')
+    for semester in semesters:
+        for prototype, day in expand(semester, prototypes, start, end):
+            if (prototype.id, day) not in exclude:
+                yield occurrence(prototype, day)
+
+
+def materialize_occurrence(prototype, day, **fields):
+    """
+    Store the occurrence of `prototype` on `day` as a Lesson (e.g. once
+    it gets cancelled or assignments are attached to it), updating
+    `fields` on it. Raises ValueError if there is no such occurrence.
+    """
+    semester = Semester.objects.filter(
+        start_on__lte=day, session_on__gt=day
+    ).order_by('-start_on').first()
+    if semester is None or day not in set(semester_days(semester, day, day)) \
+            or not occurs_on(prototype, semester, day):
+        raise ValueError('%s does not take place on %s' % (prototype, day))
+    with transaction.atomic():
+        lesson = Lesson.objects.select_for_update().filter(
+            prototype=prototype, date=day
+        ).first()
+        if lesson is None:
+            lesson = occurrence(prototype, day)
+            for name, value in fields.items():
+                setattr(lesson, name, value)
+            lesson.save()
+            lesson.groups.set(prototype.groups.all())
+        elif fields:
+            for name, value in fields.items():
+                setattr(lesson, name, value)
+            lesson.save(update_fields=list(fields))
+    return lesson
+
+
+def materialize_semester(semester, prototypes=None, batch_size=2000):
+    """
+    Create the Lesson rows (and their `groups` links) for every
+    occurrence of `prototypes` (a queryset, all prototypes by default)
+    in `semester` that has not been materialized yet. Safe to run
+    repeatedly; returns the number of created lessons.
+    """
+    if prototypes is None:
+        prototypes = LessonPrototype.objects.all()
+    # Filters below use `prototypes` as a subquery, so a queryset of any
+    # size is fine on SQLite as well
+    Links = LessonPrototype.groups.through
+    subgroups = {}
+    for prototype_id, subgroup_id in Links.objects.filter(
+            lessonprototype__in=prototypes
+    ).values_list('lessonprototype_id', 'subgroup_id'):
+        subgroups.setdefault(prototype_id, []).append(subgroup_id)
+    in_semester = Lesson.objects.filter(
+        date__gte=semester.start_on, date__lt=semester.session_on,
+        prototype__isnull=False
+    )
+    existing = set(in_semester.filter(
+        prototype__in=prototypes
+    ).values_list('prototype_id', 'date'))
+    prototypes = list(prototypes)
+
+    created = 0
+    batch = []
+    with transaction.atomic():
+        for prototype, day in expand(semester, prototypes):
+            if (prototype.id, day) in existing:
+                continue
+            batch.append(Lesson(
+                date=day,
+                start_time_id=prototype.start_time_id,
+                end_time_id=prototype.end_time_id,
+                discipline_id=prototype.discipline_id,
+                teacher_id=prototype.teacher_id,
+                classroom_id=prototype.classroom_id,
+                prototype_id=prototype.id,
+                state=0
+            ))
+            if len(batch) >= batch_size:
+                created += _flush(batch, in_semester, subgroups)
+                batch = []
+        if batch:
+            created += _flush(batch, in_semester, subgroups)
+    if created:
+        caching.bump_version(Lesson)
+        export.touch(semester.id)
+    return created
+
+
+def _flush(batch, in_semester, subgroups):
+    Lesson.objects.bulk_create(batch)
+    # bulk_create doesn't return ids on every backend, so read them back
+    # by the (prototype, date) key; batches are built date by date, so
+    # the date window is narrow
+    keys = {(x.prototype_id, x.date) for x in batch}
+    ids = in_semester.filter(
+        date__gte=min(x.date for x in batch),
+        date__lte=max(x.date for x in batch)
+    ).values_list('id', 'prototype_id', 'date')
+    Links = Lesson.groups.through
+    Links.objects.bulk_create(
+        Links(lesson_id=pk, subgroup_id=subgroup_id)
+        for pk, prototype_id, date in ids if (prototype_id, date) in keys
+        for subgroup_id in subgroups.get(prototype_id, ())
+    )
+    return len(batch)
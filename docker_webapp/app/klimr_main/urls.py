@@ -19,5 +19,10 @@ router.register(r'info/timing', views.LessonTimingViewSet)
 # Additionally, we include login URLs for the browsable API.
 urlpatterns = [
     url(r'^', include(router.urls)),
+    url(r'^info/cache-stats/$', views.CacheStatsView.as_view()),
+    url(r'^calendar/(?P<kind>subgroup|teacher|classroom)/(?P<pk>[0-9]+)\.ics$',
+        views.CalendarFeedView.as_view()),
+    url(r'^measurement/bulk/$', views.MeasurementBulkView.as_view()),
+    url(r'^roster/import/$', views.RosterImportView.as_view()),
     url(r'^api-auth/', include('rest_framework.urls', namespace='rest_framework'))
 ]
@@ -1,16 +1,37 @@
+import datetime
+import os
+from collections import OrderedDict
+from django.conf import settings
 from django.db.models.query import QuerySet
+from django.http import Http404, HttpResponse, FileResponse, StreamingHttpResponse
+from django.utils import timezone
+from django.utils.cache import get_conditional_response
+from django.utils.dateparse import parse_date
+from django.utils.http import quote_etag
 from django.shortcuts import render, get_object_or_404
 from django.contrib.auth.models import User, Group
 from klimr_main.serializers import *
 from klimr_main.models import Semester, Holiday, LessonTiming, Person, \
-    Department, Course, Teacher, Discipline, Lesson, \
-    Student, Group, GroupSemesterState, Classroom
-from rest_framework import viewsets, mixins
+    Department, Course, Teacher, Discipline, Lesson, LessonPrototype, \
+    Student, Group, GroupSemesterState, Subgroup, Classroom, QueueRecord, \
+    Assignment, AssignmentProgress
+from klimr_main import export, ical, measurements, occupancy, progress, \
+    queues, roster, search, timetable, waittime
+from klimr_main.caching import ConditionalGetMixin, CachedResponseMixin, \
+    conditional, get_stats
+from klimr_main.pagination import LessonKeysetPagination
+from klimr_main.parsers import NDJSONParser, CSVParser
+from klimr_main.renderers import ICalendarRenderer
+from rest_framework import viewsets, mixins, status
 from rest_framework.decorators import list_route, detail_route
+from rest_framework.exceptions import ParseError, ValidationError
+from rest_framework.parsers import JSONParser
 from rest_framework.response import Response
+from rest_framework.utils.encoders import JSONEncoder
+from rest_framework.views import APIView
 
 
-class ShortGenericViewset(viewsets.GenericViewSet):
+class ShortGenericViewset(ConditionalGetMixin, viewsets.GenericViewSet):
     """
     Viewset that uses different serializers for list and
     retrieve
@@ -44,6 +65,17 @@ class ShortGenericViewset(viewsets.GenericViewSet):
             short_queryset = short_queryset.all()
         return short_queryset
 
+    def get_int_param(self, request, name):
+        """
+        Integer query parameter `name`, None if it's missing
+        """
+        try:
+            return int(request.query_params[name])
+        except KeyError:
+            return None
+        except ValueError:
+            raise ParseError('Invalid number in `%s`' % name)
+
     def get_short_serializer_class(self):
         """
         Return the class to use for the short serializer.
@@ -77,6 +109,7 @@ class ShortListModelMixin(object):
     List a queryset.
     """
 
+    @conditional
     def list(self, request, *args, **kwargs):
         queryset = self.filter_queryset(self.get_short_queryset())
 
@@ -89,15 +122,67 @@ class ShortListModelMixin(object):
         return Response(serializer.data)
 
 
-class SemesterViewSet(viewsets.ModelViewSet):
+class SemesterViewSet(CachedResponseMixin, viewsets.ModelViewSet):
     """
     Directory API: semesters information endpoint
     """
     queryset = Semester.objects.all().order_by('start_on')
     serializer_class = SemesterSerializer
+    cache_models = (Semester, Holiday)
+
+    @detail_route(methods=['get'])
+    def calendar(self, request, pk=None):
+        """
+        Every day of the semester with its week number and parity and
+        whether it is a holiday, in the test week or in the session
+        """
+        return self.get_cached_response(self.get_calendar, request, pk=pk)
+
+    def get_calendar(self, request, pk=None):
+        calendar = timetable.get_calendar(self.get_object())
+        Calendar = timetable.SemesterCalendar
+        return Response([
+            OrderedDict([
+                ('date', day),
+                ('week', week),
+                ('parity', 'odd' if odd else 'even'),
+                ('holiday', bool(flags & Calendar.HOLIDAY)),
+                ('test_week', bool(flags & Calendar.TEST_WEEK)),
+                ('session', bool(flags & Calendar.SESSION)),
+            ])
+            for day, week, odd, flags in calendar
+        ])
+
+    @detail_route(methods=['get'])
+    def timetable(self, request, pk=None):
+        """
+        Every lesson of the semester in one compact JSON document (see
+        klimr_main.export for its layout), sent by nginx when
+        TIMETABLE_EXPORT_ACCEL is set
+        """
+        semester = get_object_or_404(Semester.objects, pk=pk)
+        try:
+            name, version = export.get_export(semester)
+        except export.ExportBusy:
+            response = HttpResponse(status=status.HTTP_503_SERVICE_UNAVAILABLE)
+            response['Retry-After'] = export.WAIT_TIMEOUT
+            return response
+        response = get_conditional_response(request, etag=version)
+        if response is not None:
+            return response
+        if settings.TIMETABLE_EXPORT_ACCEL:
+            response = HttpResponse(content_type='application/json')
+            response['X-Accel-Redirect'] = settings.TIMETABLE_EXPORT_ACCEL + name
+        else:
+            response = FileResponse(
+                open(os.path.join(export.get_root(), name), 'rb'),
+                content_type='application/json'
+            )
+        response['ETag'] = quote_etag(version)
+        return response
 
 
-class LessonTimingViewSet(viewsets.ModelViewSet):
+class LessonTimingViewSet(CachedResponseMixin, viewsets.ModelViewSet):
     """
     Directory API: lesson time infromation endpoint
     """
@@ -105,17 +190,47 @@ class LessonTimingViewSet(viewsets.ModelViewSet):
     serializer_class = LessonTimingSerializer
 
 
-class PersonViewSet(viewsets.ModelViewSet):
+class PersonViewSet(ConditionalGetMixin, viewsets.ModelViewSet):
     """
     Directory API: person (student/teacher) information endpoint
     """
     # TODO Separate views instead of viewsets, as we want to get
     # teacher/student entities
-    queryset = Person.objects.all()
+    queryset = Person.objects.with_roles().order_by('id')
     serializer_class = PersonSerializer
+    search_limit = 20
+    max_search_limit = 100
+    cache_models = (Person, Teacher, Student, Department, Subgroup, Group,
+                    GroupSemesterState, Course)
+
+    @conditional
+    def list(self, request, *args, **kwargs):
+        return super(PersonViewSet, self).list(request, *args, **kwargs)
 
+    @conditional
+    def retrieve(self, request, *args, **kwargs):
+        return super(PersonViewSet, self).retrieve(request, *args, **kwargs)
 
-class DepartmentViewSet(viewsets.ModelViewSet):
+    @list_route()
+    @conditional
+    def search(self, request):
+        """
+        Persons matching every word of ?q= (prefixes of name words, case
+        and ё/е insensitive, with typos tolerated), best first. ?role=
+        teacher or student, ?limit=N.
+        """
+        try:
+            limit = max(1, min(int(request.query_params['limit']), self.max_search_limit))
+        except (KeyError, ValueError):
+            limit = self.search_limit
+        persons = search.search(
+            request.query_params.get('q', ''), limit=limit,
+            role=request.query_params.get('role')
+        )
+        return Response(PersonSearchSerializer(persons, many=True).data)
+
+
+class DepartmentViewSet(CachedResponseMixin, viewsets.ModelViewSet):
     """
     Directory API: department information endpoint
     """
@@ -123,15 +238,17 @@ class DepartmentViewSet(viewsets.ModelViewSet):
     serializer_class = DepartmentSerializer
 
 
-class CourseViewSet(viewsets.ModelViewSet):
+class CourseViewSet(CachedResponseMixin, viewsets.ModelViewSet):
     """
     Directory API: course information endpoint
     """
-    queryset = Course.objects.all().order_by('name')
+    queryset = Course.objects.select_related('department').order_by('name')
     serializer_class = CourseSerializer
+    cache_models = (Course, Department)
 
 
-class DisciplineViewSet(ShortGenericViewset,
+class DisciplineViewSet(CachedResponseMixin,
+                        ShortGenericViewset,
                         ShortListModelMixin,
                         viewsets.ModelViewSet):
     """
@@ -152,29 +269,95 @@ class GroupViewSet(ShortListModelMixin,
     """
     queryset = Group.objects.all()
     serializer_class = GroupSerializer
-    short_queryset = Group.objects.all()
-    short_serializer_class = ShortGroupSerializer
+    short_queryset = Group.objects.with_latest_state().order_by('id')
+    short_serializer_class = GroupDirectorySerializer
+    cache_models = (Group, GroupSemesterState, Semester, Course, Subgroup,
+                    Student, Person)
+    ordering_fields = {
+        'name': 'latest_name',
+        'semester': 'latest_semester_start_on',
+        'year': 'latest_year',
+        'course': 'course__name',
+    }
 
+    def get_short_queryset(self):
+        """
+        Supports ?name=, ?course=, ?semester= (latest semester id),
+        ?year= and ?ordering=[-]name|semester|year|course, all evaluated
+        in SQL
+        """
+        queryset = super(GroupViewSet, self).get_short_queryset()
+        params = self.request.query_params
+        if 'name' in params:
+            queryset = queryset.filter(latest_name__icontains=params['name'])
+        if 'course' in params:
+            queryset = queryset.filter(course=self.get_int_param(self.request, 'course'))
+        if 'semester' in params:
+            queryset = queryset.filter(
+                latest_semester_id=self.get_int_param(self.request, 'semester')
+            )
+        if 'year' in params:
+            queryset = queryset.filter(latest_year=self.get_int_param(self.request, 'year'))
+        ordering = params.get('ordering', '')
+        field = self.ordering_fields.get(ordering.lstrip('-'))
+        if field is not None:
+            queryset = queryset.order_by(
+                ('-' if ordering.startswith('-') else '') + field, 'id'
+            )
+        return queryset
+
+    def get_state_queryset(self, pk):
+        return GroupStateSerializer.setup_eager_loading(
+            GroupSemesterState.objects.filter(group=pk)
+        )
+
+    @conditional
     def retrieve(self, request, pk=None):
         group = get_object_or_404(Group.objects, pk=pk)
-        return Response(GroupStateSerializer(group.states.latest()).data)
+        state = get_object_or_404(
+            self.get_state_queryset(group.pk),
+            pk=group.current_state_id
+        )
+        return Response(GroupStateSerializer(state).data)
 
     @list_route(methods=['get', 'post'], url_path='(?P<pk>[0-9]+)/state')
+    @conditional
     def state_list(self, request, pk=None):
         if request.method is 'POST':
             pass
         else:
             group = get_object_or_404(Group.objects, pk=pk)
-            return Response(GroupStateSerializer(group.states.all(), many=True).data)
+            return Response(GroupStateSerializer(self.get_state_queryset(group.pk), many=True).data)
 
     @detail_route(methods=['get'], url_path='state/(?P<state_pk>[0-9]+)')
+    @conditional
     def state_details(self, request, pk=None, state_pk=None):
-        state = get_object_or_404(
-            GroupSemesterState.objects.filter(group=pk),
-            pk=state_pk
-        )
+        state = get_object_or_404(self.get_state_queryset(pk), pk=state_pk)
         return Response(GroupStateSerializer(state).data)
 
+    @detail_route(methods=['get'])
+    def progress(self, request, pk=None):
+        """
+        Completed assignments per student and discipline for the current
+        state of the group (?state=ID for another one), ?discipline=ID
+        to limit it to one discipline; read in one query
+        """
+        if 'state' in request.query_params:
+            states = GroupSemesterState.objects.filter(
+                group=pk, pk=self.get_int_param(request, 'state')
+            ).values('id')
+        else:
+            states = Group.objects.filter(pk=pk).values('current_state')
+        queryset = AssignmentProgress.objects.filter(
+            student__in=Student.objects.filter(subgroups__group__in=states).values('id')
+        ).select_related('student__person').order_by(
+            'student__person__last_name', 'student__person__first_name',
+            'student_id', 'discipline_id'
+        )
+        if 'discipline' in request.query_params:
+            queryset = queryset.filter(discipline=self.get_int_param(request, 'discipline'))
+        return Response(AssignmentProgressSerializer(queryset, many=True).data)
+
 
 
 class TeacherViewSet(mixins.CreateModelMixin,
@@ -200,16 +383,25 @@ class TeacherViewSet(mixins.CreateModelMixin,
         id__in=Teacher.objects.all().values_list('person_id', flat=True)
     )
     short_serializer_class = ShortPersonSerializer
+    cache_models = (Teacher, Person, Department, Discipline, Lesson, Group,
+                    GroupSemesterState, Subgroup, Semester, Course)
 
+    @conditional
     def retrieve(self, request, pk=None):
         # # TODO Try to simplify this code by rewriting code w/o proxy objects
         if int(pk) < 0:
-            teacher_relation = get_object_or_404(Teacher.objects, pk=-int(pk))
-            return Response(TeacherSerializer(teacher_relation).data)
+            teachers, context = TeacherSerializer.setup_eager_loading(
+                Teacher.objects.filter(pk=-int(pk))
+            )
+            if not teachers:
+                raise Http404
+            return Response(TeacherSerializer(teachers[0], context=context).data)
         #
         teacher_person = get_object_or_404(Person.objects, pk=pk)
-        teachers = teacher_person.get_teachers()
-        return Response(TeacherSerializer(teachers, many=True).data)
+        teachers, context = TeacherSerializer.setup_eager_loading(
+            teacher_person.get_teachers()
+        )
+        return Response(TeacherSerializer(teachers, many=True, context=context).data)
 
     def destroy(self, request, pk=None):
         if pk > 0:
@@ -235,7 +427,9 @@ class StudentViewSet(ShortListModelMixin,
         id__in=Student.objects.all().values_list('person_id', flat=True)
     )
     short_serializer_class = ShortPersonSerializer
+    cache_models = (Student, Person)
 
+    @conditional
     def retrieve(self, request, pk=None):
         # TODO This code is copy-pasted from above, so, make sure you checked
         # all the TODOS there
@@ -248,7 +442,9 @@ class StudentViewSet(ShortListModelMixin,
         #return Response(serializer.data)
 
 
-class ClassroomViewSet(ShortListModelMixin,
+class ClassroomViewSet(CachedResponseMixin,
+                       mixins.RetrieveModelMixin,
+                       ShortListModelMixin,
                        ShortGenericViewset):
     """
     Directory API: classroom information endpoint
@@ -257,18 +453,440 @@ class ClassroomViewSet(ShortListModelMixin,
     serializer_class = ClassroomSerializer
     short_queryset = Classroom.objects.all()
     short_serializer_class = ShortClassroomSerializer
-
-
-class LessonViewSet(viewsets.ModelViewSet):
+    max_free_days = 31
+
+    def get_date_param(self, request, name, default=None):
+        if name not in request.query_params and default is not None:
+            return default
+        try:
+            value = parse_date(request.query_params.get(name, ''))
+        except ValueError:
+            value = None
+        if value is None:
+            raise ParseError('Invalid date in `%s`' % name)
+        return value
+
+    @list_route(methods=['get'])
+    def free(self, request):
+        """
+        Classrooms free on ?date=YYYY-MM-DD (up to ?to=YYYY-MM-DD)
+        during ?timing=ID or every timing from ?start=ID to ?end=ID,
+        only ones of ?type=N if given. Answered from the occupancy index
+        (see klimr_main.occupancy), not by querying lessons.
+        """
+        first = self.get_date_param(request, 'date')
+        days = (self.get_date_param(request, 'to', first) - first).days + 1
+        if not 0 < days <= self.max_free_days:
+            raise ParseError('`to` must be within %d days after `date`' % self.max_free_days)
+        index = occupancy.get_index()
+        timing = self.get_int_param(request, 'timing')
+        start, end = (timing, timing) if timing is not None else (
+            self.get_int_param(request, 'start'), self.get_int_param(request, 'end')
+        )
+        if start not in index.timings or end not in index.timings:
+            raise ParseError('Pass a valid `timing` or `start` and `end`')
+        timings = index.timings[index.timings.index(start):index.timings.index(end) + 1]
+        if not timings:
+            raise ParseError('`end` must not be before `start`')
+        slots = [
+            (first + datetime.timedelta(days=x), y) for x in range(days) for y in timings
+        ]
+        free = index.get_free(slots, self.get_int_param(request, 'type'))
+        return Response([
+            OrderedDict([
+                ('id', x), ('name', index.classrooms[x][0]),
+                ('classroom_type', index.classrooms[x][1])
+            ])
+            for x in free
+        ])
+
+
+class LessonViewSet(ConditionalGetMixin, viewsets.ModelViewSet):
     """
     Lesson information endpoint
-    use /lesson/group/GROUP_ID/
+    use /schedule/group/SUBGROUP_ID/?from=YYYY-MM-DD&to=YYYY-MM-DD
+    (defaults to the current week), follow `next` to page through
+    the range or pass ?stream=1 to get the whole range at once
+
+    With SCHEDULE_VIRTUAL_LESSONS on, prototype occurrences w/o a stored
+    Lesson are computed on the fly (they have no `id`); POST to
+    /schedule/prototype/PROTOTYPE_ID/YYYY-MM-DD/ to store one
+
+    /schedule/LESSON_ID/queue/ is the lesson's queue, see queue()
     """
-    queryset = Lesson.objects.all()
+    queryset = LessonSerializer.setup_eager_loading(Lesson.objects.all())
     serializer_class = LessonSerializer
+    stream_batch_size = 500
+    # Days merged at a time when streaming virtual lessons
+    stream_days = 7
+    cache_models = (Lesson, LessonPrototype, LessonTiming, Discipline, Teacher,
+                    Person, Classroom, Subgroup, Semester, Holiday)
+
+    def get_etag_extra(self, request):
+        # The default range moves every week
+        start, end = self.get_date_range(request)
+        return '%s|%s|%s' % (
+            start, end, getattr(settings, 'SCHEDULE_VIRTUAL_LESSONS', False)
+        )
+
+    def get_date_range(self, request):
+        today = timezone.localtime(timezone.now()).date()
+        monday = today - datetime.timedelta(days=today.weekday())
+        result = []
+        for param, default in (('from', monday), ('to', monday + datetime.timedelta(days=6))):
+            if param not in request.query_params:
+                result.append(default)
+                continue
+            try:
+                value = parse_date(request.query_params[param])
+            except ValueError:
+                value = None
+            if value is None:
+                raise ParseError('Invalid date in `%s`' % param)
+            result.append(value)
+        return result
+
+    @conditional
+    def list(self, request, *args, **kwargs):
+        return super(LessonViewSet, self).list(request, *args, **kwargs)
+
+    @conditional
+    def retrieve(self, request, *args, **kwargs):
+        return super(LessonViewSet, self).retrieve(request, *args, **kwargs)
+
+    def encode_lessons(self, batches):
+        """
+        Serialize lists of lessons as one JSON array, so only one batch
+        is held in memory at a time
+        """
+        encoder = JSONEncoder()
+        yield '['
+        separator = ''
+        for batch in batches:
+            for item in LessonSerializer(batch, many=True).data:
+                yield separator + encoder.encode(item)
+                separator = ','
+        yield ']'
+
+    def stream_lessons(self, queryset):
+        """
+        Stream the queryset in keyset batches
+        """
+        paginator = LessonKeysetPagination
+        queryset = queryset.order_by(*paginator.ordering)
+
+        def batches():
+            key = None
+            while True:
+                batch = queryset if key is None else paginator.filter_after(queryset, key)
+                batch = list(batch[:self.stream_batch_size])
+                yield batch
+                if len(batch) < self.stream_batch_size:
+                    break
+                key = paginator.get_key(batch[-1])
+        return self.encode_lessons(batches())
+
+    def stream_virtual_lessons(self, queryset, group_pk, start, end):
+        """
+        Stream stored and virtual lessons of [start, end], merged
+        `stream_days` days at a time
+        """
+        def batches():
+            day = start
+            while day <= end:
+                last = min(end, day + datetime.timedelta(days=self.stream_days - 1))
+                yield self.merge_virtual_lessons(
+                    queryset.filter(date__gte=day, date__lte=last), group_pk, day, last
+                )
+                day = last + datetime.timedelta(days=1)
+        return self.encode_lessons(batches())
+
+    def merge_virtual_lessons(self, queryset, group_pk, start, end):
+        """
+        Stored lessons of the range plus the prototype occurrences that
+        have no stored Lesson yet, sorted like the keyset paginator
+        """
+        stored = list(queryset)
+        prototypes = LessonPrototype.objects.filter(groups=group_pk).select_related(
+            'start_time', 'discipline', 'classroom', 'teacher__person'
+        ).prefetch_related('groups')
+        lessons = stored + list(timetable.virtual_lessons(
+            prototypes, start, end,
+            exclude={(x.prototype_id, x.date) for x in stored}
+        ))
+        lessons.sort(key=LessonKeysetPagination.get_key)
+        return lessons
 
     @list_route(methods=['get', 'post'], url_path='group/(?P<group_pk>[0-9]+)')
+    @conditional
     def lessons_for_group(self, request, group_pk=None):
-        qs = Lesson.objects.all().filter(groups=group_pk)
-        return Response(LessonSerializer(qs, many=True).data)
+        start, end = self.get_date_range(request)
+        qs = self.get_queryset().filter(groups=group_pk)
+        virtual = getattr(settings, 'SCHEDULE_VIRTUAL_LESSONS', False)
+        if request.query_params.get('stream'):
+            if virtual:
+                content = self.stream_virtual_lessons(qs, group_pk, start, end)
+            else:
+                content = self.stream_lessons(qs.filter(date__gte=start, date__lte=end))
+            return StreamingHttpResponse(content, content_type='application/json')
+        qs = qs.filter(date__gte=start, date__lte=end)
+        if virtual:
+            qs = self.merge_virtual_lessons(qs, group_pk, start, end)
+        paginator = LessonKeysetPagination()
+        page = paginator.paginate_queryset(qs, request, view=self)
+        return paginator.get_paginated_response(LessonSerializer(page, many=True).data)
+
+    @list_route(methods=['post'], url_path='prototype/(?P<prototype_pk>[0-9]+)/(?P<date>[0-9-]+)')
+    def materialize(self, request, prototype_pk=None, date=None):
+        """
+        Store a virtual lesson (prototype occurrence on `date`) so it can
+        diverge from its prototype; `state` and `reason` may be passed
+        """
+        prototype = get_object_or_404(LessonPrototype.objects, pk=prototype_pk)
+        serializer = LessonStateSerializer(data=request.data, partial=True)
+        serializer.is_valid(raise_exception=True)
+        try:
+            day = parse_date(date)
+            lesson = timetable.materialize_occurrence(
+                prototype, day, **serializer.validated_data
+            )
+        except ValueError:
+            raise Http404
+        return Response(LessonSerializer(lesson).data)
+
+
+    @detail_route(methods=['post'])
+    def completed(self, request, pk=None):
+        """
+        POST {assignments, students, completed_on} to mark assignments
+        of the lesson's discipline (the lesson's own by default) completed
+        by students of its subgroups (all of them by default) on
+        completed_on (the lesson date by default). Already completed
+        pairs are skipped. Expelled students are left out unless
+        include_expelled is true.
+        """
+        lesson = get_object_or_404(Lesson.objects.only('id', 'date', 'discipline_id'), pk=pk)
+        serializer = CompletionSerializer(data=request.data)
+        serializer.is_valid(raise_exception=True)
+        data = serializer.validated_data
+        if 'assignments' not in data:
+            assignments = set(lesson.assignments.values_list('id', flat=True))
+            if not assignments:
+                raise ValidationError({'assignments': ['The lesson has no assignments']})
+        else:
+            assignments = set(data['assignments'])
+        valid = set(Assignment.objects.filter(
+            pk__in=assignments, discipline=lesson.discipline_id
+        ).values_list('id', flat=True))
+        if valid != assignments:
+            raise ValidationError({'assignments': [
+                'Not assignments of the lesson discipline: %s' % ', '.join(
+                    str(x) for x in sorted(assignments - valid)
+                )
+            ]})
+        students = Student.objects.filter(subgroups__lesson=lesson).distinct()
+        if not data['include_expelled']:
+            students = students.filter(expelled_in__isnull=True)
+        if 'students' in data:
+            requested = set(data['students'])
+            students = set(students.filter(pk__in=requested).values_list('id', flat=True))
+            if students != requested:
+                raise ValidationError({'students': [
+                    'Not students of the lesson: %s' % ', '.join(
+                        str(x) for x in sorted(requested - students)
+                    )
+                ]})
+        else:
+            students = set(students.values_list('id', flat=True))
+        created = progress.mark_completed(
+            students, assignments, data.get('completed_on', lesson.date)
+        )
+        return Response(OrderedDict([
+            ('created', created),
+            ('existing', len(students) * len(assignments) - created),
+        ]), status=status.HTTP_201_CREATED if created else status.HTTP_200_OK)
+
+    def get_queue_response(self, queue, entries, many=False, **kwargs):
+        return Response(QueueEntrySerializer(entries, many=many, context={
+            'queue': queue, 'waits': waittime.queue_waits(queue)
+        }).data, **kwargs)
+
+    @detail_route(methods=['get', 'post'])
+    def queue(self, request, pk=None):
+        """
+        GET the queue (?count=N for its head only) or POST
+        {student, reason} to join it; served from process memory,
+        see klimr_main.queues
+        """
+        if request.method == 'POST':
+            serializer = QueueJoinSerializer(data=request.data)
+            serializer.is_valid(raise_exception=True)
+            try:
+                entry = queues.join(
+                    int(pk),
+                    serializer.validated_data['student'].id,
+                    serializer.validated_data['reason']
+                )
+            except Lesson.DoesNotExist:
+                raise Http404
+            except ValueError as e:
+                raise ValidationError(str(e))
+            return self.get_queue_response(
+                queues.get_queue(int(pk)), entry, status=status.HTTP_201_CREATED
+            )
+        try:
+            count = max(1, int(request.query_params['count']))
+        except (KeyError, ValueError):
+            count = None
+        try:
+            queue = queues.get_queue(int(pk))
+        except Lesson.DoesNotExist:
+            raise Http404
+        return self.get_queue_response(queue, queue.peek(count), many=True)
+
+    @detail_route(methods=['post'], url_path='queue/next')
+    def queue_next(self, request, pk=None):
+        """
+        Take the first record out of the queue (it's being served)
+        """
+        try:
+            entry = queues.pop(int(pk))
+        except Lesson.DoesNotExist:
+            raise Http404
+        if entry is None:
+            return Response(status=status.HTTP_204_NO_CONTENT)
+        return self.get_queue_response(queues.get_queue(int(pk)), entry)
+
+    @detail_route(methods=['get', 'delete'], url_path='queue/(?P<record_pk>[0-9]+)')
+    def queue_record(self, request, pk=None, record_pk=None):
+        """
+        GET the record with its position or DELETE it to leave the queue
+        """
+        if request.method == 'DELETE':
+            try:
+                queues.leave(int(pk), int(record_pk))
+            except (Lesson.DoesNotExist, QueueRecord.DoesNotExist):
+                raise Http404
+            return Response(status=status.HTTP_204_NO_CONTENT)
+        try:
+            queue = queues.get_queue(int(pk))
+        except Lesson.DoesNotExist:
+            raise Http404
+        entry = queue.get(int(record_pk))
+        if entry is None:
+            raise Http404
+        return self.get_queue_response(queue, entry)
+
+    @detail_route(methods=['post'], url_path='queue/(?P<record_pk>[0-9]+)/move')
+    def queue_move(self, request, pk=None, record_pk=None):
+        """
+        POST {position} (1-based) to reorder the queue
+        """
+        try:
+            position = int(request.data['position'])
+        except (KeyError, TypeError, ValueError):
+            raise ValidationError({'position': 'A valid integer is required.'})
+        try:
+            entry = queues.move(int(pk), int(record_pk), position)
+        except (Lesson.DoesNotExist, QueueRecord.DoesNotExist):
+            raise Http404
+        return self.get_queue_response(queues.get_queue(int(pk)), entry)
+
+
+class CacheStatsView(APIView):
+    """
+    Hit/miss counters of the directory response cache
+    """
+    def get(self, request):
+        return Response(get_stats())
+
+
+class CalendarFeedView(APIView):
+    """
+    iCalendar feed of the lessons of a subgroup, teacher or classroom:
+    /calendar/KIND/ID.ics, see klimr_main.ical. Generated while it's
+    being sent and cached until one of its lessons changes.
+    """
+    renderer_classes = (ICalendarRenderer, )
+    related = {
+        'subgroup': ('group__semester', ),
+        'teacher': ('person', 'department'),
+        'classroom': (),
+    }
+
+    def get(self, request, kind, pk):
+        pk = int(pk)
+        version = ical.get_version(kind, pk)
+        response = get_conditional_response(request, etag=version)
+        if response is None:
+            content = ical.get_cached(version)
+            if content is not None:
+                response = HttpResponse(content, content_type='text/calendar; charset=utf-8')
+            else:
+                model = ical.FEEDS[kind][0]
+                obj = get_object_or_404(model.objects.select_related(*self.related[kind]), pk=pk)
+                response = StreamingHttpResponse(
+                    ical.cached(version, ical.generate(kind, obj)),
+                    content_type='text/calendar; charset=utf-8'
+                )
+        response['ETag'] = quote_etag(version)
+        return response
+
+
+class BatchSizeMixin(object):
+    """
+    Rows per INSERT of bulk endpoints, ?batch_size=N
+    """
+    batch_size = 1000
+    max_batch_size = 5000
+
+    def get_batch_size(self, request):
+        try:
+            size = int(request.query_params['batch_size'])
+        except (KeyError, ValueError):
+            return self.batch_size
+        return max(1, min(size, self.max_batch_size))
+
 
+class MeasurementBulkView(BatchSizeMixin, APIView):
+    """
+    POST a JSON array or newline-delimited JSON (application/x-ndjson)
+    of {user, lesson, record, time} objects. Valid ones are stored
+    (?batch_size=N rows per INSERT), the rest is reported per item by
+    its 0-based index.
+    """
+    parser_classes = (JSONParser, NDJSONParser)
+
+    def post(self, request):
+        if not isinstance(request.data, list):
+            raise ParseError('Expected a list of measurements')
+        created, errors = measurements.ingest(request.data, self.get_batch_size(request))
+        return Response(
+            OrderedDict([('created', created), ('errors', errors)]),
+            status=status.HTTP_201_CREATED if created or not errors
+            else status.HTTP_400_BAD_REQUEST
+        )
+
+
+class RosterImportView(BatchSizeMixin, APIView):
+    """
+    POST a roster of ?semester=ID as CSV (with a header row), a JSON
+    array or newline-delimited JSON of {last_name, first_name,
+    middle_name, group, subgroup, course} rows, see klimr_main.roster.
+    Rows with errors are reported by their 0-based index (not counting
+    the CSV header) and skipped.
+    """
+    parser_classes = (JSONParser, NDJSONParser, CSVParser)
+
+    def post(self, request):
+        try:
+            semester = Semester.objects.get(pk=int(request.query_params['semester']))
+        except (KeyError, ValueError, Semester.DoesNotExist):
+            raise ValidationError({'semester': ['A valid semester id is required.']})
+        if not isinstance(request.data, list):
+            raise ParseError('Expected a list of rows')
+        result = roster.import_roster(request.data, semester, self.get_batch_size(request))
+        return Response(
+            result, status=status.HTTP_201_CREATED if result['rows'] or not result['errors']
+            else status.HTTP_400_BAD_REQUEST
+        )
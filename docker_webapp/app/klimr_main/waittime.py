@@ -0,0 +1,179 @@
+"""
+Expected service and waiting times of queued students, from the
+Measurements of past lessons.
+
+A record's service time is the time between its Measurement and the
+previous one of the same lesson. ServiceTimeStats keeps running sums of
+them per discipline, teacher and queue reason: add_measurements() folds
+new Measurements in with a few UPDATEs, rebuild() recomputes everything.
+The estimator built from those sums is kept in process memory until the
+sums change, so an estimate is a couple of dict lookups.
+"""
+from django.db import IntegrityError, transaction
+from django.db.models import F
+from klimr_main import caching
+from klimr_main.models import Measurement, ServiceTimeStats
+
+# Longer gaps between two measurements are breaks, not service
+MAX_SERVICE_TIME = 60 * 60
+# Used while there are no measurements at all
+DEFAULT_SERVICE_TIME = 5 * 60
+# How many samples of the wider group (e.g. all teachers of a discipline)
+# an estimate for a narrower one (a teacher) is worth
+PRIOR_WEIGHT = 5
+
+
+class Estimator(object):
+    """
+    Mean service time per (discipline, teacher, reason), each level
+    shrunk towards the one above it (discipline and reason, reason, all
+    measurements), so sparse groups don't get wild estimates
+    """
+    def __init__(self, rows):
+        # (discipline, teacher, reason, count, total) rows
+        self.sums = {}
+        for discipline, teacher, reason, count, total in rows:
+            for key in ((), (reason, ), (reason, discipline),
+                        (reason, discipline, teacher)):
+                current = self.sums.get(key, (0, 0.0))
+                self.sums[key] = (current[0] + count, current[1] + total)
+        self.cache = {}
+
+    def service_time(self, discipline_id, teacher_id, reason):
+        key = (reason, discipline_id, teacher_id)
+        result = self.cache.get(key)
+        if result is None:
+            result = DEFAULT_SERVICE_TIME
+            for i in range(len(key) + 1):
+                count, total = self.sums.get(key[:i], (0, 0.0))
+                result = (total + PRIOR_WEIGHT * result) / (count + PRIOR_WEIGHT)
+            self.cache[key] = result
+        return result
+
+    def waits(self, discipline_id, teacher_id, reasons):
+        """
+        (expected service time, expected wait before it starts) for
+        queued records with `reasons`, in queue order
+        """
+        result = []
+        wait = 0.0
+        for reason in reasons:
+            service = self.service_time(discipline_id, teacher_id, reason)
+            result.append((service, wait))
+            wait += service
+        return result
+
+
+_estimator = (None, None)
+
+
+def get_estimator():
+    global _estimator
+    version = caching.get_versions(ServiceTimeStats)
+    if _estimator[0] != version:
+        estimator = Estimator(ServiceTimeStats.objects.values_list(
+            'discipline_id', 'teacher_id', 'reason', 'count', 'total'
+        ))
+        _estimator = (version, estimator)
+    return _estimator[1]
+
+
+def queue_waits(queue):
+    """
+    {record id: (expected service time, expected wait)} for a
+    klimr_main.queues.LessonQueue
+    """
+    entries = queue.peek()
+    waits = get_estimator().waits(
+        queue.discipline_id, queue.teacher_id, [x.reason for x in entries]
+    )
+    return {x.id: y for x, y in zip(entries, waits)}
+
+
+def _service_times(rows, new=None):
+    """
+    Yield (discipline, teacher, reason, service time) from
+    (record, lesson, time, discipline, teacher, reason) rows, only for
+    (record, time) pairs in `new` if given
+    """
+    rows = sorted(rows, key=lambda x: (x[1], x[2], x[0]))
+    for previous, row in zip(rows, rows[1:]):
+        if previous[1] != row[1] or (new is not None and (row[0], row[2]) not in new):
+            continue
+        service = row[2] - previous[2]
+        if 0 < service <= MAX_SERVICE_TIME:
+            yield row[3:] + (service, )
+
+
+def _sum(service_times, sums=None):
+    sums = {} if sums is None else sums
+    for discipline, teacher, reason, service in service_times:
+        count, total = sums.get((discipline, teacher, reason), (0, 0))
+        sums[(discipline, teacher, reason)] = (count + 1, total + service)
+    return sums
+
+
+MEASUREMENT_FIELDS = (
+    'record_id', 'lesson_id', 'time', 'lesson__discipline_id',
+    'lesson__teacher_id', 'record__reason'
+)
+# Lessons per query, keeps `IN` under SQLite's variable limit
+LESSON_CHUNK_SIZE = 500
+
+
+def add_measurements(measurements):
+    """
+    Fold saved Measurements (they may come from bulk_create, so w/o an
+    id) into ServiceTimeStats. One measured before an already folded one
+    of the same lesson is counted against its predecessor, but the later
+    one isn't corrected; rebuild() is.
+    """
+    new = {(x.record_id, x.time) for x in measurements}
+    lessons = sorted({x.lesson_id for x in measurements})
+    sums = {}
+    for i in range(0, len(lessons), LESSON_CHUNK_SIZE):
+        rows = Measurement.objects.filter(
+            lesson__in=lessons[i:i + LESSON_CHUNK_SIZE]
+        ).values_list(*MEASUREMENT_FIELDS)
+        _sum(_service_times(rows, new), sums)
+    for (discipline, teacher, reason), (count, total) in sums.items():
+        stats = ServiceTimeStats.objects.filter(
+            discipline=discipline, teacher=teacher, reason=reason
+        )
+        changes = {
+            'count': F('count') + count,
+            'total': F('total') + total,
+        }
+        if stats.update(**changes):
+            continue
+        try:
+            with transaction.atomic():
+                ServiceTimeStats.objects.create(
+                    discipline_id=discipline, teacher_id=teacher, reason=reason,
+                    count=count, total=total
+                )
+        except IntegrityError:
+            # Created concurrently
+            stats.update(**changes)
+    if sums:
+        caching.bump_version(ServiceTimeStats)
+
+
+def rebuild():
+    """
+    Recompute ServiceTimeStats from all Measurements, returns the
+    number of rows
+    """
+    rows = Measurement.objects.values_list(*MEASUREMENT_FIELDS).iterator()
+    sums = _sum(_service_times(rows))
+    with transaction.atomic():
+        ServiceTimeStats.objects.all().delete()
+        ServiceTimeStats.objects.bulk_create([
+            ServiceTimeStats(
+                discipline_id=discipline, teacher_id=teacher, reason=reason,
+                count=count, total=total
+            )
+            for (discipline, teacher, reason), (count, total) in sums.items()
+        ])
+    caching.bump_version(ServiceTimeStats)
+    return len(sums)